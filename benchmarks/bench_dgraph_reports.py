@@ -0,0 +1,88 @@
+"""
+Per-call vs multi-block post performance report against a running Dgraph.
+
+    python benchmarks/bench_dgraph_reports.py --host localhost:9080 --k 5 --runs 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dgraph_model import DgraphModel
+from dgraph_reports import PostPerformanceReport, CONTENT_LENGTH_BANDS
+
+
+def per_call_report(model, k):
+    """One round trip per metric plus a paged retention scan aggregated in Python."""
+    groups = model.queries.query("{ metrics(func: has(metric)) @groupby(metric) { count: count(uid) } }")
+    metrics = [row["metric"] for group in groups.get("metrics", []) for row in group.get("@groupby", [])]
+    top_query = """
+        query top($metric: string, $k: int) {
+            top(func: eq(metric, $metric), orderdesc: engagement_count, first: $k) {
+                uid
+                post_id
+                engagement_count
+            }
+        }
+    """
+    top_posts = {metric: model.queries.query(top_query, {"$metric": metric, "$k": k}).get("top", [])
+                 for metric in metrics}
+    retention_query = """
+        query retention($first: int, $after: string) {
+            posts(func: has(retention_time), first: $first, after: $after) {
+                uid
+                content_length
+                retention_time
+                engagement_count
+            }
+        }
+    """
+    bands = [[0, 0.0, 0.0] for _ in CONTENT_LENGTH_BANDS[:-1]]
+    for node in model.queries.paginate(retention_query, "posts"):
+        length = node.get("content_length", 0)
+        for index in range(len(bands)):
+            if CONTENT_LENGTH_BANDS[index] <= length < CONTENT_LENGTH_BANDS[index + 1]:
+                engagement = node.get("engagement_count", 0)
+                bands[index][0] += 1
+                bands[index][1] += node["retention_time"] * engagement
+                bands[index][2] += engagement
+    return top_posts, bands
+
+
+def timed(function, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="localhost:9080")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    model = DgraphModel(args.host)
+    model.connect_to_dgraph()
+    report = PostPerformanceReport(model.queries)
+    report.run(args.k)  # warm up the metric list
+
+    results = {
+        "per-call": timed(lambda: per_call_report(model, args.k), args.runs),
+        "multi-block": timed(lambda: report.run(args.k), args.runs),
+        "multi-block cached": timed(lambda: model._post_report(args.k), args.runs),
+    }
+    for name, samples in results.items():
+        print(f"{name:>20}: median {statistics.median(samples) * 1000:8.2f} ms, "
+              f"p90 {sorted(samples)[int(len(samples) * 0.9) - 1] * 1000:8.2f} ms")
+    model.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+CSR construction and PageRank on synthetic power-law engagement graphs.
+
+    python benchmarks/bench_pagerank.py --edges 100000 1000000 10000000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dgraph_influence import CSRGraph, pagerank
+
+
+def synthetic_edges(n_edges, rng):
+    # roughly one user per ten engagements, authors drawn from a Zipf distribution
+    n_nodes = max(2, n_edges // 10)
+    sources = rng.integers(0, n_nodes, n_edges, dtype=np.int32)
+    targets = ((rng.zipf(1.8, n_edges) - 1) % n_nodes).astype(np.int32)
+    return sources, targets, n_nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--edges", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'edges':>12} {'nodes':>10} {'build s':>9} {'rank s':>9} {'iters':>6} {'peak MB':>9} {'B/edge':>7}")
+    for n_edges in args.edges:
+        sources, targets, n_nodes = synthetic_edges(n_edges, rng)
+        tracemalloc.start()
+        start = time.perf_counter()
+        graph = CSRGraph.from_edges(sources, targets, n_nodes)
+        built = time.perf_counter()
+        _, iterations = pagerank(graph)
+        ranked = time.perf_counter()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{n_edges:>12} {n_nodes:>10} {built - start:>9.3f} {ranked - built:>9.3f} {iterations:>6} "
+              f"{peak / 2 ** 20:>9.1f} {peak / n_edges:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
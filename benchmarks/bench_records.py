@@ -0,0 +1,120 @@
+"""
+Memory and build rate of the row representations used by the large scans.
+
+The same columns (shared values, so only the per-row containers are measured)
+are turned into dicts, regular objects, named tuples (the driver's default
+rows), __slots__ records and plain tuples (the TUPLE_ROWS scans). Retained
+bytes come from tracemalloc, the rate from a second, untraced build. The mongo
+rows build insert documents through Post records and straight from the
+synthetic columns.
+
+    python benchmarks/bench_records.py --count 1000000
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from records import Post, Record, documents
+from synthetic import SyntheticDataset
+
+
+class PlainLike:
+    def __init__(self, post_id, user_id, timestamp):
+        self.post_id = post_id
+        self.user_id = user_id
+        self.timestamp = timestamp
+
+
+class Like(Record):
+    __slots__ = ("post_id", "user_id", "timestamp")
+
+    def __init__(self, post_id, user_id, timestamp):
+        self.post_id = post_id
+        self.user_id = user_id
+        self.timestamp = timestamp
+
+
+LikeRow = namedtuple("LikeRow", "post_id user_id timestamp")
+
+BUILDERS = {
+    "dict": lambda columns: [{"post_id": post_id, "user_id": user_id, "timestamp": timestamp}
+                             for post_id, user_id, timestamp in zip(*columns)],
+    "object": lambda columns: [PlainLike(*values) for values in zip(*columns)],
+    "namedtuple": lambda columns: [LikeRow(*values) for values in zip(*columns)],
+    "slots": lambda columns: [Like(*values) for values in zip(*columns)],
+    "tuple": lambda columns: list(zip(*columns)),
+}
+
+
+def like_columns(count, users=10_000):
+    posts = [uuid.UUID(int=index + 1) for index in range(max(1, count // 3))]
+    people = [uuid.UUID(int=(index + 1) << 64) for index in range(users)]
+    start = datetime(2024, 1, 1)
+    times = [start + timedelta(seconds=second) for second in range(86_400)]
+    return ([posts[index % len(posts)] for index in range(count)],
+            [people[(index * 7) % users] for index in range(count)],
+            [times[index % len(times)] for index in range(count)])
+
+
+def measure(build):
+    """(retained bytes, seconds) of a build."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    # timed like timeit, without collections triggered by the other representations' garbage
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        result = build()
+        seconds = time.perf_counter() - start
+    finally:
+        gc.enable()
+    del result
+    return retained, seconds
+
+
+def report(count, name, retained, seconds):
+    print(f"{name:<20} {retained / 2 ** 20:>9.1f} {retained / count:>9.1f} {seconds:>9.2f} {count / seconds:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=1_000_000, help="records per representation")
+    parser.add_argument("--skip-mongo", action="store_true", help="only the row representations")
+    args = parser.parse_args()
+    count = args.count
+
+    print(f"{'representation':<20} {'MiB':>9} {'bytes/row':>9} {'seconds':>9} {'rows/s':>12}")
+    columns = like_columns(count)
+    for name, build in BUILDERS.items():
+        report(count, name, *measure(lambda: build(columns)))
+    del columns
+    if args.skip_mongo:
+        return
+
+    chunk = next(SyntheticDataset(users=max(1, count // 10), posts=count, chunk_size=count, seed=42).posts())
+    builders = {
+        "mongo Post.to_dict": lambda: [Post(title, text, username, creation_date).to_dict() for title, text, username,
+                                       creation_date in zip(chunk["title"], chunk["content"], chunk["username"],
+                                                            chunk["timestamp"])],
+        "mongo documents": lambda: documents(Post, chunk, text="content", creation_date="timestamp"),
+    }
+    for name, build in builders.items():
+        report(count, name, *measure(build))
+
+
+if __name__ == "__main__":
+    main()
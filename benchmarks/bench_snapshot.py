@@ -0,0 +1,74 @@
+"""
+Columnar snapshot export and the offline NumPy kernels against the row-by-row
+Cassandra analytics, both fed by the fake Cassandra session. The analytics
+in SAME_ROWS read the same synthetic rows both ways and their results are
+checked to match; the fake session makes up every statement's columns on their
+own, so the other analytics' tables do not line up and are only timed.
+
+    python benchmarks/bench_snapshot.py --scales 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import snapshot_analytics
+from cassandra_model import CassandraModel
+from snapshot import Snapshot, export_snapshot
+from stand_ins import FakeCassandraSession
+
+ANALYTICS = ("follower_number_analysis", "user_interaction_patterns", "trend_analysis_of_topics",
+             "follower_to_engagement_ratio", "average_response_time_to_comments", "time_to_first_engagement",
+             "top_shared_posts")
+# how the rows of each checked analytic are compared: top_shared_posts breaks share_count ties in any order
+SAME_ROWS = {
+    "follower_number_analysis": lambda row: sorted(row.items()),
+    "follower_to_engagement_ratio": lambda row: sorted(row.items()),
+    "top_shared_posts": lambda row: row["share_count"],
+}
+
+
+def timed(function, *args, **kwargs):
+    """(seconds, result) of a call."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def check_rows(name, kernel_rows, method_rows):
+    key = SAME_ROWS.get(name)
+    if key is not None:
+        assert sorted(map(key, kernel_rows)) == sorted(map(key, method_rows)), f"{name}: kernel rows differ"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--skip-rows", action="store_true", help="only time the kernels")
+    args = parser.parse_args()
+
+    print(f"{'scale':>9} {'analytic':<36} {'rows s':>9} {'kernel s':>9} {'speedup':>8}")
+    for scale in args.scales:
+        model = CassandraModel()
+        model.session = FakeCassandraSession(scale)
+        model.cache.enabled = False
+        with tempfile.TemporaryDirectory() as directory:
+            export_seconds, _ = timed(export_snapshot, model.session, directory)
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+            print(f"{scale:>9} {'export':<36} {export_seconds:>9.3f} {size / 2 ** 20:>8.1f}M")
+            snapshot = Snapshot(directory)
+            for name in ANALYTICS:
+                kernel, kernel_rows = timed(getattr(snapshot_analytics, name), snapshot)
+                if args.skip_rows:
+                    print(f"{scale:>9} {name:<36} {'-':>9} {kernel:>9.3f}")
+                    continue
+                rows, method_rows = timed(getattr(model, name), show=False)
+                check_rows(name, kernel_rows, method_rows)
+                print(f"{scale:>9} {name:<36} {rows:>9.3f} {kernel:>9.3f} {rows / kernel:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
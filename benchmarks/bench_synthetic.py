@@ -0,0 +1,74 @@
+"""
+Synthetic dataset generation and loading into the Cassandra and Dgraph stand-ins.
+
+The digest column identifies the generated data: the same seed and sizes give
+the same digest on every machine, so results of different runs are comparable.
+
+    python benchmarks/bench_synthetic.py --scales 100000 1000000 --seed 42
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cassandra_model import CassandraModel
+from dgraph_model import DgraphModel
+from stand_ins import FakeCassandraSession, StubDgraphClient
+from synthetic import SyntheticDataset
+
+USERS_PER_POST = 0.1
+
+
+def generate(dataset):
+    """Rows generated and a digest of the post and engagement ids."""
+    digest = hashlib.sha1()
+    rows = 0
+    for chunk in dataset.users():
+        rows += len(chunk["index"])
+    for chunk in dataset.posts():
+        engagement = dataset.engagement(chunk)
+        rows += len(chunk["index"]) + sum(len(columns["post"]) for columns in engagement.values())
+        digest.update(b"".join(post_id.bytes for post_id in chunk["post_id"]))
+        digest.update(b"".join(user_id.bytes for user_id in engagement["likes"]["user_id"]))
+    return rows, digest.hexdigest()[:12]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000], help="posts per run")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-load", action="store_true", help="only time the generation")
+    args = parser.parse_args()
+
+    print(f"{'posts':>9} {'step':<10} {'seconds':>9} {'rows/s':>11} {'digest':>13}")
+    for scale in args.scales:
+        def dataset():
+            return SyntheticDataset(users=max(1, int(scale * USERS_PER_POST)), posts=scale, seed=args.seed)
+
+        start = time.perf_counter()
+        rows, digest = generate(dataset())
+        seconds = time.perf_counter() - start
+        print(f"{scale:>9} {'generate':<10} {seconds:>9.2f} {rows / seconds:>11.0f} {digest:>13}")
+        if args.skip_load:
+            continue
+
+        cassandra = CassandraModel()
+        cassandra.session = FakeCassandraSession(1)
+        start = time.perf_counter()
+        cassandra.load_dataset(dataset())
+        seconds = time.perf_counter() - start
+        print(f"{scale:>9} {'cassandra':<10} {seconds:>9.2f} {len(cassandra.session.statements) / seconds:>11.0f}")
+
+        dgraph = DgraphModel()
+        dgraph.attach_client(StubDgraphClient(1))
+        start = time.perf_counter()
+        nodes = dgraph.populate_database(dataset()) + scale + int(scale * USERS_PER_POST)
+        seconds = time.perf_counter() - start
+        print(f"{scale:>9} {'dgraph':<10} {seconds:>9.2f} {nodes / seconds:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
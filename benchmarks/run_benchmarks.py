@@ -0,0 +1,268 @@
+"""
+Benchmark every menu operation against in-process stand-ins.
+
+    python benchmarks/run_benchmarks.py --scales 10000 100000 --output bench.json
+    python benchmarks/run_benchmarks.py --scales 10000 --compare bench.json
+
+Mongo runs on mongomock, Cassandra on a fake session that replays synthetic
+rows, Dgraph on a stub client. For each operation and scale it reports the
+median/p90 latency, rows handled per second, round trips and peak traced
+memory. `--compare` flags operations whose latency or round trips grew.
+"""
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import mongomock
+
+from cassandra_model import CassandraModel
+from dgraph_model import DgraphModel
+from mongo_model import MongoModel
+from stand_ins import FakeCassandraSession, StubDgraphClient, CountingCollection, BASE_TIME, sample_text
+
+DEFAULT_SCALES = (10_000, 100_000, 1_000_000)
+MONGO_USERS_PER_POST = 0.1
+
+
+class Operation:
+    def __init__(self, name, store, call, inputs=(), setup=None, destructive=False):
+        self.name = name
+        self.store = store
+        self.call = call
+        self.inputs = inputs
+        self.setup = setup
+        self.destructive = destructive
+
+
+def _login(models, run):
+    models["mongo"].current_username = "user0"
+
+
+def _throwaway_user(models, run):
+    models["mongo"].users_collection.insert_one({"username": f"throwaway{run}", "password": "x",
+                                                 "language": "eng", "notifications": "on"})
+    models["mongo"].current_username = f"throwaway{run}"
+
+
+def _own_post(models, run):
+    models["mongo"].current_username = "user0"
+    models["mongo"].posts_collection.insert_one({"title": f"bench delete {run}", "text": "x", "username": "user0",
+                                                 "creation_date": BASE_TIME})
+
+
+def _logged_out(models, run):
+    models["mongo"].current_username = None
+
+
+OPERATIONS = [
+    Operation("create_user", "mongo", lambda m: m["mongo"].create_user(), lambda run: [f"bench{run}", "pw"]),
+    Operation("delete_user", "mongo", lambda m: m["mongo"].delete_user(), lambda run: ["yes"], _throwaway_user),
+    Operation("login", "mongo", lambda m: m["mongo"].login(), lambda run: ["user1", "pw1"], _logged_out),
+    Operation("logout", "mongo", lambda m: m["mongo"].logout(), setup=_login),
+    Operation("change_password", "mongo", lambda m: m["mongo"].change_password(), lambda run: ["pw0", "pw0"], _login),
+    Operation("change_notifications", "mongo", lambda m: m["mongo"].change_notifications(), lambda run: ["off"],
+              _login),
+    Operation("change_language", "mongo", lambda m: m["mongo"].change_language(), lambda run: ["esp"], _login),
+    Operation("most_used_language", "mongo", lambda m: m["mongo"].most_used_language()),
+    Operation("create_post", "mongo", lambda m: m["mongo"].create_post(), lambda run: [f"bench post {run}", "text"],
+              _login),
+    Operation("delete_a_post", "mongo", lambda m: m["mongo"].delete_a_post(), lambda run: [f"bench delete {run}"],
+              _own_post),
+    Operation("see_your_posts", "mongo", lambda m: m["mongo"].see_your_posts(), lambda run: ["20"], _login),
+    Operation("see_posts_from_people", "mongo", lambda m: m["mongo"].see_posts_from_people(), lambda run: ["20"],
+              _login),
+    Operation("get_list_of_users", "mongo", lambda m: m["mongo"].get_list_of_users()),
+    Operation("populate_database", "mongo", lambda m: m["mongo"].populate_database()),
+    Operation("clean_database", "mongo", lambda m: m["mongo"].clean_database(), destructive=True),
+
+    Operation("follower_number_analysis", "cassandra", lambda m: m["cassandra"].follower_number_analysis()),
+    Operation("user_interaction_patterns", "cassandra", lambda m: m["cassandra"].user_interaction_patterns()),
+    Operation("trend_analysis_of_topics", "cassandra", lambda m: m["cassandra"].trend_analysis_of_topics()),
+    Operation("user_sentiment_analysis", "cassandra", lambda m: m["cassandra"].user_sentiment_analysis()),
+    Operation("content_type_performance", "cassandra", lambda m: m["cassandra"].content_type_performance()),
+    Operation("most_engaging_post_types", "cassandra", lambda m: m["cassandra"].most_engaging_post_types("music")),
+    Operation("keyword_influence_on_engagement", "cassandra",
+              lambda m: m["cassandra"].keyword_influence_on_engagement()),
+    Operation("follower_to_engagement_ratio", "cassandra", lambda m: m["cassandra"].follower_to_engagement_ratio()),
+    Operation("average_response_time_to_comments", "cassandra",
+              lambda m: m["cassandra"].average_response_time_to_comments()),
+    Operation("time_to_first_engagement", "cassandra", lambda m: m["cassandra"].time_to_first_engagement()),
+    Operation("top_shared_posts", "cassandra", lambda m: m["cassandra"].top_shared_posts()),
+    Operation("populate_cassandra", "cassandra", lambda m: m["cassandra"].populate_database()),
+
+    Operation("analyze_platform_usage", "dgraph", lambda m: m["dgraph"].analyze_platform_usage()),
+    Operation("view_daily_engagement_trends", "dgraph", lambda m: m["dgraph"].view_daily_engagement_trends()),
+    Operation("view_weekly_engagement_trends", "dgraph", lambda m: m["dgraph"].view_weekly_engagement_trends()),
+    Operation("view_monthly_engagement_trends", "dgraph", lambda m: m["dgraph"].view_monthly_engagement_trends()),
+    Operation("view_yearly_engagement_trends", "dgraph", lambda m: m["dgraph"].view_yearly_engagement_trends()),
+    Operation("cluster_users_by_interests", "dgraph", lambda m: m["dgraph"].cluster_users_by_interests()),
+    Operation("identify_inactive_users", "dgraph", lambda m: m["dgraph"].identify_inactive_users(90)),
+    Operation("analyze_post_retention", "dgraph", lambda m: m["dgraph"].analyze_post_retention()),
+    Operation("find_top_performing_post", "dgraph", lambda m: m["dgraph"].find_top_performing_post()),
+    Operation("rollup_engagement_trends", "dgraph", lambda m: m["dgraph"].rollup_engagement_trends()),
+    Operation("refresh_interest_clusters", "dgraph", lambda m: m["dgraph"].refresh_interest_clusters(True)),
+    Operation("record_inactive_users", "dgraph", lambda m: m["dgraph"].record_inactive_users(90)),
+    Operation("rank_influencers", "dgraph", lambda m: m["dgraph"].rank_influencers()),
+]
+
+
+def build_models(scale):
+    mongo = MongoModel(client=mongomock.MongoClient())
+    users = max(1, int(scale * MONGO_USERS_PER_POST))
+    mongo.users_collection.insert_many([
+        {"username": f"user{index}", "password": f"pw{index}", "creation_date": BASE_TIME,
+         "notifications": "on", "language": ("eng", "esp")[index % 2]} for index in range(users)])
+    mongo.posts_collection.insert_many([
+        {"title": f"post {index}", "text": sample_text(index), "username": f"user{index % users}",
+         "creation_date": BASE_TIME} for index in range(scale)])
+    mongo.users_collection = CountingCollection(mongo.users_collection)
+    mongo.posts_collection = CountingCollection(mongo.posts_collection)
+
+    cassandra = CassandraModel()
+    cassandra.session = FakeCassandraSession(scale)
+
+    dgraph = DgraphModel()
+    dgraph.attach_client(StubDgraphClient(scale))
+    # repeats measure the computation, not result cache hits
+    for model in (mongo, cassandra, dgraph):
+        model.cache.enabled = False
+    return {"mongo": mongo, "cassandra": cassandra, "dgraph": dgraph}
+
+
+def _counters(models, store):
+    if store == "mongo":
+        collections = (models["mongo"].users_collection, models["mongo"].posts_collection)
+        return sum(c.round_trips for c in collections), sum(c.rows for c in collections)
+    backend = models["cassandra"].session if store == "cassandra" else models["dgraph"].client
+    return backend.round_trips, backend.rows
+
+
+def _reset(models, store):
+    if store == "mongo":
+        for collection in (models["mongo"].users_collection, models["mongo"].posts_collection):
+            collection.round_trips = collection.rows = 0
+    else:
+        (models["cassandra"].session if store == "cassandra" else models["dgraph"].client).reset_counters()
+
+
+def _invoke(operation, models, run, traced):
+    if operation.setup:
+        operation.setup(models, run)
+    answers = iter(operation.inputs(run) if callable(operation.inputs) else operation.inputs)
+    _reset(models, operation.store)
+    original_input = builtins.input
+    builtins.input = lambda prompt="": next(answers)
+    if traced:
+        tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            operation.call(models)
+            elapsed = time.perf_counter() - start
+    finally:
+        peak = tracemalloc.get_traced_memory()[1] if traced else 0
+        if traced:
+            tracemalloc.stop()
+        builtins.input = original_input
+    return elapsed, peak
+
+
+def run_operation(operation, models, repeat):
+    """Time `repeat` untraced runs, then measure peak memory in one extra traced run."""
+    latencies = []
+    round_trips = rows = peak = 0
+    runs = [False] * repeat + [True] if not operation.destructive else [True]
+    for run, traced in enumerate(runs):
+        elapsed, run_peak = _invoke(operation, models, run, traced)
+        if not traced or operation.destructive:
+            latencies.append(elapsed)
+        peak = max(peak, run_peak)
+        run_trips, run_rows = _counters(models, operation.store)
+        # cached results make later runs cheaper, report the worst run
+        round_trips, rows = max(round_trips, run_trips), max(rows, run_rows)
+
+    median = statistics.median(latencies)
+    return {
+        "operation": operation.name,
+        "store": operation.store,
+        "latency_ms": {"median": median * 1000, "p90": sorted(latencies)[max(0, int(len(latencies) * 0.9) - 1)] * 1000,
+                       "min": min(latencies) * 1000},
+        "rows": rows,
+        "rows_per_s": rows / median if median else 0.0,
+        "round_trips": round_trips,
+        "peak_mb": peak / 2 ** 20,
+    }
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as baseline_file:
+        baseline = {(r["operation"], r["scale"]): r for r in json.load(baseline_file)["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get((result["operation"], result["scale"]))
+        if before is None:
+            continue
+        if result["round_trips"] > before["round_trips"]:
+            regressions.append(f"{result['operation']}@{result['scale']}: round trips "
+                               f"{before['round_trips']} -> {result['round_trips']}")
+        if result["latency_ms"]["median"] > before["latency_ms"]["median"] * (1 + threshold):
+            regressions.append(f"{result['operation']}@{result['scale']}: median latency "
+                               f"{before['latency_ms']['median']:.1f} -> {result['latency_ms']['median']:.1f} ms")
+    return regressions
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", help="operation names to run")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative latency growth")
+    args = parser.parse_args()
+
+    operations = [op for op in OPERATIONS if not args.only or op.name in args.only]
+    operations.sort(key=lambda op: op.destructive)
+    results = []
+    for scale in args.scales:
+        models = build_models(scale)
+        for operation in operations:
+            result = run_operation(operation, models, args.repeat)
+            result["scale"] = scale
+            results.append(result)
+            print(f"{scale:>9} {operation.store:>9} {operation.name:<36} "
+                  f"{result['latency_ms']['median']:>10.2f} ms {result['round_trips']:>9} trips "
+                  f"{result['rows_per_s']:>12.0f} rows/s {result['peak_mb']:>8.1f} MB")
+
+    report = {"commit": _commit(), "python": platform.python_version(), "results": results}
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
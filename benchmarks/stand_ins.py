@@ -0,0 +1,341 @@
+"""
+In-process stand-ins for Cassandra, Dgraph and MongoDB.
+
+They record every round trip and replay synthetic rows sized by `scale`, so
+the client-side cost of an operation (row handling, aggregation, printing,
+number of round trips) can be measured without a running cluster.
+"""
+import json
+import re
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+
+from cassandra_model import TUPLE_ROWS
+
+WORDS = ("data graph social post share like comment trend music sport travel food code python "
+         "cassandra mongo dgraph cloud photo video news game art book movie").split()
+BASE_TIME = datetime(2024, 1, 1)
+
+
+def sample_text(index, words=12):
+    return " ".join(WORDS[(index * 7 + position * 3) % len(WORDS)] for position in range(words))
+
+
+class TableSizes:
+    """Row counts per table derived from the number of posts."""
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.users = max(1, scale // 10)
+        self.tables = {
+            "users": self.users,
+            "posts": scale,
+            "user_posts": scale,
+            "comments": scale * 3,
+            "post_comments": scale * 3,
+            "likes": scale * 3,
+            "shares": scale,
+            "user_activity": scale * 5,
+            "tags": len(WORDS),
+            "posts_by_tag": max(1, scale // len(WORDS)),
+            "tag_popularity": len(WORDS),
+            "top_shared_posts": scale,
+        }
+
+
+# Cassandra
+
+_SELECT = re.compile(r"select\s+(?P<columns>.+?)\s+from\s+(?:\w+\.)?(?P<table>\w+)(?P<rest>.*)", re.I | re.S)
+_LIMIT = re.compile(r"limit\s+(\d+)", re.I)
+_GROUP_BY = re.compile(r"group\s+by\s+(\w+)", re.I)
+_TOKEN_RANGE = re.compile(r"token\(\w+\)\s*>", re.I)
+TOKEN_RING = 2 ** 64
+
+
+class FakeResult:
+    def __init__(self, rows, counter):
+        self._rows = rows
+        self._counter = counter
+
+    def __iter__(self):
+        for row in self._rows:
+            self._counter.rows += 1
+            yield row
+
+    def one(self):
+        return next(iter(self), None)
+
+    def all(self):
+        return list(self)
+
+
+class FakeCassandraSession:
+    """Records statements and replays synthetic rows for the selected columns."""
+
+    def __init__(self, scale):
+        self.sizes = TableSizes(scale)
+        self.statements = []
+        self.rows = 0
+        self._row_types = {}
+
+    @property
+    def round_trips(self):
+        return len(self.statements)
+
+    def reset_counters(self):
+        self.statements = []
+        self.rows = 0
+
+    def set_keyspace(self, keyspace):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def prepare(self, query):
+        return query
+
+    def execute(self, query, parameters=None, **kwargs):
+        query = getattr(query, "query_string", query)
+        self.statements.append(query)
+        match = _SELECT.match(query.strip())
+        if match is None:
+            return FakeResult([], self)
+        columns = [self._alias(column) for column in _split_columns(match.group("columns"))]
+        start, count = self._row_count(match.group("table"), match.group("rest"), parameters)
+        rows = self._generate(match.group("table"), columns, start, count,
+                              kwargs.get("execution_profile") == TUPLE_ROWS)
+        return FakeResult(rows, self)
+
+    def execute_async(self, query, parameters=None, **kwargs):
+        return _Future(self.execute(query, parameters, **kwargs))
+
+    def _row_count(self, table, rest, parameters=None):
+        """(first row index, row count) of a statement."""
+        count = self.sizes.tables.get(table, self.sizes.scale)
+        group_by = _GROUP_BY.search(rest)
+        if group_by:
+            count = self.sizes.users if group_by.group(1) == "user_id" else self.sizes.scale
+        if re.search(r"where\s+(post_id|user_id)\s*=", rest, re.I):
+            count = max(1, count // max(1, self.sizes.tables.get("posts", 1)))
+        limit = _LIMIT.search(rest)
+        if limit:
+            count = min(count, int(limit.group(1)))
+        if _TOKEN_RANGE.search(rest) and parameters:
+            # rows are spread evenly over the token ring, a range gets its share of them
+            low, high = (int(count * (bound + TOKEN_RING // 2) / TOKEN_RING) for bound in parameters)
+            return low, high - low
+        return 0, count
+
+    @staticmethod
+    def _alias(column):
+        parts = re.split(r"\s+as\s+", column.strip(), flags=re.I)
+        return parts[-1].strip()
+
+    def _generate(self, table, columns, start, count, tuples=False):
+        key = tuple(columns)
+        if key not in self._row_types:
+            self._row_types[key] = namedtuple("Row", columns, rename=True)
+        row_type = self._row_types[key]
+        users = self.sizes.users
+        for index in range(start, start + count):
+            values = (_value(column, index, users) for column in columns)
+            yield tuple(values) if tuples else row_type(*values)
+
+
+def _split_columns(columns):
+    depth, current, parts = 0, "", []
+    for char in columns:
+        depth += char == "("
+        depth -= char == ")"
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+def _value(column, index, users):
+    if column == "user_id":
+        return uuid.UUID(int=index % users + 1)
+    if column.endswith("_id"):
+        return uuid.UUID(int=(index + 1) << 64)
+    if column.endswith("count"):
+        return (index * 37) % 1000
+    if "timestamp" in column or column in ("first_engagement_time", "joined_date", "last_used"):
+        offset = 3600 if "comment" in column else 0
+        return BASE_TIME + timedelta(seconds=index + offset)
+    if column == "content":
+        return sample_text(index)
+    if column == "tags":
+        return {WORDS[index % len(WORDS)], WORDS[(index * 5) % len(WORDS)]}
+    if column == "type":
+        return ("post", "comment", "like")[index % 3]
+    return f"{column}-{index}"
+
+
+class _Future:
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
+
+
+# Dgraph
+
+_BLOCK = re.compile(r"(?P<name>\w+)\s*\((?P<args>[^{}]*)\)\s*(?P<directives>(?:@\w+(?:\([^{}]*?\))?\s*)*)\{",
+                    re.S)
+_AGGREGATE = re.compile(r"(\w+)\s*:\s*(?:avg|sum|min|max)\(")
+
+
+class _Response:
+    def __init__(self, payload, uids=None):
+        self.json = json.dumps(payload).encode("utf-8")
+        self.uids = uids or {}
+
+
+class StubDgraphTxn:
+    def __init__(self, client):
+        self.client = client
+
+    def query(self, query, variables=None, timeout=None, **kwargs):
+        self.client.round_trips += 1
+        payload = self.client.answer(query, variables or {})
+        self.client.rows += sum(len(nodes) for nodes in payload.values())
+        return _Response(payload)
+
+    def mutate(self, set_obj=None, del_obj=None, commit_now=None, **kwargs):
+        self.client.round_trips += 1
+        self.client.mutations += 1
+        uids = {}
+        for node in (set_obj if isinstance(set_obj, list) else [set_obj] if set_obj else []):
+            uid = node.get("uid", "")
+            if uid.startswith("_:"):
+                uids[uid[2:]] = hex(0x100000 + len(uids))
+        return _Response({}, uids)
+
+    def commit(self, timeout=None, **kwargs):
+        self.client.round_trips += 1
+
+    def discard(self):
+        pass
+
+
+class StubDgraphClient:
+    """Answers the query shapes used by DgraphModel with synthetic nodes."""
+
+    def __init__(self, scale):
+        self.sizes = TableSizes(scale)
+        self.round_trips = 0
+        self.mutations = 0
+        self.rows = 0
+
+    def reset_counters(self):
+        self.round_trips = 0
+        self.mutations = 0
+        self.rows = 0
+
+    def txn(self, read_only=False, best_effort=False, **kwargs):
+        return StubDgraphTxn(self)
+
+    def alter(self, operation, timeout=None, **kwargs):
+        self.round_trips += 1
+
+    def answer(self, query, variables):
+        payload = {}
+        for block in _BLOCK.finditer(query):
+            name, args, directives = block.group("name"), block.group("args"), block.group("directives")
+            if name in ("query", "var") or not args.strip():
+                continue
+            body = query[block.end():query.find("}", block.end())]
+            payload[name] = self._block(name, args, directives, body, variables)
+        for name in re.findall(r"(\w+)\(\)\s*\{", query):
+            body = query[query.find(name + "()"):]
+            payload[name] = [{alias: 1.0} for alias in _AGGREGATE.findall(body[:body.find("}")])]
+        return payload
+
+    def _block(self, name, args, directives, body, variables):
+        scale = self.sizes.scale
+        if "@groupby" in directives:
+            key = re.search(r"@groupby\((\w+)\)", directives).group(1)
+            return [{"@groupby": [{key: f"{key}-{index}", "count": scale // 4} for index in range(4)]}]
+        if body.strip().startswith("count(uid)"):
+            return [{"count": scale}]
+        if "eq(" in args and "metric" not in args:
+            return []
+        if "type(Cluster)" in args:
+            total = 8
+        elif "between(" in args:
+            total = 365
+        elif "le(last_active" in args:
+            total = scale // 3
+        elif "eq(metric" in args:
+            total = int(variables.get("$k", 5))
+        else:
+            total = scale
+        first = int(variables.get("$first", total))
+        after = int(variables.get("$after", "0x0"), 16)
+        return [self._node(index) for index in islice(range(after, total), first)]
+
+    def _node(self, index):
+        timestamp = (BASE_TIME + timedelta(minutes=index)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return {
+            "uid": hex(index + 1), "user_id": f"user-{index}", "name": f"User {index}", "post_id": f"post-{index}",
+            "daily_usage": index % 24 / 3, "weekly_usage": index % 70 / 2, "monthly_usage": index % 300 / 2,
+            "yearly_usage": float(index % 3000), "interests": [WORDS[index % len(WORDS)], WORDS[index * 3 % len(WORDS)]],
+            "last_active": timestamp, "timestamp": timestamp, "metric": "likes", "engagement_count": index % 500,
+            "retention_time": index % 600 / 10, "content_length": index % 1000,
+            "user": {"uid": hex(index % self.sizes.users + 1)},
+            "post": {"user": {"uid": hex(index * 7 % self.sizes.users + 1)}},
+            "day": 20240101 + index % 28, "week": 202401 + index % 52, "month": 202401 + index % 12, "year": 2024,
+            "cluster_id": f"cluster-{index}", "interest_keywords": WORDS[:3], "representative_users": [],
+            "cluster_size": index,
+        }
+
+
+# MongoDB
+
+class CountingCursor:
+    def __init__(self, cursor, collection):
+        self._cursor = cursor
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if name in ("sort", "limit", "skip", "batch_size", "hint"):
+            return lambda *args, **kwargs: CountingCursor(attribute(*args, **kwargs), self._collection)
+        return attribute
+
+    def __iter__(self):
+        for document in self._cursor:
+            self._collection.rows += 1
+            yield document
+
+
+class CountingCollection:
+    """Wraps a (mongomock) collection and counts round trips and documents returned."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.round_trips = 0
+        self.rows = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def counted(*args, **kwargs):
+            self.round_trips += 1
+            result = attribute(*args, **kwargs)
+            if name in ("find", "aggregate"):
+                return CountingCursor(result, self)
+            if name == "find_one" and result is not None:
+                self.rows += 1
+            return result
+        return counted
@@ -1,20 +1,67 @@
-from collections import defaultdict
-from cassandra.cluster import Cluster
-from cassandra.query import SimpleStatement
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import heapq
+from cassandra.cluster import EXEC_PROFILE_DEFAULT, Cluster, ExecutionProfile
+from cassandra.query import SimpleStatement, tuple_factory
 from textblob import TextBlob
-import uuid
-from datetime import datetime, timedelta
-from faker import Faker
+from datetime import timedelta
+import numpy as np
 import random
 
+from records import Columns
+from result_cache import ResultCache, cached
+from synthetic import SyntheticDataset, rows as columns_of
+from sketches import CountMinSketch, HeavyHitters, HyperLogLog, ReservoirSample, cluster_total, hash64, proportion_interval
+
+# Approximate analytics scan the Murmur3 token ring of post_id in TOKEN_SPLITS ranges.
+# Sampled queries read SAMPLE_RANGES of them picked at random, about 3% of every table.
+TOKEN_MIN = -2 ** 63
+TOKEN_SPLITS = 1024
+SAMPLE_RANGES = 32
+SCAN_WORKERS = 8
+# rows per page of the full-table scans read page by page
+SCAN_FETCH_SIZE = 5000
+SENTIMENT_SAMPLE = 400
+WRITE_CONCURRENCY = 64
+TABLES = ("users", "posts", "user_posts", "comments", "post_comments", "likes", "tags", "user_activity", "shares",
+          "posts_by_tag", "tag_popularity", "top_shared_posts")
+# TRUNCATE waits for every replica to flush and snapshot the table
+TRUNCATE_TIMEOUT = 120
+# execution profile of the large scans, rows come back as plain tuples indexed through records.Columns
+TUPLE_ROWS = "tuple_rows"
+
+
+def token_ranges():
+    """The TOKEN_SPLITS (low, high] ranges covering the ring, Murmur3 never yields TOKEN_MIN."""
+    step = 2 ** 64 // TOKEN_SPLITS
+    return [(TOKEN_MIN + step * index, TOKEN_MIN + step * (index + 1) if index < TOKEN_SPLITS - 1 else 2 ** 63 - 1)
+            for index in range(TOKEN_SPLITS)]
+
+
+def insert_statement(session, table, columns):
+    """Prepared INSERT of `columns` into a social_media table."""
+    return session.prepare(
+        f"INSERT INTO social_media.{table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})")
+
+
+def sentiment_of(content):
+    polarity = TextBlob(content or "").sentiment.polarity  # Polarity: -1 to 1
+    return "positive" if polarity > 0 else "negative" if polarity < 0 else "neutral"
+
 
 class CassandraModel:
     def __init__(self):
         self.cluster = None
         self.session = None
+        self.cache = ResultCache()
+        self._range_queries = {}
 
     def connect_to_cassandra(self):
-        self.cluster = Cluster(["127.0.0.1"])
+        self.cluster = Cluster(["127.0.0.1"], execution_profiles={
+            EXEC_PROFILE_DEFAULT: ExecutionProfile(),
+            TUPLE_ROWS: ExecutionProfile(row_factory=tuple_factory),
+        })
         self.session = self.cluster.connect()
         print("Connected to Cassandra.")
         self.setup_keyspace_and_tables()
@@ -139,90 +186,127 @@ class CassandraModel:
 
         print("Tables created.")
 
+    def _scan(self, query, parameters=None):
+        """Execute a large read with tuple rows, much lighter than the default named tuples."""
+        return self.session.execute(query, parameters, execution_profile=TUPLE_ROWS)
+
     # Logic for cassandra requirements (1-11)
+    # Each analytic returns its rows as dicts, `show` prints them as well.
 
     # 1. Follower Number Analysis
-    def follower_number_analysis(self):
-        print("Executing Follower Number Analysis...")
-        query = "SELECT user_id, followers_count, following_count FROM users"
-        rows = self.session.execute(query)
-        for row in rows:
-            print(f"User ID: {row.user_id}, Followers: {row.followers_count}, Following: {row.following_count}")
+    def follower_number_analysis(self, show=True):
+        if show:
+            print("Executing Follower Number Analysis...")
+        columns = Columns("user_id, followers_count, following_count")
+        rows = self._scan(f"SELECT {columns} FROM users")
+        results = [dict(zip(columns.names, row)) for row in rows]
+        if show:
+            for row in results:
+                print(f"User ID: {row['user_id']}, Followers: {row['followers_count']}, "
+                      f"Following: {row['following_count']}")
+        return results
 
     # 2. User Interaction Patterns by Time of Day
-    def user_interaction_patterns(self):
-        print("Analyzing User Interaction Patterns by Time of Day...")
-        query = "SELECT user_id, activity_id, type, timestamp FROM user_activity"
-        rows = self.session.execute(query)
-        rows_list = list(rows)
-        print(f"Rows returned: {len(rows_list)}")
-
-        for row in rows_list:
-            print(f"User ID: {row.user_id}, Type: {row.type}, Timestamp: {row.timestamp}")
+    def user_interaction_patterns(self, show=True):
+        if show:
+            print("Analyzing User Interaction Patterns by Time of Day...")
+        columns = Columns("user_id, activity_id, type, timestamp")
+        rows = self._scan(f"SELECT {columns} FROM user_activity")
+        results = [dict(zip(columns.names, row)) for row in rows]
+        if show:
+            print(f"Rows returned: {len(results)}")
+            for row in results:
+                print(f"User ID: {row['user_id']}, Type: {row['type']}, Timestamp: {row['timestamp']}")
+        return results
 
     # 3. Trend Analysis of Popular Topics
-    def trend_analysis_of_topics(self):
-        print("Analyzing Trending Topics...")
+    def trend_analysis_of_topics(self, show=True):
+        if show:
+            print("Analyzing Trending Topics...")
         query = "SELECT tag, post_count FROM tag_popularity LIMIT 10"
         rows = self.session.execute(query)
-        for row in rows:
-            print(f"Tag: {row.tag}, Post Count: {row.post_count}")
+        results = [{"tag": row.tag, "post_count": row.post_count} for row in rows]
+        if show:
+            for row in results:
+                print(f"Tag: {row['tag']}, Post Count: {row['post_count']}")
+        return results
 
     # 4. User Sentiment Analysis
-    def user_sentiment_analysis(self):
+    def user_sentiment_analysis(self, show=True):
+        sentiment_results = self._sentiment_by_post()
+        if show:
+            for result in sentiment_results:
+                print(f"Post ID: {result['post_id']}, Sentiment: {result['sentiment']}")
+
+        return sentiment_results
+
+    @cached("user_sentiment_analysis", ttl=600, tags=("cassandra",))
+    def _sentiment_by_post(self):
         query = "SELECT post_id, content FROM social_media.posts;"
-        rows = self.session.execute(query)
+        rows = self._scan(query)
 
         sentiment_results = []
 
-        for row in rows:
-            content = row.content
-            sentiment_score = TextBlob(content).sentiment.polarity  # Polarity: -1 to 1
-            sentiment = "positive" if sentiment_score > 0 else "negative" if sentiment_score < 0 else "neutral"
-
+        for post_id, content in rows:
             sentiment_results.append({
-                'post_id': row.post_id,
+                'post_id': post_id,
                 'content': content,
-                'sentiment': sentiment
+                'sentiment': sentiment_of(content)
             })
 
-            print(f"Post ID: {row.post_id}, Sentiment: {sentiment}")
-
         return sentiment_results
 
     # 5. Content Type Performance Analysis
-    def content_type_performance(self):
-        print("Analyzing Content Type Performance...")
+    def content_type_performance(self, show=True):
+        if show:
+            print("Analyzing Content Type Performance...")
         query = "SELECT user_id, COUNT(*) AS post_count FROM user_posts GROUP BY user_id"
         rows = self.session.execute(query)
-        for row in rows:
-            print(f"User ID: {row.user_id}, Post Count: {row.post_count}")
+        results = [{"user_id": row.user_id, "post_count": row.post_count} for row in rows]
+        if show:
+            for row in results:
+                print(f"User ID: {row['user_id']}, Post Count: {row['post_count']}")
+        return results
 
     # 6. Most Engaging Post Types for Specific Hashtags
-    def most_engaging_post_types(self, example_tag):
-        print(f"Finding Most Engaging Posts for Tag: {example_tag}")
+    def most_engaging_post_types(self, example_tag, show=True):
+        if show:
+            print(f"Finding Most Engaging Posts for Tag: {example_tag}")
         query = """
             SELECT post_id, like_count, share_count, comment_count
             FROM posts_by_tag
             WHERE tag = %s;
         """
         rows = self.session.execute(query, (example_tag,))
+        results = []
         for row in rows:
             total_engagement = (row.like_count or 0) + (row.share_count or 0) + (row.comment_count or 0)
-            print(f"Post ID: {row.post_id}, Total Engagement: {total_engagement}")
+            results.append({"post_id": row.post_id, "total_engagement": total_engagement})
+            if show:
+                print(f"Post ID: {row.post_id}, Total Engagement: {total_engagement}")
+        return results
 
     # 7. Keyword Influence on Engagement
-    def keyword_influence_on_engagement(self):
-        print("Analyzing Keyword Influence on Engagement...")
-
+    def keyword_influence_on_engagement(self, show=True):
+        if show:
+            print("Analyzing Keyword Influence on Engagement...")
+        results = self._keyword_averages()
+
+        if show:
+            print("Top 10 keywords influencing engagement (by average likes):")
+            for row in results:
+                print(
+                    f"Keyword: {row['keyword']}, Avg Likes: {row['avg_likes']:.2f}, Avg Comments: {row['avg_comments']:.2f}, Avg Shares: {row['avg_shares']:.2f}")
+        return results
+
+    @cached("keyword_influence_on_engagement", ttl=600, tags=("cassandra",))
+    def _keyword_averages(self):
         keyword_engagement = defaultdict(lambda: {"likes": 0, "comments": 0, "shares": 0, "count": 0})
 
         posts_query = "SELECT post_id, content FROM social_media.posts;"
-        posts = self.session.execute(posts_query)
+        posts = self._scan(posts_query)
 
-        for post in posts:
-            post_id = post.post_id
-            content = post.content
+        for post_id, content in posts:
             keywords = set(content.split())  # Split content into words for simplicity
 
             engagement_query = """
@@ -250,88 +334,107 @@ class CassandraModel:
                 }
 
         sorted_keywords = sorted(keyword_averages.items(), key=lambda x: x[1]["avg_likes"], reverse=True)
-
-        print("Top 10 keywords influencing engagement (by average likes):")
-        for keyword, averages in sorted_keywords[:10]:
-            print(
-                f"Keyword: {keyword}, Avg Likes: {averages['avg_likes']:.2f}, Avg Comments: {averages['avg_comments']:.2f}, Avg Shares: {averages['avg_shares']:.2f}")
+        return [dict(keyword=keyword, **averages) for keyword, averages in sorted_keywords[:10]]
 
     # 8. Follower-to-Engagement Ratio
-    def follower_to_engagement_ratio(self):
-        print("Calculating Follower-to-Engagement Ratios...")
-
+    def follower_to_engagement_ratio(self, show=True):
+        if show:
+            print("Calculating Follower-to-Engagement Ratios...")
+        results = self._engagement_ratios()
+        if show:
+            for row in results:
+                print(f"User ID: {row['user_id']}, Ratio: {row['ratio']:.2f}")
+        return results
+
+    @cached("follower_to_engagement_ratio", ttl=300, tags=("cassandra",))
+    def _engagement_ratios(self):
         query = "SELECT user_id, like_count, comment_count FROM posts"
-        rows = self.session.execute(query)
+        rows = self._scan(query)
 
         user_engagement = {}
-        for row in rows:
-            if row.user_id not in user_engagement:
-                user_engagement[row.user_id] = 0
-            user_engagement[row.user_id] += row.like_count + row.comment_count
+        for user_id, like_count, comment_count in rows:
+            if user_id not in user_engagement:
+                user_engagement[user_id] = 0
+            user_engagement[user_id] += like_count + comment_count
 
         followers_query = "SELECT user_id, followers_count FROM users"
-        followers_rows = {row.user_id: row.followers_count for row in self.session.execute(followers_query)}
+        followers_rows = dict(self._scan(followers_query))
 
+        results = []
         for user_id, total_engagement in user_engagement.items():
             followers_count = followers_rows.get(user_id, 0)  # Default to 0 if no followers count found
             ratio = total_engagement / followers_count if followers_count else 0
-            print(f"User ID: {user_id}, Ratio: {ratio:.2f}")
+            results.append({"user_id": user_id, "total_engagement": total_engagement,
+                            "followers_count": followers_count, "ratio": ratio})
+        return results
 
     # 9. Average Response Time to Comments
-    def average_response_time_to_comments(self):
-        print("Calculating Average Response Time to Comments...")
+    def average_response_time_to_comments(self, show=True):
+        if show:
+            print("Calculating Average Response Time to Comments...")
 
         posts_query = """
             SELECT post_id, user_id, timestamp as post_timestamp
             FROM social_media.posts;
         """
-        posts = self.session.execute(posts_query)
+        posts = self._scan(posts_query)
 
-        for post in posts:
+        results = []
+        for post_id, _, post_timestamp in posts:
             comments_query = """
                 SELECT comment_id, timestamp as comment_timestamp
                 FROM social_media.post_comments
                 WHERE post_id = %s
             """
-            comments = self.session.execute(comments_query, [post.post_id])
+            comments = self._scan(comments_query, [post_id])
             comments_list = list(comments)
 
             if comments_list:
                 total_response_time = timedelta()
                 comment_count = 0
 
-                for comment in comments_list:
-                    response_time = comment.comment_timestamp - post.post_timestamp
+                for _, comment_timestamp in comments_list:
+                    response_time = comment_timestamp - post_timestamp
                     if response_time.total_seconds() > 0:
                         total_response_time += response_time
                         comment_count += 1
 
                 if comment_count > 0:
                     avg_response_time = total_response_time / comment_count
+                    results.append({"post_id": post_id, "comment_count": comment_count,
+                                    "avg_response_seconds": avg_response_time.total_seconds()})
+                    if not show:
+                        continue
 
                     total_seconds = int(avg_response_time.total_seconds())
                     hours = total_seconds // 3600
                     minutes = (total_seconds % 3600) // 60
                     seconds = total_seconds % 60
 
-                    print(f"Post ID: {post.post_id}")
+                    print(f"Post ID: {post_id}")
                     print(f"Number of comments: {comment_count}")
                     print(f"Average response time: {hours}h {minutes}m {seconds}s")
                     print("---")
+        return results
 
     # 10. Time-to-First-Engagement Analysis
-    def time_to_first_engagement(self):
-        print("Analyzing Time-to-First-Engagement...")
+    def time_to_first_engagement(self, show=True):
+        if show:
+            print("Analyzing Time-to-First-Engagement...")
         query = """
             SELECT post_id, MIN(timestamp) AS first_engagement_time FROM likes GROUP BY post_id;
         """
         rows = self.session.execute(query)
-        for row in rows:
-            print(f"Post ID: {row.post_id}, First Engagement Time: {row.first_engagement_time}")
+        results = [{"post_id": row.post_id, "first_engagement_time": row.first_engagement_time} for row in rows]
+        if show:
+            for row in results:
+                print(f"Post ID: {row['post_id']}, First Engagement Time: {row['first_engagement_time']}")
+        return results
 
     # 11. Top Shared Posts
-    def top_shared_posts(self):
-        print("Finding Top Shared Posts...")
+    def top_shared_posts(self, show=True):
+        if show:
+            print("Finding Top Shared Posts...")
 
         query = """
             SELECT post_id, share_count 
@@ -340,18 +443,270 @@ class CassandraModel:
             ALLOW FILTERING
         """
         try:
-            rows = self.session.execute(query)
-            posts = list(rows)
-            posts.sort(key=lambda x: x.share_count, reverse=True)
+            rows = self._scan(query)
+            posts = heapq.nlargest(10, rows, key=lambda row: row[1])
+            results = [{"post_id": post_id, "share_count": share_count} for post_id, share_count in posts]
+            if not show:
+                return results
             if not posts:
                 print("No shared posts found.")
             else:
                 print("\nTop Shared Posts:")
-                for post in posts[:10]:
-                    print(f"Post ID: {post.post_id}, Share Count: {post.share_count}")
+                for row in results:
+                    print(f"Post ID: {row['post_id']}, Share Count: {row['share_count']}")
+            return results
 
         except Exception as e:
+            if not show:
+                raise
             print(f"Error retrieving top shared posts: {str(e)}")
+            return []
+
+    def post_tags(self):
+        """
+        (tags,) of every post, a page of SCAN_FETCH_SIZE rows at a time. The table has
+        no time-ordered key, so this is always a full scan.
+        """
+        return self._scan(SimpleStatement("SELECT tags FROM posts", fetch_size=SCAN_FETCH_SIZE))
+
+    # Approximate analytics
+    # Mergeable sketches built over parallel token-range scans of the tables keyed by
+    # post_id. With `sample_ranges` only that many random ranges are read, so the cost
+    # stays flat as the tables grow; counts are then scaled up and reported with 95% bounds.
+
+    def _scan_token_ranges(self, new_partial, scan, sample_ranges=None, seed=None):
+        """
+        Call scan(partial, low, high) for every token range, or `sample_ranges` random
+        ones, on SCAN_WORKERS threads with one partial per thread. `scan` returns the
+        rows it read. Returns the partials and the rows read per range.
+        """
+        ranges = token_ranges()
+        if sample_ranges is not None and sample_ranges < TOKEN_SPLITS:
+            ranges = random.Random(seed).sample(ranges, sample_ranges)
+        workers = max(1, min(SCAN_WORKERS, len(ranges)))
+
+        def run(assigned):
+            partial = new_partial()
+            return partial, [scan(partial, low, high) for low, high in assigned]
+
+        # workers run in a copy of the caller's context, so metrics and logs keep its operation
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda assigned: context.copy().run(run, assigned),
+                                        [ranges[worker::workers] for worker in range(workers)]))
+        return [partial for partial, _ in results], [rows for _, counts in results for rows in counts]
+
+    def _range_query(self, table, columns, key="post_id"):
+        # prepared once per model, every range of every scan reuses it
+        statement = (table, str(columns), key)
+        if statement not in self._range_queries:
+            self._range_queries[statement] = self.session.prepare(
+                f"SELECT {columns} FROM social_media.{table} WHERE token({key}) > ? AND token({key}) <= ?")
+        return self._range_queries[statement]
+
+    def read_token_range(self, table, columns, low, high, key="post_id"):
+        """Tuple rows of `table` whose partition key `key` hashes into the (low, high] token range."""
+        return self._scan(self._range_query(table, columns, key), (low, high))
+
+    def _heavy_terms(self, columns, terms_of, k, sample_ranges, seed):
+        """Most frequent terms of the posts, with like/comment/share sums sketched per term."""
+        query = self._range_query("posts", columns)
+        engagement = columns.getter("like_count", "comment_count", "share_count")
+
+        def new_partial():
+            return {"terms": HeavyHitters(k * 4), "likes": CountMinSketch(), "comments": CountMinSketch(),
+                    "shares": CountMinSketch()}
+
+        def scan(partial, low, high):
+            counts, likes, comments, shares = Counter(), Counter(), Counter(), Counter()
+            rows = 0
+            for row in self._scan(query, (low, high)):
+                rows += 1
+                like_count, comment_count, share_count = engagement(row)
+                for term in terms_of(row):
+                    counts[term] += 1
+                    likes[term] += like_count or 0
+                    comments[term] += comment_count or 0
+                    shares[term] += share_count or 0
+            for name, counter in (("terms", counts), ("likes", likes), ("comments", comments), ("shares", shares)):
+                partial[name].add_many(list(counter), list(counter.values()))
+            return rows
+
+        partials, range_rows = self._scan_token_ranges(new_partial, scan, sample_ranges, seed)
+        merged = partials[0]
+        for partial in partials[1:]:
+            for name, sketch in partial.items():
+                merged[name].merge(sketch)
+        scale = TOKEN_SPLITS / len(range_rows)
+        terms = merged["terms"]
+        top = terms.top()[:k]
+        results = []
+        for (term, count), likes, comments, shares in zip(
+                top, *(merged[name].estimate_many([term for term, _ in top])
+                       for name in ("likes", "comments", "shares"))):
+            results.append({"term": term, "estimated_posts": round(count * scale),
+                            "error": round(terms.sketch.error * scale), "avg_likes": likes / count,
+                            "avg_comments": comments / count, "avg_shares": shares / count})
+        return results
+
+    def approximate_keyword_influence(self, k=10, sample_ranges=SAMPLE_RANGES, seed=None, show=True):
+        """The k most frequent keywords with their average engagement, from a token-range sample."""
+        if show:
+            print("Estimating Keyword Influence on Engagement...")
+        columns = Columns("post_id, content, like_count, comment_count, share_count")
+        results = [dict(keyword=row.pop("term"), **row) for row in self._heavy_terms(
+            columns, lambda row: set((row[columns.content] or "").split()), k, sample_ranges, seed)]
+        if show:
+            for row in results:
+                print(f"Keyword: {row['keyword']}, Posts: ~{row['estimated_posts']} (±{row['error']}), "
+                      f"Avg Likes: {row['avg_likes']:.2f}, Avg Comments: {row['avg_comments']:.2f}, "
+                      f"Avg Shares: {row['avg_shares']:.2f}")
+        return results
+
+    def approximate_trending_tags(self, k=10, sample_ranges=SAMPLE_RANGES, seed=None, show=True):
+        """The k most used tags with their average engagement, from a token-range sample."""
+        if show:
+            print("Estimating Trending Tags...")
+        columns = Columns("post_id, tags, like_count, comment_count, share_count")
+        results = [dict(tag=row.pop("term"), **row) for row in self._heavy_terms(
+            columns, lambda row: row[columns.tags] or (), k, sample_ranges, seed)]
+        if show:
+            for row in results:
+                print(f"Tag: {row['tag']}, Posts: ~{row['estimated_posts']} (±{row['error']}), "
+                      f"Avg Likes: {row['avg_likes']:.2f}")
+        return results
+
+    def approximate_sentiment(self, sample_size=SENTIMENT_SAMPLE, sample_ranges=SAMPLE_RANGES, seed=None, show=True):
+        """Share of positive, negative and neutral posts from a reservoir sample, with 95% bounds."""
+        if show:
+            print("Estimating User Sentiment...")
+        query = self._range_query("posts", "post_id, content")
+
+        def scan(reservoir, low, high):
+            rows = 0
+            for _, content in self._scan(query, (low, high)):
+                reservoir.add(content)
+                rows += 1
+            return rows
+
+        reservoirs, range_rows = self._scan_token_ranges(lambda: ReservoirSample(sample_size, seed), scan,
+                                                         sample_ranges, seed)
+        sample = reservoirs[0]
+        for reservoir in reservoirs[1:]:
+            sample.merge(reservoir)
+        posts, _, _ = cluster_total(range_rows, TOKEN_SPLITS)
+        sentiments = Counter()
+        for content in sample.items:
+            sentiments[sentiment_of(content)] += 1
+        results = []
+        for sentiment in ("positive", "negative", "neutral"):
+            share, low, high = proportion_interval(sentiments[sentiment], len(sample.items), round(posts))
+            results.append({"sentiment": sentiment, "sampled": sentiments[sentiment], "share": share,
+                            "share_low": low, "share_high": high, "estimated_posts": round(share * posts)})
+        if show:
+            print(f"Sampled {len(sample.items)} of ~{round(posts)} posts.")
+            for row in results:
+                print(f"{row['sentiment'].capitalize()}: {row['share']:.1%} "
+                      f"({row['share_low']:.1%} - {row['share_high']:.1%}), ~{row['estimated_posts']} posts")
+        return results
+
+    def approximate_engagement_totals(self, sample_ranges=SAMPLE_RANGES, seed=None, show=True):
+        """Row counts of posts, likes, shares and comments estimated from a token-range sample."""
+        if show:
+            print("Estimating Engagement Totals...")
+        tables = ("posts", "likes", "shares", "post_comments")
+        queries = {table: self._range_query(table, "post_id") for table in tables}
+        per_range = []  # (table, rows) of every range, appended from the scan threads
+
+        def scan(_, low, high):
+            rows = 0
+            for table in tables:
+                count = sum(1 for _ in self._scan(queries[table], (low, high)))
+                per_range.append((table, count))
+                rows += count
+            return rows
+
+        self._scan_token_ranges(lambda: None, scan, sample_ranges, seed)
+        results = []
+        for table in tables:
+            counts = [count for name, count in per_range if name == table]
+            estimate, low, high = cluster_total(counts, TOKEN_SPLITS)
+            results.append({"table": table, "estimated_rows": round(estimate), "low": round(low),
+                            "high": round(high), "rows_read": sum(counts)})
+        if show:
+            for row in results:
+                print(f"{row['table']}: ~{row['estimated_rows']} rows ({row['low']} - {row['high']}), "
+                      f"read {row['rows_read']}")
+        return results
+
+    def approximate_unique_engagers(self, by="tag", k=10, sample_ranges=None, seed=None, show=True):
+        """
+        Distinct users who liked, shared or commented, per post or per tag.
+
+        Posts and their engagement share a partition key, so a token range holds all
+        of its posts' engagers and those are counted exactly, range by range. Per-tag
+        and overall counts merge HyperLogLogs across ranges. Distinct counts do not
+        scale up from a sample, so the default reads the whole ring in parallel; with
+        `sample_ranges` they cover the sampled posts only.
+        """
+        if by not in ("post", "tag"):
+            raise ValueError("by must be 'post' or 'tag'")
+        if show:
+            print(f"Estimating Unique Engagers per {by.capitalize()}...")
+        tags_query = self._range_query("posts", "post_id, tags")
+        engagement_queries = [self._range_query(table, "post_id, user_id")
+                              for table in ("likes", "shares", "post_comments")]
+
+        def new_partial():
+            return {"posts": [], "tags": defaultdict(HyperLogLog), "all": HyperLogLog()}
+
+        def scan(partial, low, high):
+            engagers = defaultdict(set)
+            rows = 0
+            for query in engagement_queries:
+                for post_id, user_id in self._scan(query, (low, high)):
+                    engagers[post_id].add(user_id)
+                    rows += 1
+            hashes = {user: hash64(user) for users in engagers.values() for user in users}
+            partial["all"].add_hashes(np.fromiter(hashes.values(), dtype=np.uint64, count=len(hashes)))
+            for post_id, users in engagers.items():
+                entry = (len(users), str(post_id), post_id)
+                if len(partial["posts"]) < k:
+                    heapq.heappush(partial["posts"], entry)
+                elif entry > partial["posts"][0]:
+                    heapq.heapreplace(partial["posts"], entry)
+            if by == "tag":
+                tag_hashes = defaultdict(list)
+                for post_id, tags in self._scan(tags_query, (low, high)):
+                    users = engagers.get(post_id, ())
+                    for tag in tags or () if users else ():
+                        tag_hashes[tag].extend(hashes[user] for user in users)
+                for tag, values in tag_hashes.items():
+                    partial["tags"][tag].add_hashes(np.array(values, dtype=np.uint64))
+            return rows
+
+        partials, _ = self._scan_token_ranges(new_partial, scan, sample_ranges, seed)
+        everyone = partials[0]["all"]
+        for partial in partials[1:]:
+            everyone.merge(partial["all"])
+        if by == "post":
+            top = heapq.nlargest(k, (entry for partial in partials for entry in partial["posts"]))
+            results = [{"post_id": post_id, "unique_engagers": count} for count, _, post_id in top]
+        else:
+            tags = defaultdict(HyperLogLog)
+            for partial in partials:
+                for tag, users in partial["tags"].items():
+                    tags[tag].merge(users)
+            ranked = sorted(((users.estimate(), tag, users.relative_error) for tag, users in tags.items()),
+                            reverse=True)[:k]
+            results = [{"tag": tag, "unique_engagers": round(count), "relative_error": error}
+                       for count, tag, error in ranked]
+        if show:
+            print(f"Unique engagers overall: ~{round(everyone.estimate())}")
+            for row in results:
+                print(f"{by.capitalize()}: {row[by if by == 'tag' else 'post_id']}, "
+                      f"Unique Engagers: ~{row['unique_engagers']}")
+        return results
 
     def close_connection(self):
         if self.session:
@@ -360,159 +715,97 @@ class CassandraModel:
             self.cluster.shutdown()
         print("Connection to Cassandra closed.")
 
-    def populate_database(self):
-        fake = Faker()
-
-        users = []
-        posts = []
-        # Creates fake users
-        for _ in range(50):
-            user_id = uuid.uuid4()
-            users.append(user_id)
-            username = fake.user_name()
-            email = fake.email()
-            joined_date = fake.date_time_this_decade()
-            followers_count = random.randint(0, 5000)
-            following_count = random.randint(0, 2000)
-
-            query = """
-            INSERT INTO social_media.users (user_id, username, email, joined_date, followers_count, following_count)
-            VALUES (%s, %s, %s, %s, %s, %s);
-            """
-            self.session.execute(query, (user_id, username, email, joined_date, followers_count, following_count))
-
-        # Creates posts and user_posts
-        for _ in range(100):
-            post_id = uuid.uuid4()
-            posts.append(post_id)
-            user_id = random.choice(users)
-            content = fake.text(max_nb_chars=200)
-            timestamp = fake.date_time_this_year()
-            like_count = random.randint(0, 1000)
-            comment_count = random.randint(0, 500)
-            share_count = random.randint(0, 200)
-            tags = set(fake.words(nb=random.randint(1, 5)))
-
-            # Insert posts table
-            query = """
-            INSERT INTO social_media.posts (post_id, user_id, content, timestamp, like_count, comment_count, share_count, tags)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
-            """
-            self.session.execute(query,
-                                 (post_id, user_id, content, timestamp, like_count, comment_count, share_count, tags))
-
-            # Insert user_posts table
-            query = """
-            INSERT INTO social_media.user_posts (post_id, user_id, content, timestamp)
-            VALUES (%s, %s, %s, %s);
-            """
-            self.session.execute(query, (post_id, user_id, content, timestamp))
-
-            # Insert top_shared_posts table (this isn't totally needed, since I changed the top shared posts logic.
-            # Although this would work better in theory.)
-            query = """
-            INSERT INTO social_media.top_shared_posts (share_count, post_id)
-            VALUES (%s, %s);
-            """
-            self.session.execute(query, (share_count, post_id))
-
-            # Creates tag_popularity data
-            for tag in tags:
-                post_count = random.randint(1, 20)
-                query = """
-                INSERT INTO social_media.tag_popularity (post_count, tag)
-                VALUES (%s, %s);
-                """
-                self.session.execute(query, (post_count, tag))
-
-            # Creates user activity table data (for posts)
-            activity_id = uuid.uuid4()
-            activity_type = "post"
-            target_id = post_id
-            timestamp = datetime.now()
-            query = """
-            INSERT INTO social_media.user_activity (user_id, activity_id, type, target_id, timestamp)
-            VALUES (%s, %s, %s, %s, %s);
-            """
-            self.session.execute(query, (user_id, activity_id, activity_type, target_id, timestamp))
-
-        # Creates comments and post_comments
-        for post_id in posts:
-            # Get post timestamp
-            post_query = "SELECT timestamp FROM social_media.posts WHERE post_id = %s"
-            post_timestamp = self.session.execute(post_query, [post_id]).one().timestamp
-
-            # Generates 1-5 comments for each post
-            for _ in range(random.randint(1, 5)):
-                comment_id = uuid.uuid4()
-                user_id = random.choice(users)
-                content = fake.text(max_nb_chars=100)
-                # Generates comment timestamp that's after the post timestamp, it'll be between 1 minute and 24 hours
-                time_diff = random.randint(60, 86400)
-                timestamp = post_timestamp + timedelta(seconds=time_diff)
-
-                # Insert comments
-                query = """
-                INSERT INTO social_media.comments (comment_id, post_id, user_id, content, timestamp)
-                VALUES (%s, %s, %s, %s, %s);
-                """
-                self.session.execute(query, (comment_id, post_id, user_id, content, timestamp))
-
-                # Insert post_comments
-                query = """
-                INSERT INTO social_media.post_comments (post_id, comment_id, user_id, content, timestamp)
-                VALUES (%s, %s, %s, %s, %s);
-                """
-                self.session.execute(query, (post_id, comment_id, user_id, content, timestamp))
-
-                # Creates user activity data (for comments)
-                activity_id = uuid.uuid4()
-                activity_type = "comment"
-                target_id = comment_id
-                query = """
-                INSERT INTO social_media.user_activity (user_id, activity_id, type, target_id, timestamp)
-                VALUES (%s, %s, %s, %s, %s);
-                """
-                self.session.execute(query, (user_id, activity_id, activity_type, target_id, timestamp))
-
-        # Creates likes
-        for _ in range(300):
-            post_id = random.choice(posts)
-            user_id = random.choice(users)
-            timestamp = fake.date_time_this_year()
-
-            query = """
-            INSERT INTO social_media.likes (post_id, user_id, timestamp)
-            VALUES (%s, %s, %s);
-            """
-            self.session.execute(query, (post_id, user_id, timestamp))
-
-            # Creates user activity data (for likes)
-            activity_id = uuid.uuid4()
-            activity_type = "like"
-            target_id = post_id
-            timestamp = datetime.now()
-            query = """
-            INSERT INTO social_media.user_activity (user_id, activity_id, type, target_id, timestamp)
-            VALUES (%s, %s, %s, %s, %s);
-            """
-            self.session.execute(query, (user_id, activity_id, activity_type, target_id, timestamp))
-
-        # Creates tags
-        tags = set()
-        for row in self.session.execute("SELECT tags FROM social_media.posts;"):
-            tags.update(row.tags)
-
-        for tag in tags:
-            post_count = random.randint(1, 20)
-            last_used = fake.date_time_this_year()
-
-            query = """
-            INSERT INTO social_media.tags (tag, post_count, last_used)
-            VALUES (%s, %s, %s);
-            """
-            self.session.execute(query, (tag, post_count, last_used))
-
-        print("Test data inserted into the database.")
+    def clean_database(self, tables=TABLES):
+        """TRUNCATE every table, all of them at once."""
+        futures = [self.session.execute_async(f"TRUNCATE social_media.{table}", timeout=TRUNCATE_TIMEOUT)
+                   for table in tables]
+        for future in futures:
+            future.result()
+        self.cache.invalidate("cassandra")
+        print(f"Truncated {len(futures)} tables.")
+
+    def populate_database(self, dataset=None):
+        """Load a small random dataset, or `dataset`, see synthetic.py."""
+        self.load_dataset(dataset or SyntheticDataset(users=50, posts=100))
+
+    def _write_all(self, statement, rows, concurrency=WRITE_CONCURRENCY):
+        """Execute a prepared statement for every row with at most `concurrency` requests in flight."""
+        pending = deque()
+        for row in rows:
+            if len(pending) == concurrency:
+                pending.popleft().result()
+            pending.append(self.session.execute_async(statement, row))
+        for future in pending:
+            future.result()
+
+    def load_dataset(self, dataset, concurrency=WRITE_CONCURRENCY):
+        """Stream a SyntheticDataset into every table, chunk by chunk."""
+        def insert(table, columns):
+            return insert_statement(self.session, table, columns)
+
+        users = insert("users", ("user_id", "username", "email", "joined_date", "followers_count", "following_count"))
+        posts = insert("posts", ("post_id", "user_id", "content", "timestamp", "like_count", "comment_count",
+                                 "share_count", "tags"))
+        user_posts = insert("user_posts", ("post_id", "user_id", "content", "timestamp"))
+        top_shared = insert("top_shared_posts", ("share_count", "post_id"))
+        posts_by_tag = insert("posts_by_tag", ("tag", "post_id", "like_count", "share_count", "comment_count"))
+        comments = insert("comments", ("comment_id", "post_id", "user_id", "content", "timestamp"))
+        post_comments = insert("post_comments", ("post_id", "comment_id", "user_id", "content", "timestamp"))
+        likes = insert("likes", ("post_id", "user_id", "timestamp"))
+        shares = insert("shares", ("post_id", "user_id", "timestamp"))
+        activity = insert("user_activity", ("user_id", "activity_id", "type", "target_id", "timestamp"))
+        tags = insert("tags", ("tag", "post_count", "last_used"))
+        tag_popularity = insert("tag_popularity", ("tag", "post_count"))
+
+        for chunk in dataset.users():
+            self._write_all(users, columns_of(chunk, ("user_id", "username", "email", "joined_date", "followers_count",
+                                                      "following_count")), concurrency)
+        tag_counts, tag_last_used = Counter(), {}
+        for chunk in dataset.posts():
+            self._write_all(posts, columns_of(chunk, ("post_id", "user_id", "content", "timestamp", "like_count",
+                                                      "comment_count", "share_count", "tags")), concurrency)
+            self._write_all(user_posts, columns_of(chunk, ("post_id", "user_id", "content", "timestamp")), concurrency)
+            self._write_all(top_shared, columns_of(chunk, ("share_count", "post_id")), concurrency)
+            self._write_all(posts_by_tag, ((tag, post_id, like_count, share_count, comment_count)
+                                           for post_id, post_tags, like_count, share_count, comment_count
+                                           in columns_of(chunk, ("post_id", "tags", "like_count", "share_count",
+                                                                 "comment_count"))
+                                           for tag in post_tags), concurrency)
+            self._write_all(activity, ((user_id, activity_id, "post", post_id, timestamp)
+                                       for user_id, activity_id, post_id, timestamp
+                                       in columns_of(chunk, ("user_id", "activity_id", "post_id", "timestamp"))),
+                            concurrency)
+            for post_tags, timestamp in columns_of(chunk, ("tags", "timestamp")):
+                tag_counts.update(post_tags)
+                for tag in post_tags:
+                    tag_last_used[tag] = max(timestamp, tag_last_used.get(tag, timestamp))
+
+            engagement = dataset.engagement(chunk)
+            post_ids = chunk["post_id"]
+            rows = engagement["comments"]
+            comment_rows = [(comment_id, post_ids[post], user_id, content, timestamp)
+                            for comment_id, post, user_id, content, timestamp
+                            in columns_of(rows, ("comment_id", "post", "user_id", "content", "timestamp"))]
+            self._write_all(comments, comment_rows, concurrency)
+            self._write_all(post_comments, ((post_id, comment_id, user_id, content, timestamp)
+                                            for comment_id, post_id, user_id, content, timestamp in comment_rows),
+                            concurrency)
+            self._write_all(activity, ((user_id, activity_id, "comment", comment_id, timestamp)
+                                       for user_id, activity_id, comment_id, timestamp
+                                       in columns_of(rows, ("user_id", "activity_id", "comment_id", "timestamp"))),
+                            concurrency)
+            for table, name in ((likes, "likes"), (shares, "shares")):
+                self._write_all(table, ((post_ids[post], user_id, timestamp) for post, user_id, timestamp
+                                        in columns_of(engagement[name], ("post", "user_id", "timestamp"))),
+                                concurrency)
+            self._write_all(activity, ((user_id, activity_id, "like", post_ids[post], timestamp)
+                                       for user_id, activity_id, post, timestamp
+                                       in columns_of(engagement["likes"], ("user_id", "activity_id", "post",
+                                                                           "timestamp"))), concurrency)
+
+        self._write_all(tags, ((tag, count, tag_last_used[tag]) for tag, count in tag_counts.items()), concurrency)
+        self._write_all(tag_popularity, tag_counts.items(), concurrency)
+        self.cache.invalidate("cassandra")
+        print(f"Test data inserted: {dataset.n_users} users, {dataset.n_posts} posts (seed {dataset.seed}).")
 
 
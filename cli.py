@@ -0,0 +1,634 @@
+"""
+Non-interactive mode: `python main.py <command> [options]`.
+
+Every analytic is a subcommand writing its rows as JSON Lines or CSV through a
+buffered writer, populate/clean/refresh actions write one status row. Progress
+messages printed by the models go to stderr so stdout only carries the rows.
+`run-all` runs every analytic concurrently, one output file each,
+`audit-queries` runs every read path once and reports the plan of each statement,
+`materialize` keeps the materialized results of materializer.py refreshed, and
+`reset` / `save-fixture` empty the stores or restore them from a fixture (fixtures.py).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext, redirect_stdout
+from datetime import date, datetime
+from typing import Callable, NamedTuple
+from uuid import UUID
+
+import fixtures
+import ingest
+import instrumentation
+import materializer
+import profiling
+import slow_queries
+import snapshot_analytics
+from snapshot import Snapshot, export_snapshot
+from synthetic import CHUNK_SIZE, TAGS, SyntheticDataset
+
+try:
+    import orjson
+
+    def to_json(row):
+        return orjson.dumps(row, default=_plain, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+except ImportError:  # orjson is optional
+    def to_json(row):
+        return json.dumps(row, default=_plain)
+
+OUTPUT_BUFFER = 1 << 20
+FORMATS = ("jsonl", "csv")
+DEFAULT_OUTPUT_DIR = "reports"
+DEFAULT_SNAPSHOT_DIR = "snapshot"
+MAX_WORKERS = 16
+
+
+def _plain(value):
+    """JSON fallback for the driver types found in the rows."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if hasattr(value, "tolist"):  # NumPy arrays and scalars
+        return value.tolist()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def as_dict(row):
+    return row._asdict() if hasattr(row, "_asdict") else dict(row)
+
+
+class ResultWriter:
+    """Buffered JSON Lines / CSV writer, `path` "-" writes to stdout."""
+
+    def __init__(self, path, output_format="jsonl", stdout=None):
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown format {output_format!r}, expected one of {', '.join(FORMATS)}")
+        self.format = output_format
+        self.rows = 0
+        self._owned = path != "-"
+        self._file = open(path, "w", buffering=OUTPUT_BUFFER, newline="") if self._owned else stdout or sys.stdout
+        self._csv = None
+
+    def write(self, rows):
+        if self.format == "jsonl":
+            for row in rows:
+                self._file.write(to_json(as_dict(row)))
+                self._file.write("\n")
+                self.rows += 1
+            return
+        for row in rows:
+            row = as_dict(row)
+            if self._csv is None:
+                self._csv = csv.DictWriter(self._file, fieldnames=list(row), extrasaction="ignore")
+                self._csv.writeheader()
+            self._csv.writerow({key: _csv_value(value) for key, value in row.items()})
+            self.rows += 1
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _csv_value(value):
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, (list, tuple, dict, set, frozenset)) or hasattr(value, "tolist"):
+        return to_json(value)
+    return _plain(value) if isinstance(value, (datetime, date, UUID)) else value
+
+
+class Stores:
+    """Connects to each store the first time a command needs it."""
+
+    def __init__(self, metrics=None, slow_log=None):
+        self.metrics = metrics
+        self.slow_log = slow_log
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, store):
+        model = self._models.get(store)
+        if model is not None:
+            return model
+        with self._lock:
+            if store in self._models:
+                return self._models[store]
+            if store == "offline":
+                model = None  # offline commands open the snapshot given on the command line
+            elif store == "mongo":
+                from mongo_model import MongoModel
+                model = MongoModel()
+            elif store == "cassandra":
+                from cassandra_model import CassandraModel
+                model = CassandraModel()
+                model.connect_to_cassandra()
+            else:
+                from dgraph_model import DgraphModel
+                model = DgraphModel()
+                model.connect_to_dgraph()
+            if model is not None:
+                # the slow-query proxies wrap the drivers themselves, metrics wrap them in turn
+                if self.slow_log is not None:
+                    slow_queries.attach(log=self.slow_log, **{f"{store}_model": model})
+                if self.metrics is not None:
+                    instrumentation.instrument(metrics=self.metrics, **{f"{store}_model": model})
+            self._models[store] = model
+        return self._models[store]
+
+    def close(self):
+        for model in self._models.values():
+            if hasattr(model, "close_connection"):
+                model.close_connection()
+
+
+# Commands
+
+class Command(NamedTuple):
+    name: str
+    store: str
+    run: Callable  # (model, args) -> iterable of rows
+    help: str
+    arguments: tuple = ()
+    analytic: bool = True
+
+
+def _usage_rows(model, args):
+    overall, by_segment = model.analyze_platform_usage(args.by_interest, show=False)
+    for stats in overall.values():
+        yield dict(interest=None, **stats._asdict())
+    for interest, segment in sorted(by_segment.items()):
+        for stats in segment.values():
+            yield dict(interest=interest, **stats._asdict())
+
+
+def _trend_rows(granularity):
+    def run(model, args):
+        return getattr(model, f"view_{granularity}_engagement_trends")(args.first, args.last, show=False)
+    return run
+
+
+def _top_post_rows(model, args):
+    for metric, posts in sorted(model.find_top_performing_post(args.k, show=False).items()):
+        yield from posts
+
+
+def _language_rows(model, args):
+    return [{"language": language, "users": users} for language, users in model.most_used_language(False).items()]
+
+
+def _report_rows(report):
+    """One row per entry of each section of a report, tagged with its section and sharing the CSV columns."""
+    rows = [{"section": section, **row} for section, entries in report.items()
+            for row in (entries if isinstance(entries, list) else [entries])]
+    columns = dict.fromkeys(column for row in rows for column in row)
+    return [{column: row.get(column) for column in columns} for row in rows]
+
+
+def _status(result):
+    return [{"result": result}]
+
+
+def _offline(kernel, *parameters):
+    def run(model, args):
+        return kernel(Snapshot(args.snapshot), *(getattr(args, name) for name in parameters))
+    return run
+
+
+def _sampling(args):
+    """Sampling options of the approximate analytics, the model defaults when not given."""
+    options = {"seed": args.seed}
+    if args.sample_ranges is not None:
+        options["sample_ranges"] = args.sample_ranges or None  # 0 reads every range
+    return options
+
+
+def _ingest(model, args):
+    try:
+        return [ingest.ingest_file(model.session, args.input, args.workers, args.checkpoint, args.dead_letter,
+                                   args.restart, file_format=args.input_format, concurrency=args.concurrency)]
+    finally:
+        model.cache.invalidate("cassandra")
+
+
+def _materialized_rows(model, args):
+    entry = materializer.MaterializedStore(args.materialize_dir).load(args.job)
+    if entry is None:
+        raise LookupError(f"Nothing materialized for {args.job} in {args.materialize_dir}, run materialize first.")
+    print(f"{args.job}: {materializer.freshness(entry)}")
+    return materializer.JOBS_BY_NAME[args.job].rows(entry.result)
+
+
+def _load(model, args):
+    dataset = SyntheticDataset(args.users, args.posts, args.seed, args.chunk_size)
+    model.load_dataset(dataset)
+    return [{"users": dataset.n_users, "posts": dataset.n_posts, "seed": dataset.seed}]
+
+
+_TAG = (("--tag", {"required": True, "help": "hashtag to analyze"}),)
+_DAYS = (("--days", {"type": int, "default": 90, "help": "inactivity threshold in days (default 90)"}),)
+_K = (("--k", {"type": int, "default": 1, "help": "posts per metric (default 1)"}),)
+_SNAPSHOT = (("--snapshot", {"default": DEFAULT_SNAPSHOT_DIR,
+                            "help": f"snapshot directory (default ./{DEFAULT_SNAPSHOT_DIR})"}),)
+_SAMPLING = (("--sample-ranges", {"type": int, "help": "token ranges read out of 1024, 0 reads all"}),
+             ("--seed", {"type": int, "help": "seed of the range and reservoir sampling"}))
+_DATASET = (("--users", {"type": int, "default": 1000, "help": "users to generate (default 1000)"}),
+            ("--posts", {"type": int, "default": 10000, "help": "posts to generate (default 10000)"}),
+            ("--seed", {"type": int, "help": "the same seed loads the same data into every store"}),
+            ("--chunk-size", {"type": int, "default": CHUNK_SIZE, "help": "rows generated and written at a time"}))
+_MATERIALIZE_DIR = (("--materialize-dir", {"default": materializer.MATERIALIZE_DIR,
+                                            "help": f"materialized results (default ./{materializer.MATERIALIZE_DIR})"}),)
+_TOP = (("--k", {"type": int, "default": 10, "help": "rows returned (default 10)"}),)
+_PERIODS = (("--first", {"type": int, "default": 0, "help": "first period, e.g. 20240101 for days"}),
+            ("--last", {"type": int, "default": 99999999, "help": "last period"}))
+
+COMMANDS = (
+    # MongoDB
+    Command("most-used-language", "mongo", _language_rows, "users per language"),
+    Command("list-users", "mongo", lambda model, args: model.get_list_of_users(False), "every username"),
+    Command("post-analytics", "mongo", lambda model, args: _report_rows(model.post_analytics(args.k, show=False)),
+            "post totals, posts per user, top posters and posts per month", _TOP),
+    Command("post-activity", "mongo",
+            lambda model, args: _report_rows(model.post_activity(args.first, args.last, args.k, show=False)),
+            "posts per day, top posters and totals between two days", _TOP + _PERIODS),
+    Command("populate-mongo", "mongo", lambda model, args: _status(model.populate_database()),
+            "load the sample users and posts", analytic=False),
+    Command("clean-mongo", "mongo", lambda model, args: _status(model.clean_database()),
+            "drop every user and post", analytic=False),
+    Command("load-synthetic-mongo", "mongo", _load, "insert a seeded synthetic dataset", _DATASET, analytic=False),
+    # Cassandra
+    Command("follower-number-analysis", "cassandra", lambda model, args: model.follower_number_analysis(False),
+            "followers and following per user"),
+    Command("user-interaction-patterns", "cassandra", lambda model, args: model.user_interaction_patterns(False),
+            "user activity with timestamps"),
+    Command("trend-analysis-of-topics", "cassandra", lambda model, args: model.trend_analysis_of_topics(False),
+            "most popular tags"),
+    Command("user-sentiment-analysis", "cassandra", lambda model, args: model.user_sentiment_analysis(False),
+            "sentiment of every post"),
+    Command("content-type-performance", "cassandra", lambda model, args: model.content_type_performance(False),
+            "posts per user"),
+    Command("most-engaging-post-types", "cassandra",
+            lambda model, args: model.most_engaging_post_types(args.tag, False),
+            "total engagement of the posts with a tag", _TAG),
+    Command("keyword-influence-on-engagement", "cassandra",
+            lambda model, args: model.keyword_influence_on_engagement(False), "top keywords by average likes"),
+    Command("follower-to-engagement-ratio", "cassandra",
+            lambda model, args: model.follower_to_engagement_ratio(False), "engagement per follower for each user"),
+    Command("average-response-time-to-comments", "cassandra",
+            lambda model, args: model.average_response_time_to_comments(False), "average comment delay per post"),
+    Command("time-to-first-engagement", "cassandra", lambda model, args: model.time_to_first_engagement(False),
+            "first like per post"),
+    Command("top-shared-posts", "cassandra", lambda model, args: model.top_shared_posts(False),
+            "ten most shared posts"),
+    Command("approximate-keyword-influence", "cassandra",
+            lambda model, args: model.approximate_keyword_influence(args.k, show=False, **_sampling(args)),
+            "most frequent keywords and their engagement, sampled", _TOP + _SAMPLING),
+    Command("approximate-trending-tags", "cassandra",
+            lambda model, args: model.approximate_trending_tags(args.k, show=False, **_sampling(args)),
+            "most used tags and their engagement, sampled", _TOP + _SAMPLING),
+    Command("approximate-sentiment", "cassandra",
+            lambda model, args: model.approximate_sentiment(show=False, **_sampling(args)),
+            "share of positive, negative and neutral posts with 95% bounds", _SAMPLING),
+    Command("approximate-engagement-totals", "cassandra",
+            lambda model, args: model.approximate_engagement_totals(show=False, **_sampling(args)),
+            "posts, likes, shares and comments with 95% bounds", _SAMPLING),
+    Command("approximate-unique-engagers", "cassandra",
+            lambda model, args: model.approximate_unique_engagers(args.by, args.k, show=False, **_sampling(args)),
+            "distinct engaging users per post or tag", _TOP + _SAMPLING +
+            (("--by", {"choices": ("post", "tag"), "default": "tag", "help": "group by (default tag)"}),)),
+    Command("populate-cassandra", "cassandra", lambda model, args: _status(model.populate_database()),
+            "load random test data", analytic=False),
+    Command("clean-cassandra", "cassandra", lambda model, args: _status(model.clean_database()),
+            "truncate every table", analytic=False),
+    Command("load-synthetic-cassandra", "cassandra", _load, "insert a seeded synthetic dataset", _DATASET,
+            analytic=False),
+    Command("ingest-events", "cassandra", _ingest,
+            "stream a post/comment/like/share event log (JSON Lines or CSV, gzip too), resuming at its checkpoint",
+            (("--input", {"required": True, "help": "event log file"}),
+             ("--input-format", {"choices": ingest.FORMATS, "help": "default from the file name"}),
+             ("--checkpoint", {"help": "byte offset checkpoint (default <input>.checkpoint.json)"}),
+             ("--dead-letter", {"help": "malformed lines (default <input>.dead.jsonl)"}),
+             ("--concurrency", {"type": int, "default": ingest.WRITE_CONCURRENCY,
+                                "help": "writes in flight per worker"}),
+             ("--workers", {"type": int, "default": 1,
+                            "help": "processes, each ingesting a byte range of an uncompressed log"}),
+             ("--restart", {"action": "store_true", "help": "ignore the checkpoint and start over"})),
+            analytic=False),
+    Command("profile-summary", "offline", lambda model, args: profiling.summarize(args.profile_dir),
+            "profiled operations ranked by cumulative time, with their peak memory",
+            (("--profile-dir", {"default": profiling.PROFILE_DIR, "help": "directory of the profiles"}),),
+            analytic=False),
+    Command("materialized", "offline", _materialized_rows, "last materialized result of a job, without recomputing it",
+            _MATERIALIZE_DIR + (("--job", {"required": True, "choices": tuple(materializer.JOBS_BY_NAME)}),),
+            analytic=False),
+    Command("materialize-status", "offline",
+            lambda model, args: materializer.status(materializer.MaterializedStore(args.materialize_dir)),
+            "runs, duration, lag and watermark of each materialized job", _MATERIALIZE_DIR, analytic=False),
+    Command("export-snapshot", "cassandra", lambda model, args: _status(export_snapshot(model.session, args.snapshot)),
+            "export posts, users, likes, comments and activity to a columnar snapshot", _SNAPSHOT, analytic=False),
+    # Offline, over a snapshot
+    Command("offline-follower-number-analysis", "offline", _offline(snapshot_analytics.follower_number_analysis),
+            "followers and following per user", _SNAPSHOT),
+    Command("offline-user-interaction-patterns", "offline", _offline(snapshot_analytics.user_interaction_patterns),
+            "activity per type and hour of day", _SNAPSHOT),
+    Command("offline-trend-analysis-of-topics", "offline", _offline(snapshot_analytics.trend_analysis_of_topics),
+            "most used tags", _SNAPSHOT),
+    Command("offline-content-type-performance", "offline", _offline(snapshot_analytics.content_type_performance),
+            "posts per user", _SNAPSHOT),
+    Command("offline-most-engaging-post-types", "offline",
+            _offline(snapshot_analytics.most_engaging_post_types, "tag"),
+            "total engagement of the posts with a tag", _SNAPSHOT + _TAG),
+    Command("offline-follower-to-engagement-ratio", "offline",
+            _offline(snapshot_analytics.follower_to_engagement_ratio), "engagement per follower for each user",
+            _SNAPSHOT),
+    Command("offline-average-response-time-to-comments", "offline",
+            _offline(snapshot_analytics.average_response_time_to_comments), "average comment delay per post",
+            _SNAPSHOT),
+    Command("offline-time-to-first-engagement", "offline", _offline(snapshot_analytics.time_to_first_engagement),
+            "first like per post", _SNAPSHOT),
+    Command("offline-top-shared-posts", "offline", _offline(snapshot_analytics.top_shared_posts),
+            "ten most shared posts", _SNAPSHOT),
+    # Dgraph
+    Command("platform-usage", "dgraph", _usage_rows, "usage time distribution per horizon",
+            (("--by-interest", {"action": "store_true", "help": "also segment by interest"}),)),
+    Command("daily-engagement-trends", "dgraph", _trend_rows("daily"), "engagement per day (YYYYMMDD)", _PERIODS),
+    Command("weekly-engagement-trends", "dgraph", _trend_rows("weekly"), "engagement per ISO week (YYYYWW)",
+            _PERIODS),
+    Command("monthly-engagement-trends", "dgraph", _trend_rows("monthly"), "engagement per month (YYYYMM)",
+            _PERIODS),
+    Command("yearly-engagement-trends", "dgraph", _trend_rows("yearly"), "engagement per year", _PERIODS),
+    Command("cluster-users-by-interests", "dgraph", lambda model, args: model.cluster_users_by_interests(show=False),
+            "stored interest clusters"),
+    Command("inactive-users", "dgraph", lambda model, args: model.identify_inactive_users(args.days, show=False),
+            "users not active in the last --days days", _DAYS),
+    Command("inactive-users-summary", "dgraph",
+            lambda model, args: [{"days": days, "users": users}
+                                 for days, users in model.inactive_users_summary(show=False)],
+            "inactive users per threshold"),
+    Command("post-retention", "dgraph", lambda model, args: model.analyze_post_retention(show=False)[0],
+            "retention per content length band"),
+    Command("post-retention-histogram", "dgraph", lambda model, args: model.analyze_post_retention(show=False)[1],
+            "retention time histogram"),
+    Command("top-performing-posts", "dgraph", _top_post_rows, "top posts per metric", _K),
+    Command("top-influencers", "dgraph", lambda model, args: model.top_influencers(args.k, show=False),
+            "users with the highest influence score",
+            (("--k", {"type": int, "default": 10, "help": "number of users (default 10)"}),)),
+    Command("related-tags", "dgraph",
+            lambda model, args: [{"tag": tag, "posts_together": posts}
+                                 for tag, posts in model.related_tags(args.tag, args.k, show=False)],
+            "tags most often used together with a tag", _TAG + _TOP),
+    Command("populate-dgraph", "dgraph", lambda model, args: _status(model.populate_database()),
+            "set the schema and load sample data", analytic=False),
+    Command("clean-dgraph", "dgraph", lambda model, args: _status(model.clean_database()),
+            "drop all data and apply the schema again", analytic=False),
+    Command("load-synthetic-dgraph", "dgraph", _load, "insert a seeded synthetic dataset", _DATASET, analytic=False),
+    Command("set-dgraph-schema", "dgraph", lambda model, args: _status(model.set_schema()), "apply the schema",
+            analytic=False),
+    Command("rollup-engagement-trends", "dgraph",
+            lambda model, args: _status(model.rollup_engagement_trends(args.full)),
+            "fold new engagements into the trend nodes, --full recounts them all",
+            (("--full", {"action": "store_true", "help": "recount every engagement"}),), analytic=False),
+    Command("refresh-interest-clusters", "dgraph",
+            lambda model, args: _status(model.refresh_interest_clusters(args.full)),
+            "assign new users to clusters, --full re-fits them",
+            (("--full", {"action": "store_true", "help": "re-fit every cluster"}),), analytic=False),
+    Command("record-inactive-users", "dgraph", lambda model, args: _status(model.record_inactive_users(args.days)),
+            "upsert Inactivity nodes", _DAYS, analytic=False),
+    Command("rank-influencers", "dgraph", lambda model, args: _status(model.rank_influencers()),
+            "store PageRank influence scores", analytic=False),
+)
+COMMANDS_BY_NAME = {command.name: command for command in COMMANDS}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py", description="Social media analytics, batch mode.")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl", help="output format (default jsonl)")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile each command into PROFILE_DIR (also PROFILE_ENABLED=1)")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for command in COMMANDS:
+        subparser = subparsers.add_parser(command.name, help=f"{command.help} ({command.store})")
+        subparser.add_argument("--output", "-o", default="-", help="output file (default stdout)")
+        for flag, options in command.arguments:
+            subparser.add_argument(flag, **options)
+    run_all = subparsers.add_parser("run-all", help="every analytic concurrently, one file each")
+    run_all.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help=f"default ./{DEFAULT_OUTPUT_DIR}")
+    run_all.add_argument("--stores", nargs="+", choices=("mongo", "cassandra", "dgraph", "offline"),
+                         default=("mongo", "cassandra", "dgraph"))
+    run_all.add_argument("--snapshot", default=DEFAULT_SNAPSHOT_DIR, help="snapshot used by the offline analytics")
+    run_all.add_argument("--workers", type=int, default=MAX_WORKERS)
+    run_all.add_argument("--tag", help="also run most-engaging-post-types and related-tags for this tag")
+    audit = subparsers.add_parser("audit-queries", help="run every read path once and report each statement's plan")
+    audit.add_argument("--output", "-o", default="-", help="output file (default stdout)")
+    audit.add_argument("--stores", nargs="+", choices=("mongo", "cassandra", "dgraph"),
+                       default=("mongo", "cassandra", "dgraph"))
+    audit.add_argument("--tag", default=TAGS[0],
+                       help=f"hashtag of most-engaging-post-types and related-tags (default {TAGS[0]})")
+    materialize = subparsers.add_parser("materialize", help="refresh the materialized results on their schedules")
+    materialize.add_argument("--jobs", nargs="+", choices=tuple(materializer.JOBS_BY_NAME),
+                             default=tuple(materializer.JOBS_BY_NAME))
+    materialize.add_argument("--once", action="store_true", help="refresh each job once, write its status and exit")
+    materialize.add_argument("--full", action="store_true", help="with --once, recompute instead of folding in")
+    materialize.add_argument("--output", "-o", default="-", help="status output of --once (default stdout)")
+    reset = subparsers.add_parser("reset", help="empty the stores, and restore a fixture with --fixture")
+    reset.add_argument("--stores", nargs="+", choices=fixtures.STORES, default=fixtures.STORES)
+    reset.add_argument("--fixture", help="fixture directory written by save-fixture")
+    reset.add_argument("--concurrency", type=int, default=fixtures.WRITE_CONCURRENCY,
+                       help=f"Cassandra writes in flight per table (default {fixtures.WRITE_CONCURRENCY})")
+    save = subparsers.add_parser("save-fixture", help="export the stores into a fixture directory")
+    save.add_argument("--stores", nargs="+", choices=fixtures.STORES, default=fixtures.STORES)
+    save.add_argument("--fixture", required=True, help="fixture directory")
+    tag_graph = subparsers.add_parser("update-tag-graph",
+                                      help="recount the tags of the Cassandra posts into the Dgraph tag graph")
+    tag_graph.add_argument("--full", action="store_true", help="rebuild the graph from every post")
+    for subparser in (reset, save, tag_graph):
+        subparser.add_argument("--output", "-o", default="-", help="status output (default stdout)")
+    reset.add_argument("--materialize-dir", default=materializer.MATERIALIZE_DIR,
+                       help="materialized results of the reset stores are dropped")
+    # defaults of the per-command options, used by run-all and audit-queries
+    for subparser in (run_all, audit):
+        subparser.set_defaults(days=90, k=10, first=0, last=99999999, by_interest=False, sample_ranges=None,
+                               seed=None, by="tag")
+    return parser
+
+
+def run_command(command, stores, args, path, metrics=None, profiler=None):
+    """Run one command into `path` and return (rows, seconds)."""
+    start = time.perf_counter()
+    model = stores.get(command.store)
+    name = command.name.replace("-", "_")
+    scope = metrics.operation(name) if metrics is not None else nullcontext()
+    profile = profiler.operation(name) if profiler is not None else nullcontext()
+    with scope, profile, ResultWriter(path, args.format, args.stdout) as writer:
+        writer.write(command.run(model, args))
+    return writer.rows, time.perf_counter() - start
+
+
+def run_all(stores, args, metrics=None, profiler=None):
+    """Run the analytics of the selected stores concurrently, returns the number of failures."""
+    commands = [command for command in COMMANDS if command.analytic and command.store in args.stores
+                and (_TAG[0] not in command.arguments or args.tag)]
+    os.makedirs(args.output_dir, exist_ok=True)
+    # connect up front, the models are shared by the worker threads
+    for store in args.stores:
+        stores.get(store)
+    failures = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(commands)))) as executor:
+        futures = {executor.submit(run_command, command, stores, args,
+                                   os.path.join(args.output_dir, f"{command.name}.{args.format}"), metrics,
+                                   profiler): command
+                   for command in commands}
+        for future in as_completed(futures):
+            command = futures[future]
+            try:
+                rows, seconds = future.result()
+                print(f"{command.name}: {rows} rows in {seconds:.2f}s")
+            except Exception as e:
+                failures += 1
+                print(f"{command.name}: failed: {e}")
+    print(f"Ran {len(commands)} analytics in {time.perf_counter() - start:.2f}s, {failures} failed.")
+    return failures
+
+
+# Mongo reads of the HTTP service, audited next to the analytics
+_SERVICE_READS = (
+    ("posts_by", lambda model: model.posts_by("audit")),
+    ("recent_posts", lambda model: model.recent_posts()),
+    ("home_timeline", lambda model: model.home_timeline("audit")),
+    ("authenticate", lambda model: model.authenticate("audit", "audit")),
+)
+
+
+def audit_queries(stores, args, metrics=None):
+    """
+    Run every analytic and service read of the selected stores once, one at a time,
+    and write a row per distinct statement with its plan. `stores` must log to a
+    SlowQueryLog capturing every statement. Returns the number of failures.
+    """
+    # operation scopes name the statements, even when metrics are off
+    scopes = metrics or instrumentation.Metrics()
+    failures = 0
+    for command in COMMANDS:
+        if command.analytic and command.store in args.stores:
+            try:
+                run_command(command, stores, args, os.devnull, scopes)
+            except Exception as e:
+                failures += 1
+                print(f"{command.name}: failed: {e}")
+    if "mongo" in args.stores:
+        for name, read in _SERVICE_READS:
+            with scopes.operation(name):
+                read(stores.get("mongo"))
+    rows = stores.slow_log.summary()
+    with ResultWriter(args.output, args.format, args.stdout) as writer:
+        writer.write(rows)
+    flagged = sum(1 for row in rows if row["flags"])
+    print(f"Audited {len(rows)} statements, {flagged} flagged, {failures} analytics failed.")
+    return failures
+
+
+def materialize(stores, args, metrics=None):
+    """Refresh the selected jobs until interrupted, or once with --once. Returns the number of failures."""
+    runner = materializer.Runner(stores, [materializer.JOBS_BY_NAME[name] for name in args.jobs], metrics=metrics)
+    if not args.once:
+        print(f"Materializing {', '.join(args.jobs)} into {runner.results.directory}, Ctrl-C stops.")
+        try:
+            runner.run_forever()
+        except KeyboardInterrupt:
+            runner.stop()
+        return 0
+    failures = 0
+    for name in args.jobs:
+        entry = runner.run_job(name, args.full)
+        if entry is None:
+            failures += 1
+        else:
+            print(f"{name}: {entry.duration_s:.2f}s, {materializer.freshness(entry)}")
+    with ResultWriter(args.output, args.format, args.stdout) as writer:
+        writer.write(runner.status())
+    return failures
+
+
+def reset_stores(stores, args, metrics=None):
+    """Empty the selected stores, or restore them from --fixture, and write a status row per store."""
+    models = {store: stores.get(store) for store in args.stores}
+    if args.fixture:
+        rows = fixtures.restore(args.fixture, models, args.concurrency, metrics)
+    else:
+        rows = fixtures.reset(models, metrics)
+    # the watermarks of results materialized from the old data no longer hold
+    results = materializer.MaterializedStore(args.materialize_dir)
+    for job in materializer.JOBS:
+        if job.store in models:
+            results.discard(job.name)
+    with ResultWriter(args.output, args.format, args.stdout) as writer:
+        writer.write(rows)
+
+
+def save_fixture(stores, args, metrics=None):
+    models = {store: stores.get(store) for store in args.stores}
+    with ResultWriter(args.output, args.format, args.stdout) as writer:
+        writer.write(fixtures.save(args.fixture, models, metrics))
+
+
+def update_tag_graph(stores, args):
+    posts = stores.get("dgraph").update_tag_graph(stores.get("cassandra"), args.full)
+    with ResultWriter(args.output, args.format, args.stdout) as writer:
+        writer.write(_status(posts))
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.stdout = sys.stdout
+    metrics = instrumentation.METRICS if instrumentation.enabled() else None
+    if args.command == "audit-queries":
+        slow_log = slow_queries.SlowQueryLog(threshold_ms=0, path=None, trace_sample=1,
+                                             explain_verbosity="executionStats", capture_once=True)
+    else:
+        slow_log = slow_queries.SLOW_LOG if slow_queries.enabled() else None
+    stores = Stores(metrics, slow_log)
+    profiler = profiling.Profiler() if args.profile or profiling.enabled() else None
+    status = 0
+    # the models report progress with print(), keep stdout for the rows
+    with redirect_stdout(sys.stderr):
+        try:
+            if args.command == "run-all":
+                status = 1 if run_all(stores, args, metrics, profiler) else 0
+            elif args.command == "audit-queries":
+                status = 1 if audit_queries(stores, args, metrics) else 0
+            elif args.command == "materialize":
+                status = 1 if materialize(stores, args, metrics) else 0
+            elif args.command == "reset":
+                reset_stores(stores, args, metrics)
+            elif args.command == "save-fixture":
+                save_fixture(stores, args, metrics)
+            elif args.command == "update-tag-graph":
+                update_tag_graph(stores, args)
+            else:
+                rows, seconds = run_command(COMMANDS_BY_NAME[args.command], stores, args, args.output, metrics,
+                                            profiler)
+                print(f"{args.command}: {rows} rows in {seconds:.2f}s")
+        except Exception as e:
+            print(f"Error: {e}")
+            status = 1
+        finally:
+            stores.close()
+            if metrics is not None:
+                instrumentation.export_metrics(metrics)
+    return status
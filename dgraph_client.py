@@ -0,0 +1,83 @@
+import itertools
+import os
+import random
+import time
+
+import grpc
+import pydgraph
+
+DEFAULT_ALPHAS = "localhost:9080"
+MAX_MESSAGE_MB = 64
+KEEPALIVE_MS = 30000
+COMPRESSION = "gzip"
+TIMEOUT_SECONDS = 30.0
+MAX_RETRIES = 4
+BASE_DELAY = 0.1
+MAX_DELAY = 2.0
+
+_COMPRESSION = {"none": grpc.Compression.NoCompression, "gzip": grpc.Compression.Gzip,
+                "deflate": grpc.Compression.Deflate}
+_RETRYABLE_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.ABORTED)
+
+
+class DgraphSettings:
+    """Connection settings, every value can be overridden through the environment."""
+
+    def __init__(self, alphas=None, max_message_mb=None, keepalive_ms=None, compression=None, timeout=None,
+                 max_retries=None):
+        alphas = alphas or os.getenv("DGRAPH_ALPHAS", DEFAULT_ALPHAS)
+        if isinstance(alphas, str):
+            alphas = [alpha.strip() for alpha in alphas.split(",") if alpha.strip()]
+        self.alphas = alphas
+        self.max_message_mb = max_message_mb or int(os.getenv("DGRAPH_MAX_MESSAGE_MB", MAX_MESSAGE_MB))
+        self.keepalive_ms = keepalive_ms or int(os.getenv("DGRAPH_KEEPALIVE_MS", KEEPALIVE_MS))
+        self.compression = (compression or os.getenv("DGRAPH_COMPRESSION", COMPRESSION)).lower()
+        self.timeout = timeout or float(os.getenv("DGRAPH_TIMEOUT", TIMEOUT_SECONDS))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("DGRAPH_MAX_RETRIES", MAX_RETRIES))
+
+    def channel_options(self):
+        max_bytes = self.max_message_mb * 1024 * 1024
+        return [
+            ("grpc.max_send_message_length", max_bytes),
+            ("grpc.max_receive_message_length", max_bytes),
+            ("grpc.keepalive_time_ms", self.keepalive_ms),
+            ("grpc.keepalive_timeout_ms", max(1000, self.keepalive_ms // 3)),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+            ("grpc.default_compression_algorithm", int(_COMPRESSION[self.compression])),
+        ]
+
+
+class RoundRobinDgraphClient(pydgraph.DgraphClient):
+    """pydgraph picks a random stub per request, this one cycles through them in order."""
+
+    def __init__(self, *clients):
+        super().__init__(*clients)
+        self._next_client = itertools.cycle(clients)
+
+    def any_client(self):
+        return next(self._next_client)
+
+
+def connect(settings):
+    """One stub (and gRPC channel) per alpha, shared by a round-robin client."""
+    stubs = [pydgraph.DgraphClientStub(alpha, options=settings.channel_options()) for alpha in settings.alphas]
+    return stubs, RoundRobinDgraphClient(*stubs)
+
+
+def is_retryable(error):
+    if isinstance(error, (pydgraph.AbortedError, pydgraph.RetriableError)):
+        return True
+    return isinstance(error, grpc.RpcError) and error.code() in _RETRYABLE_CODES
+
+
+def with_retries(function, max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Call `function` again with jittered exponential backoff while it fails with aborted/unavailable."""
+    for attempt in itertools.count():
+        try:
+            return function()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
@@ -0,0 +1,287 @@
+import base64
+import heapq
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from dgraph_client import with_retries
+
+N_FEATURES = 2 ** 12
+N_CLUSTERS = 8
+BATCH_SIZE = 1000
+EPOCHS = 3
+TOP_KEYWORDS = 10
+REPRESENTATIVES = 5
+MODEL_ID = "interest_clusters"
+
+
+def encode_array(array):
+    return base64.b64encode(np.ascontiguousarray(array, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_array(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32).copy()
+
+
+def feature_indexes(interests, n_features=N_FEATURES):
+    """Stable hashing trick, crc32 so the buckets survive process restarts."""
+    return [zlib.crc32(interest.strip().lower().encode("utf-8")) % n_features for interest in interests]
+
+
+class InterestVectorizer:
+    """Hashed TF-IDF vectors of users' interests, L2 normalised."""
+
+    def __init__(self, n_features=N_FEATURES, idf=None):
+        self.n_features = n_features
+        self.idf = idf if idf is not None else np.ones(n_features, dtype=np.float32)
+
+    def fit_idf(self, interest_batches):
+        document_frequency = np.zeros(self.n_features, dtype=np.int64)
+        documents = 0
+        for batch in interest_batches:
+            for interests in batch:
+                document_frequency[np.unique(feature_indexes(interests, self.n_features))] += 1
+            documents += len(batch)
+        self.idf = (np.log((1 + documents) / (1 + document_frequency)) + 1).astype(np.float32)
+        return documents
+
+    def transform(self, batch):
+        matrix = np.zeros((len(batch), self.n_features), dtype=np.float32)
+        for row, interests in enumerate(batch):
+            np.add.at(matrix[row], feature_indexes(interests, self.n_features), 1.0)
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+
+class MiniBatchKMeans:
+    """Spherical mini-batch k-means, per-centroid learning rates as in Sculley (2010)."""
+
+    def __init__(self, n_clusters=N_CLUSTERS, seed=0, centroids=None, counts=None):
+        self.n_clusters = n_clusters
+        self.rng = np.random.default_rng(seed)
+        self.centroids = centroids
+        self.counts = counts
+
+    def _init_centroids(self, matrix):
+        # k-means++ seeding on the first batch
+        first = self.rng.integers(len(matrix))
+        chosen = [first]
+        distances = 1 - matrix @ matrix[first]
+        for _ in range(1, min(self.n_clusters, len(matrix))):
+            probabilities = np.clip(distances, 0, None)
+            total = probabilities.sum()
+            index = self.rng.choice(len(matrix), p=probabilities / total) if total > 0 else self.rng.integers(len(matrix))
+            chosen.append(index)
+            distances = np.minimum(distances, 1 - matrix @ matrix[index])
+        self.centroids = matrix[chosen].copy()
+        self.counts = np.zeros(len(chosen), dtype=np.int64)
+
+    def predict(self, matrix):
+        similarities = matrix @ self.centroids.T
+        labels = similarities.argmax(axis=1)
+        return labels, similarities[np.arange(len(matrix)), labels]
+
+    def partial_fit(self, matrix):
+        if len(matrix) == 0:
+            return np.empty(0, dtype=np.int64)
+        if self.centroids is None:
+            self._init_centroids(matrix)
+        labels, _ = self.predict(matrix)
+        for cluster in np.unique(labels):
+            members = matrix[labels == cluster]
+            self.counts[cluster] += len(members)
+            rate = len(members) / self.counts[cluster]
+            centroid = (1 - rate) * self.centroids[cluster] + rate * members.mean(axis=0)
+            norm = np.linalg.norm(centroid)
+            self.centroids[cluster] = centroid / norm if norm else centroid
+        return labels
+
+
+class InterestClustering:
+    """
+    Clusters users by interests and writes Cluster nodes back to Dgraph.
+
+    `refresh()` re-fits from scratch by streaming users page by page, so memory
+    depends on the batch size and the number of features, not on the number of
+    users. `assign_new()` places users that have no `clusters` edge yet on the
+    stored centroids and nudges those centroids, without touching anyone else.
+
+    A refresh replaces the old clusters with the new ones in one transaction and
+    marks the model complete once every user is reassigned, so a refresh
+    stopped halfway never leaves two generations of clusters, and the next
+    `assign_new()` runs a refresh again instead of assigning against it.
+    """
+
+    def __init__(self, client, queries, n_clusters=N_CLUSTERS, n_features=N_FEATURES, batch_size=BATCH_SIZE):
+        self.client = client
+        self.queries = queries
+        self.n_clusters = n_clusters
+        self.n_features = n_features
+        self.batch_size = batch_size
+
+    def _user_batches(self, unassigned_only=False):
+        query_filter = "@filter(NOT has(clusters))" if unassigned_only else ""
+        query = f"""
+            query users($first: int, $after: string) {{
+                users(func: has(interests), first: $first, after: $after) {query_filter} {{
+                    uid
+                    interests
+                }}
+            }}
+        """
+        with self.queries.snapshot() as txn:
+            batch = []
+            for node in self.queries.paginate(query, "users", txn=txn, page_size=self.batch_size):
+                batch.append(node)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def refresh(self):
+        vectorizer = InterestVectorizer(self.n_features)
+        users = vectorizer.fit_idf([node["interests"] for node in batch] for batch in self._user_batches())
+        if users == 0:
+            print("No users with interests to cluster.")
+            return 0
+
+        kmeans = MiniBatchKMeans(self.n_clusters)
+        for _ in range(EPOCHS):
+            for batch in self._user_batches():
+                kmeans.partial_fit(vectorizer.transform([node["interests"] for node in batch]))
+
+        cluster_uids = self._write_clusters(kmeans, vectorizer, self._stored_clusters())
+        keywords = [Counter() for _ in cluster_uids]
+        representatives = [[] for _ in cluster_uids]
+        sizes = np.zeros(len(cluster_uids), dtype=np.int64)
+        for batch in self._user_batches():
+            labels, similarities = kmeans.predict(vectorizer.transform([node["interests"] for node in batch]))
+            self._write_assignments(batch, labels, cluster_uids, replace=True)
+            for node, label, similarity in zip(batch, labels, similarities):
+                sizes[label] += 1
+                keywords[label].update(interest.strip().lower() for interest in node["interests"])
+                heap = representatives[label]
+                if len(heap) < REPRESENTATIVES:
+                    heapq.heappush(heap, (float(similarity), node["uid"]))
+                else:
+                    heapq.heappushpop(heap, (float(similarity), node["uid"]))
+
+        nodes = [{
+            "uid": cluster_uid,
+            "interest_keywords": [keyword for keyword, _ in keywords[label].most_common(TOP_KEYWORDS)],
+            "representative_users": [{"uid": uid} for _, uid in sorted(representatives[label], reverse=True)],
+            "cluster_size": int(sizes[label]),
+        } for label, cluster_uid in enumerate(cluster_uids)]
+        nodes.append({"uid": self._model_uid(), "complete": True})
+        with_retries(lambda: self.client.txn().mutate(set_obj=nodes, commit_now=True, timeout=self.queries.timeout),
+                     self.queries.max_retries)
+        print(f"Clustered {users} users into {len(cluster_uids)} clusters.")
+        return users
+
+    def assign_new(self):
+        model, clusters = self._stored_model(), self._stored_clusters()
+        if model is None or not clusters or model.get("complete") is False:
+            return self.refresh()
+
+        vectorizer = InterestVectorizer(model["n_features"], decode_array(model["idf"]))
+        kmeans = MiniBatchKMeans(len(clusters),
+                                 centroids=np.stack([decode_array(cluster["centroid"]) for cluster in clusters]),
+                                 counts=np.array([cluster.get("cluster_size", 0) for cluster in clusters]))
+        cluster_uids = [cluster["uid"] for cluster in clusters]
+        assigned = 0
+        for batch in self._user_batches(unassigned_only=True):
+            labels = kmeans.partial_fit(vectorizer.transform([node["interests"] for node in batch]))
+            self._write_assignments(batch, labels, cluster_uids)
+            assigned += len(batch)
+
+        if assigned:
+            nodes = [{
+                "uid": cluster_uid,
+                "centroid": encode_array(kmeans.centroids[label]),
+                "cluster_size": int(kmeans.counts[label]),
+            } for label, cluster_uid in enumerate(cluster_uids)]
+            with_retries(lambda: self.client.txn().mutate(set_obj=nodes, commit_now=True, timeout=self.queries.timeout),
+                         self.queries.max_retries)
+        print(f"Assigned {assigned} new users to existing clusters.")
+        return assigned
+
+    def _model_uid(self):
+        return self.queries.uids_by_key("model_id", [MODEL_ID]).get(MODEL_ID, "_:model")
+
+    def _write_clusters(self, kmeans, vectorizer, old_clusters):
+        """Replace `old_clusters` by the fitted ones in one transaction, returns the new cluster uids."""
+        nodes = [{
+            "uid": self._model_uid(),
+            "dgraph.type": "ClusterModel",
+            "model_id": MODEL_ID,
+            "n_features": vectorizer.n_features,
+            "idf": encode_array(vectorizer.idf),
+            "complete": False,
+        }]
+        for label, centroid in enumerate(kmeans.centroids):
+            nodes.append({
+                "uid": f"_:cluster{label}",
+                "dgraph.type": "Cluster",
+                "cluster_id": f"{MODEL_ID}-{label}",
+                "centroid": encode_array(centroid),
+                "cluster_size": 0,
+            })
+        res = with_retries(lambda: self._replace_clusters(old_clusters, nodes), self.queries.max_retries)
+        return [res.uids[f"cluster{label}"] for label in range(len(kmeans.centroids))]
+
+    def _replace_clusters(self, old_clusters, nodes):
+        txn = self.client.txn()
+        try:
+            if old_clusters:
+                txn.mutate(del_obj=[{"uid": cluster["uid"]} for cluster in old_clusters], timeout=self.queries.timeout)
+            res = txn.mutate(set_obj=nodes, timeout=self.queries.timeout)
+            txn.commit(timeout=self.queries.timeout)
+        finally:
+            txn.discard()
+        return res
+
+    def _write_assignments(self, batch, labels, cluster_uids, replace=False):
+        with_retries(lambda: self._write_assignments_once(batch, labels, cluster_uids, replace),
+                     self.queries.max_retries)
+
+    def _write_assignments_once(self, batch, labels, cluster_uids, replace):
+        edges = [{"uid": node["uid"], "clusters": [{"uid": cluster_uids[label]}]} for node, label in zip(batch, labels)]
+        txn = self.client.txn()
+        try:
+            if replace:
+                txn.mutate(del_obj=[{"uid": node["uid"], "clusters": None} for node in batch],
+                           timeout=self.queries.timeout)
+            txn.mutate(set_obj=edges, timeout=self.queries.timeout)
+            txn.commit(timeout=self.queries.timeout)
+        finally:
+            txn.discard()
+
+    def _stored_model(self):
+        query = """
+            query model($model: string) {
+                model(func: eq(model_id, $model)) {
+                    uid
+                    n_features
+                    idf
+                    complete
+                }
+            }
+        """
+        nodes = self.queries.query(query, {"$model": MODEL_ID}).get("model", [])
+        return nodes[0] if nodes and "idf" in nodes[0] else None
+
+    def _stored_clusters(self):
+        query = """
+            {
+                clusters(func: type(Cluster)) {
+                    uid
+                    centroid
+                    cluster_size
+                }
+            }
+        """
+        return [node for node in self.queries.query(query).get("clusters", []) if "centroid" in node]
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+
+from dgraph_client import with_retries
+from dgraph_query import parse_datetime
+
+DEFAULT_THRESHOLDS = (30, 90, 180)
+BATCH_SIZE = 1000
+
+
+def cutoff_for(days, now=None):
+    return (now or datetime.now(timezone.utc)) - timedelta(days=days)
+
+
+class InactivityScan:
+    """
+    Walks the `last_active` hour index below a relative cutoff and upserts one
+    Inactivity node per user and threshold, keyed by "<user uid>:<days>" so
+    repeated daily runs update the same nodes instead of piling up new ones,
+    and runs with other thresholds keep nodes of their own. The nodes of the
+    threshold whose users were active again since are deleted. Inactivity nodes
+    carry `last_active` too, so every read of the index keeps to the User nodes.
+    """
+
+    def __init__(self, client, queries, batch_size=BATCH_SIZE):
+        self.client = client
+        self.queries = queries
+        self.batch_size = batch_size
+
+    def run(self, days=90, now=None):
+        now = now or datetime.now(timezone.utc)
+        query = """
+            query inactive($cutoff: string, $first: int, $after: string) {
+                inactiveUsers(func: le(last_active, $cutoff), first: $first, after: $after) @filter(type(User)) {
+                    uid
+                    last_active
+                }
+            }
+        """
+        batch = []
+        recorded = 0
+        with self.queries.snapshot() as read_txn:
+            for node in self.queries.paginate(query, "inactiveUsers", {"$cutoff": cutoff_for(days, now)}, read_txn,
+                                              self.batch_size):
+                batch.append(node)
+                if len(batch) == self.batch_size:
+                    recorded += self._upsert(batch, days, now)
+                    batch = []
+        if batch:
+            recorded += self._upsert(batch, days, now)
+        removed = self._remove_active(days, cutoff_for(days, now))
+        print(f"Recorded {recorded} users inactive for at least {days} days, removed {removed} active again.")
+        return recorded
+
+    def _remove_active(self, days, cutoff):
+        """
+        Delete the Inactivity nodes of the `days` threshold whose users were active
+        after `cutoff`, and those written before nodes carried their threshold.
+        """
+        query = """
+            query stale($days: int, $cutoff: string, $first: int, $after: string) {
+                stale(func: type(Inactivity), first: $first, after: $after)
+                        @filter(eq(inactivity_days, $days) OR NOT has(inactivity_days)) {
+                    uid
+                    inactivity_days
+                    user @filter(gt(last_active, $cutoff)) {
+                        uid
+                    }
+                }
+            }
+        """
+        with self.queries.snapshot() as read_txn:
+            stale = [node["uid"] for node in self.queries.paginate(query, "stale", {"$days": days, "$cutoff": cutoff},
+                                                                    read_txn, self.batch_size)
+                     if node.get("user") or "inactivity_days" not in node]
+        for start in range(0, len(stale), self.batch_size):
+            batch = [{"uid": uid} for uid in stale[start:start + self.batch_size]]
+            with_retries(lambda: self.client.txn().mutate(del_obj=batch, commit_now=True, timeout=self.queries.timeout),
+                         self.queries.max_retries)
+        return len(stale)
+
+    def _upsert(self, users, days, now):
+        return with_retries(lambda: self._upsert_once(users, days, now), self.queries.max_retries)
+
+    def _upsert_once(self, users, days, now):
+        txn = self.client.txn()
+        try:
+            keys = [f"{user['uid']}:{days}" for user in users]
+            existing = self.queries.uids_by_key("inactivity_id", keys, txn)
+            nodes = []
+            for user, key in zip(users, keys):
+                last_active = parse_datetime(user["last_active"])
+                nodes.append({
+                    "uid": existing.get(key, f"_:{user['uid']}"),
+                    "dgraph.type": "Inactivity",
+                    "inactivity_id": key,
+                    "inactivity_days": days,
+                    "user": {"uid": user["uid"]},
+                    "last_active": user["last_active"],
+                    "inactivity_duration": (now - last_active).days,
+                })
+            txn.mutate(set_obj=nodes, timeout=self.queries.timeout)
+            txn.commit(timeout=self.queries.timeout)
+        finally:
+            txn.discard()
+        return len(users)
+
+    def summary(self, thresholds=DEFAULT_THRESHOLDS, now=None):
+        """Users inactive for at least each threshold, counted by the index in one round trip."""
+        thresholds = sorted(thresholds)
+        declarations = ", ".join(f"$c{days}: string" for days in thresholds)
+        blocks = "\n".join(f"t{days}(func: le(last_active, $c{days})) @filter(type(User)) {{ count(uid) }}"
+                           for days in thresholds)
+        query = f"query summary({declarations}) {{\n{blocks}\n}}"
+        res = self.queries.query(query, {f"$c{days}": cutoff_for(days, now) for days in thresholds})
+        return [(days, res[f"t{days}"][0]["count"] if res.get(f"t{days}") else 0) for days in thresholds]
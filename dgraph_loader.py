@@ -0,0 +1,105 @@
+import numpy as np
+
+from dgraph_client import with_retries
+from dgraph_query import to_variable
+
+MUTATION_BATCH = 5000
+
+
+class DatasetLoader:
+    """
+    Writes a SyntheticDataset as User, Post and Engagement nodes.
+
+    Nodes go in batches of blank nodes, one mutation each. The uids Dgraph
+    assigns to users are kept (one array slot per user) so posts and
+    engagements of later chunks can point at their users.
+    """
+
+    def __init__(self, client, queries, batch_size=MUTATION_BATCH):
+        self.client = client
+        self.queries = queries
+        self.batch_size = batch_size
+
+    def _create(self, nodes):
+        """Set the nodes in batches, returns the uid of every blank node name."""
+        uids = {}
+        for start in range(0, len(nodes), self.batch_size):
+            batch = nodes[start:start + self.batch_size]
+            res = with_retries(
+                lambda: self.client.txn().mutate(set_obj=batch, commit_now=True, timeout=self.queries.timeout),
+                self.queries.max_retries)
+            uids.update(res.uids)
+        return uids
+
+    def load(self, dataset):
+        user_uids = np.empty(dataset.n_users, dtype=object)
+        for chunk in dataset.users():
+            nodes = [{
+                "uid": f"_:u{index}",
+                "dgraph.type": "User",
+                "user_id": str(user_id),
+                "name": username,
+                "email": email,
+                "interests": interests,
+                "daily_usage": daily,
+                "weekly_usage": weekly,
+                "monthly_usage": monthly,
+                "yearly_usage": yearly,
+                "last_active": to_variable(last_active),
+            } for index, user_id, username, email, interests, daily, weekly, monthly, yearly, last_active in zip(
+                chunk["index"], chunk["user_id"], chunk["username"], chunk["email"], chunk["interests"],
+                chunk["daily_usage"], chunk["weekly_usage"], chunk["monthly_usage"], chunk["yearly_usage"],
+                chunk["last_active"])]
+            uids = self._create(nodes)
+            for index in chunk["index"]:
+                user_uids[index] = uids[f"u{index}"]
+
+        engagements = 0
+        for chunk in dataset.posts():
+            nodes = [{
+                "uid": f"_:p{position}",
+                "dgraph.type": "Post",
+                "post_id": str(post_id),
+                "content": content,
+                "content_length": len(content),
+                "views": views,
+                "likes": likes,
+                "comments": comments,
+                "shares": shares,
+                "engagement_count": likes + comments + shares,
+                "retention_time": retention,
+                "metric": metric,
+                "user": {"uid": user_uids[author]},
+            } for position, (post_id, content, views, likes, comments, shares, retention, metric, author) in enumerate(
+                zip(chunk["post_id"], chunk["content"], chunk["views"], chunk["like_count"], chunk["comment_count"],
+                    chunk["share_count"], chunk["retention_time"], chunk["metric"], chunk["author"]))]
+            uids = self._create(nodes)
+            post_uids = [uids[f"p{position}"] for position in range(len(nodes))]
+
+            nodes = []
+            for kind, rows in self._engagement_rows(dataset.engagement(chunk), chunk):
+                nodes.extend({
+                    "dgraph.type": "Engagement",
+                    "engagement_id": engagement_id,
+                    "type": kind,
+                    "user": {"uid": user_uids[user]},
+                    "post": {"uid": post_uids[post]},
+                    "timestamp": to_variable(timestamp),
+                } for engagement_id, post, user, timestamp in rows)
+            self._create(nodes)
+            engagements += len(nodes)
+        print(f"Loaded {dataset.n_users} users, {dataset.n_posts} posts and {engagements} engagements "
+              f"(seed {dataset.seed}).")
+        return engagements
+
+    @staticmethod
+    def _engagement_rows(engagement, posts):
+        post_indexes = posts["index"]
+        for kind, name in (("like", "likes"), ("share", "shares")):
+            rows = engagement[name]
+            yield kind, ((f"{kind}-{post_indexes[post]}-{user}", post, user, timestamp)
+                         for post, user, timestamp in zip(rows["post"], rows["user"], rows["timestamp"]))
+        rows = engagement["comments"]
+        yield "comment", ((str(comment_id), post, user, timestamp)
+                          for comment_id, post, user, timestamp
+                          in zip(rows["comment_id"], rows["post"], rows["user"], rows["timestamp"]))
@@ -1,20 +1,47 @@
+from datetime import datetime, timezone
+
 import pydgraph
 
+from dgraph_client import DgraphSettings, connect, with_retries
+from dgraph_query import QueryRunner, ClusterRecord, InactiveUser, to_record, parse_datetime
+from dgraph_trends import TrendRollup, read_trends
+from dgraph_clusters import InterestClustering
+from dgraph_inactivity import InactivityScan, DEFAULT_THRESHOLDS, cutoff_for
+from dgraph_usage import UsageDistribution
+from dgraph_reports import PostPerformanceReport
+from dgraph_influence import InfluencerRanking, DAMPING, TOLERANCE
+from dgraph_loader import DatasetLoader
+from dgraph_tags import TagGraph
+from result_cache import ResultCache, cached
+from synthetic import SyntheticDataset
+
 
 class DgraphModel:
-    def __init__(self, host="localhost:9080"):
-        self.client_stub = None
+    def __init__(self, host=None, settings=None):
+        # host may list several alphas separated by commas, DGRAPH_ALPHAS is used otherwise
+        self.settings = settings or DgraphSettings(host)
+        self.client_stubs = []
         self.client = None
-        self.host = host
+        self.queries = None
+        self.post_report = None
+        self.cache = ResultCache()
 
     def connect_to_dgraph(self):
-        self.client_stub = pydgraph.DgraphClientStub(self.host)
-        self.client = pydgraph.DgraphClient(self.client_stub)
-        print("Connected to Dgraph.")
+        self.client_stubs, client = connect(self.settings)
+        self.attach_client(client)
+        print(f"Connected to Dgraph ({', '.join(self.settings.alphas)}).")
+
+    def attach_client(self, client):
+        """Use an already built client, e.g. a stand-in for benchmarks."""
+        self.client = client
+        self.queries = QueryRunner(self.client, timeout=self.settings.timeout, max_retries=self.settings.max_retries)
+        self.post_report = PostPerformanceReport(self.queries)
+        self.cache.clear()
 
     def close_connection(self):
-        if self.client_stub:
-            self.client_stub.close()
+        if self.client_stubs:
+            for stub in self.client_stubs:
+                stub.close()
             print("Connection to Dgraph closed.")
 
     def set_schema(self):
@@ -30,6 +57,7 @@ class DgraphModel:
                 interests: [string]
                 last_active: datetime
                 clusters: [Cluster]
+                influence_score: float
             }
             type Post {
                 post_id: string
@@ -60,10 +88,23 @@ class DgraphModel:
                 engagement_count: int
                 engagement_percentage: float
             }
+            type RollupState {
+                rollup_id: string
+                watermark: datetime
+                last_uid: string
+            }
             type Cluster {
                 cluster_id: string
                 interest_keywords: [string]
                 representative_users: [User]
+                centroid: string
+                cluster_size: int
+            }
+            type ClusterModel {
+                model_id: string
+                n_features: int
+                idf: string
+                complete: bool
             }
             type Metric {
                 metric_id: string
@@ -72,10 +113,17 @@ class DgraphModel:
                 top_post: Post
             }
             type Inactivity {
+                inactivity_id: string
+                inactivity_days: int
                 user: User
                 last_active: datetime
                 inactivity_duration: int
             }
+            type Tag {
+                tag_name: string
+                post_count: int
+                co_occurs: [Tag]
+            }
 
             user_id: string @index(hash) .
             name: string @index(term) .
@@ -87,6 +135,7 @@ class DgraphModel:
             interests: [string] @index(term) .
             last_active: datetime @index(hour) .
             clusters: [uid] @reverse .
+            influence_score: float @index(float) .
             post_id: string @index(hash) .
             content: string @index(term) .
             content_length: int .
@@ -102,7 +151,7 @@ class DgraphModel:
             post: uid .
             timestamp: datetime @index(hour) .
             type: string @index(exact) .
-            trend_id: string .
+            trend_id: string @index(hash) @upsert .
             day: int @index(int) .
             week: int @index(int) .
             month: int @index(int) .
@@ -111,135 +160,267 @@ class DgraphModel:
             cluster_id: string .
             interest_keywords: [string] @index(term) .
             representative_users: [uid] .
+            centroid: string .
+            cluster_size: int .
+            model_id: string @index(hash) @upsert .
+            n_features: int .
+            idf: string .
+            complete: bool .
             metric_id: string .
             description: string .
             top_post: uid .
             inactivity_duration: int .
+            inactivity_id: string @index(hash) @upsert .
+            inactivity_days: int @index(int) .
+            rollup_id: string @index(hash) @upsert .
+            watermark: datetime .
+            last_uid: string .
+            tag_name: string @index(hash) @upsert .
+            post_count: int .
+            co_occurs: [uid] .
         """
         op = pydgraph.Operation(schema=schema)
-        self.client.alter(op)
+        with_retries(lambda: self.client.alter(op, timeout=self.settings.timeout), self.settings.max_retries)
         print("Schema with types set successfully.")
 
-    def analyze_platform_usage(client):
-        """Analyze platform usage time."""
-        query = """
-            {
-                usageStats(func: has(daily_usage)) {
-                    user_id
-                    name
-                    daily_usage
-                    weekly_usage
-                    monthly_usage
-                    yearly_usage
-                }
-            }
-        """
-        res = client.txn(read_only=True).query(query)
-        print(res.json.decode("utf-8"))
+    def clean_database(self):
+        """Drop every node and predicate, then apply the schema again."""
+        op = pydgraph.Operation(drop_all=True)
+        with_retries(lambda: self.client.alter(op, timeout=self.settings.timeout), self.settings.max_retries)
+        self.set_schema()
+        self.cache.clear()
+        print("Dgraph data dropped.")
 
-    def view_daily_engagement_trends(client):
-        """View daily engagement trends."""
-        query = """
-            {
-                dailyTrends(func: has(day)) {
-                    day: day
-                    total_engagement: count(uid)
-                }
-            }
-        """
-        res = client.txn(read_only=True).query(query)
-        print(res.json.decode("utf-8"))
+    def populate_database(self, dataset=None):
+        """Set the schema and load a sample dataset, or `dataset`, see synthetic.py."""
+        self.set_schema()
+        loaded = DatasetLoader(self.client, self.queries).load(dataset or SyntheticDataset(users=200, posts=1000))
+        self.cache.clear()
+        return loaded
 
-    def view_weekly_engagement_trends(client):
-        """View weekly engagement trends."""
-        query = """
-            {
-                weeklyTrends(func: has(week)) @groupby(week) {
-                    count: count(uid)
-                }
-            }
-        """
-        res = client.txn(read_only=True).query(query)
-        print(res.json.decode("utf-8"))
 
-    def view_monthly_engagement_trends(client):
-        """View monthly engagement trends."""
-        query = """
-            {
-                monthlyTrends(func: has(month)) @groupby(month) {
-                    count: count(uid)
-                }
-            }
-        """
-        res = client.txn(read_only=True).query(query)
-        print(res.json.decode("utf-8"))
+    # The analytics return their records, `show` prints them as well.
+
+    def analyze_platform_usage(self, by_interest=False, txn=None, show=True):
+        """Distribution of platform usage time per horizon, optionally per interest."""
+        overall, by_segment = UsageDistribution(self.queries).compute(by_interest, txn)
+        if show:
+            for stats in overall.values():
+                print(f"{stats.horizon}: users={stats.users}, mean={stats.mean:.2f}, stddev={stats.stddev:.2f}, "
+                      f"p50={stats.p50:.2f}, p90={stats.p90:.2f}, p99={stats.p99:.2f}, "
+                      f"top 1% share={stats.power_user_share:.1%}")
+            for interest, segment in sorted(by_segment.items()):
+                daily = segment["daily_usage"]
+                print(f"Interest: {interest}, users={daily.users}, daily mean={daily.mean:.2f}, "
+                      f"daily p90={daily.p90:.2f}")
+        return overall, by_segment
+
+    def _engagement_trends(self, granularity, first_period, last_period, txn, show):
+        trends = read_trends(self.queries, granularity, first_period, last_period, txn)
+        if show:
+            for bucket in trends:
+                print(f"{granularity.capitalize()}: {bucket.period}, Engagement: {bucket.count}, "
+                      f"Percentage: {bucket.percentage}%")
+        return trends
+
+    def view_daily_engagement_trends(self, first_day=0, last_day=99999999, txn=None, show=True):
+        """View daily engagement trends, days are encoded as YYYYMMDD."""
+        return self._engagement_trends("day", first_day, last_day, txn, show)
+
+    def view_weekly_engagement_trends(self, first_week=0, last_week=999999, txn=None, show=True):
+        """View weekly engagement trends, ISO weeks are encoded as YYYYWW."""
+        return self._engagement_trends("week", first_week, last_week, txn, show)
+
+    def view_monthly_engagement_trends(self, first_month=0, last_month=999999, txn=None, show=True):
+        """View monthly engagement trends, months are encoded as YYYYMM."""
+        return self._engagement_trends("month", first_month, last_month, txn, show)
 
-    def view_yearly_engagement_trends(client):
+    def view_yearly_engagement_trends(self, first_year=0, last_year=9999, txn=None, show=True):
         """View yearly engagement trends."""
-        query = """
-            {
-                yearlyTrends(func: has(year)) @groupby(year) {
-                    count: count(uid)
-                }
-            }
-        """
-        res = client.txn(read_only=True).query(query)
-        print(res.json.decode("utf-8"))
+        return self._engagement_trends("year", first_year, last_year, txn, show)
+
+    def rollup_engagement_trends(self, full=False):
+        """Fold the engagements added since the last rollup into the Trend nodes, or recount them all with `full`."""
+        return TrendRollup(self.client, self.queries).run(full)
+
+    def engagement_trends_watermark(self):
+        """Timestamp of the newest engagement folded into the Trend nodes."""
+        return TrendRollup(self.client, self.queries).watermark()
+
+    def update_tag_graph(self, cassandra_model, full=False):
+        """Recount the tag pairs of the Cassandra posts and write the changes to the co-occurrence graph."""
+        try:
+            return TagGraph(self.client, self.queries).update(cassandra_model.post_tags, full)
+        finally:
+            self.cache.invalidate("dgraph.tags")
 
-    def cluster_users_by_interests(client):
+    def related_tags(self, tag, k=10, txn=None, show=True):
+        """The `k` tags most often used together with `tag`, by posts sharing them."""
+        related = self._cached_related_tags(tag, k) if txn is None else self._read_related_tags(tag, k, txn)
+        if show:
+            if not related:
+                print(f"No tags seen together with {tag}.")
+            for name, posts in related:
+                print(f"Tag: {name}, Posts together: {posts}")
+        return related
+
+    @cached("related_tags", ttl=300, tags=("dgraph.tags",))
+    def _cached_related_tags(self, tag, k):
+        return self._read_related_tags(tag, k)
+
+    def _read_related_tags(self, tag, k, txn=None):
+        return TagGraph(self.client, self.queries).related(tag, k, txn)
+
+    def cluster_users_by_interests(self, txn=None, show=True):
         """Cluster users by interests."""
+        # a caller's snapshot is read as is, otherwise the clusters come from the cache
+        clusters = self._cached_clusters() if txn is None else self._read_clusters(txn)
+        if show:
+            for record in clusters:
+                representatives = ", ".join(user.get("name", user.get("user_id", ""))
+                                            for user in record.representative_users or [])
+                print(f"Cluster: {record.cluster_id}, Users: {record.cluster_size}, "
+                      f"Interests: {', '.join(record.interest_keywords or [])}, Representatives: {representatives}")
+        return clusters
+
+    @cached("cluster_users_by_interests", ttl=900, tags=("dgraph.clusters",))
+    def _cached_clusters(self):
+        return self._read_clusters()
+
+    def _read_clusters(self, txn=None):
         query = """
-            {
-                interestClusters(func: has(interests)) {
-                    interest_keywords: interests
-                    users: ~clusters {
+            query clusters($first: int, $after: string) {
+                interestClusters(func: type(Cluster), first: $first, after: $after) {
+                    uid
+                    cluster_id
+                    interest_keywords
+                    representative_users {
                         user_id
                         name
                     }
+                    cluster_size: count(~clusters)
                 }
             }
         """
-        res = client.txn(read_only=True).query(query)
-        print(res.json.decode("utf-8"))
+        return list(self.queries.records(ClusterRecord, query, "interestClusters", txn=txn))
 
-    def identify_inactive_users(client):
-        """Identify inactive users."""
-        query = """
-            {
-                inactiveUsers(func: le(last_active, "2024-01-01T00:00:00Z")) {
+    def refresh_interest_clusters(self, full=False):
+        """Assign new users to the stored clusters, or re-fit them all with `full`."""
+        clustering = InterestClustering(self.client, self.queries)
+        try:
+            return clustering.refresh() if full else clustering.assign_new()
+        finally:
+            self.cache.invalidate("dgraph.clusters")
+
+    def identify_inactive_users(self, days=90, txn=None, show=True, active_after=None, now=None):
+        """
+        Identify users not active in the last `days` days. With `active_after`, only
+        those last active after it, i.e. the users who crossed the threshold since
+        an earlier cutoff.
+        """
+        # Inactivity nodes hold a last_active as well, only the users are read
+        since = (("$since: string, ", "@filter(type(User) AND gt(last_active, $since))") if active_after is not None
+                 else ("", "@filter(type(User))"))
+        query = f"""
+            query inactive($cutoff: string, {since[0]}$first: int, $after: string) {{
+                inactiveUsers(func: le(last_active, $cutoff), first: $first, after: $after) {since[1]} {{
+                    uid
                     user_id
                     name
                     last_active
-                }
-            }
+                }}
+            }}
         """
-        res = client.txn(read_only=True).query(query)
-        print(res.json.decode("utf-8"))
+        now = now or datetime.now(timezone.utc)
+        variables = {"$cutoff": cutoff_for(days, now)}
+        if active_after is not None:
+            variables["$since"] = active_after
+        inactive = []
+        for node in self.queries.paginate(query, "inactiveUsers", variables, txn):
+            node["inactivity_duration"] = (now - parse_datetime(node["last_active"])).days
+            record = to_record(InactiveUser, node)
+            inactive.append(record)
+            if show:
+                print(f"User ID: {record.user_id}, Name: {record.name}, Last Active: {record.last_active}, "
+                      f"Inactive for: {record.inactivity_duration} days")
+        return inactive
 
-    def analyze_post_retention(client):
-        """Analyze post retention."""
+    def users_active_since(self, since, txn=None):
+        """Uids of the users active after `since`, through the `last_active` index."""
         query = """
-            {
-                retentionAnalysis(func: has(retention_time)) {
-                    post_id
-                    retention_time
-                    engagement_count
+            query active($since: string, $first: int, $after: string) {
+                activeUsers(func: gt(last_active, $since), first: $first, after: $after) @filter(type(User)) {
+                    uid
                 }
             }
         """
-        res = client.txn(read_only=True).query(query)
-        print(res.json.decode("utf-8"))
+        return [node["uid"] for node in self.queries.paginate(query, "activeUsers", {"$since": since}, txn)]
+
+    def record_inactive_users(self, days=90):
+        """Upsert Inactivity nodes for users not active in the last `days` days."""
+        return InactivityScan(self.client, self.queries).run(days)
+
+    def inactive_users_summary(self, thresholds=DEFAULT_THRESHOLDS, show=True):
+        """Count users inactive for at least each threshold, in days."""
+        summary = InactivityScan(self.client, self.queries).summary(thresholds)
+        if show:
+            for days, count in summary:
+                print(f"Inactive for {days}+ days: {count} users")
+        return summary
+
+    def analyze_post_retention(self, txn=None, show=True):
+        """Retention histogram and engagement-weighted retention per content length band."""
+        report = self._post_report() if txn is None else self.post_report.run(txn=txn)
+        if show:
+            for band in report.retention_bands:
+                print(f"Content length {band.min_length}-{band.max_length}: posts={band.posts}, "
+                      f"mean retention={band.mean_retention:.2f}, weighted retention={band.weighted_retention:.2f}")
+            for bin in report.retention_histogram:
+                print(f"Retention {bin.low:g}-{bin.high:g}: {bin.posts} posts")
+        return report.retention_bands, report.retention_histogram
 
-    def find_top_performing_post(client):
-        """Find top-performing post by metric."""
+    def find_top_performing_post(self, k=1, txn=None, show=True):
+        """Find the top `k` performing posts for every metric."""
+        report = self._post_report(k) if txn is None else self.post_report.run(k, txn)
+        if show:
+            for metric, posts in sorted(report.top_posts.items()):
+                for record in posts:
+                    print(f"Metric: {metric}, Post ID: {record.post_id}, Engagement: {record.engagement_count}")
+        return report.top_posts
+
+    # a caller's snapshot is read as is, like the clusters
+    @cached("post_performance_report", ttl=300, tags=("dgraph",))
+    def _post_report(self, k=5):
+        return self.post_report.run(k)
+
+    def rank_influencers(self, damping=DAMPING, tolerance=TOLERANCE):
+        """Score every user with PageRank over the engagement graph and store it as influence_score."""
+        return InfluencerRanking(self.client, self.queries).run(damping, tolerance)
+
+    def top_influencers(self, k=10, txn=None, show=True):
+        """Users with the highest stored influence_score."""
         query = """
-            {
-                topPosts(func: has(metric), orderdesc: engagement_count, first: 1) {
-                    post_id
-                    metric
-                    engagement_count
+            query influencers($k: int) {
+                influencers(func: has(influence_score), orderdesc: influence_score, first: $k) {
+                    user_id
+                    name
+                    influence_score
                 }
             }
         """
-        res = client.txn(read_only=True).query(query)
-        print(res.json.decode("utf-8"))
+        influencers = self.queries.query(query, {"$k": k}, txn).get("influencers", [])
+        if show:
+            for user in influencers:
+                print(f"User ID: {user.get('user_id')}, Name: {user.get('name')}, "
+                      f"Influence: {user['influence_score']:.6f}")
+        return influencers
+
+    def platform_report(self, inactive_days=90, show=True):
+        """Run the read-only analytics against one consistent snapshot."""
+        with self.queries.snapshot() as txn:
+            return {
+                "usage": self.analyze_platform_usage(txn=txn, show=show),
+                "inactive_users": self.identify_inactive_users(inactive_days, txn, show),
+                "retention": self.analyze_post_retention(txn, show),
+                "top_posts": self.find_top_performing_post(txn=txn, show=show),
+            }
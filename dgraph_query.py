@@ -0,0 +1,150 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from dgraph_client import MAX_RETRIES, with_retries
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional, the stdlib decoder also accepts bytes
+    import json
+    _loads = json.loads
+
+
+DEFAULT_PAGE_SIZE = 1000
+FIRST_UID = "0x0"
+
+
+# Typed records returned by the Dgraph analytics
+
+class TrendBucket(NamedTuple):
+    period: int
+    count: int
+    percentage: float = None
+
+
+class ClusterRecord(NamedTuple):
+    uid: str
+    cluster_id: str
+    interest_keywords: list
+    representative_users: list
+    cluster_size: int
+
+
+class InactiveUser(NamedTuple):
+    uid: str
+    user_id: str
+    name: str
+    last_active: str
+    inactivity_duration: int = None
+
+
+class TopPost(NamedTuple):
+    uid: str
+    post_id: str
+    metric: str
+    engagement_count: int
+
+
+def to_record(record_type, node):
+    """Build a record from a decoded node, missing predicates become None."""
+    return record_type._make(node.get(field) for field in record_type._fields)
+
+
+def parse_datetime(value):
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def to_variable(value):
+    """GraphQL+- variables travel as strings, datetimes in RFC 3339."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class QueryRunner:
+    """Runs parameterized queries and decodes the responses."""
+
+    def __init__(self, client, page_size=DEFAULT_PAGE_SIZE, timeout=None, max_retries=MAX_RETRIES):
+        self.client = client
+        self.page_size = page_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    @contextmanager
+    def snapshot(self):
+        """Read-only best-effort transaction shared by every query of a report."""
+        txn = self.client.txn(read_only=True, best_effort=True)
+        try:
+            yield txn
+        finally:
+            txn.discard()
+
+    def query(self, query, variables=None, txn=None):
+        """Run a query and return the decoded response as a dict."""
+        if variables:
+            variables = {name: to_variable(value) for name, value in variables.items()}
+        if txn is None:
+            # a txn is bound to the stub it was created with, each attempt takes a new one and so the next alpha
+            res = with_retries(lambda: self._run_alone(query, variables), self.max_retries)
+        else:
+            res = with_retries(lambda: txn.query(query, variables=variables, timeout=self.timeout), self.max_retries)
+        return _loads(res.json)
+
+    def _run_alone(self, query, variables):
+        with self.snapshot() as txn:
+            return txn.query(query, variables=variables, timeout=self.timeout)
+
+    def paginate(self, query, block, variables=None, txn=None, page_size=None, after=FIRST_UID):
+        """
+        Yield the nodes of `block` page by page, from the first uid above `after`.
+
+        The query must declare `$first: int` and `$after: string` and use them
+        as `first: $first, after: $after` on the root function of `block`.
+        """
+        page_size = page_size or self.page_size
+        variables = dict(variables or {})
+        while True:
+            variables["$first"] = page_size
+            variables["$after"] = after
+            nodes = self.query(query, variables, txn).get(block, [])
+            yield from nodes
+            if len(nodes) < page_size:
+                return
+            after = nodes[-1]["uid"]
+
+    def records(self, record_type, query, block, variables=None, txn=None, page_size=None):
+        """Paginate `block` and build one record per node."""
+        for node in self.paginate(query, block, variables, txn, page_size):
+            yield to_record(record_type, node)
+
+    def uids_by_key(self, key, values, txn=None):
+        """Map each value of an indexed `key` predicate to the uid of its node."""
+        if not values:
+            return {}
+        query = f"""
+            {{
+                nodes(func: eq({key}, {string_list(values)})) {{
+                    uid
+                    {key}
+                }}
+            }}
+        """
+        return {node[key]: node["uid"] for node in self.query(query, txn=txn).get("nodes", [])}
+
+
+def string_list(values):
+    """Inline list literal for eq(), variables cannot carry lists."""
+    return "[" + ", ".join(_quote(value) for value in values) + "]"
+
+
+def _quote(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
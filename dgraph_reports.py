@@ -0,0 +1,120 @@
+from typing import NamedTuple
+
+from dgraph_query import TopPost, to_record
+
+CONTENT_LENGTH_BANDS = (0, 50, 100, 200, 500, 1000, 10 ** 9)
+RETENTION_BINS = (0.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1e18)
+
+
+class RetentionBand(NamedTuple):
+    min_length: int
+    max_length: int
+    posts: int
+    mean_retention: float
+    weighted_retention: float
+
+
+class HistogramBin(NamedTuple):
+    low: float
+    high: float
+    posts: int
+
+
+class PostReport(NamedTuple):
+    metric_posts: dict
+    top_posts: dict
+    retention_bands: list
+    retention_histogram: list
+
+
+class PostPerformanceReport:
+    """
+    Top-K posts per metric and retention buckets in one multi-block query.
+
+    The metric names come from the `@groupby(metric)` block of the previous
+    run, so a steady state report is a single round trip; a metric seen for
+    the first time costs one extra query.
+    """
+
+    def __init__(self, queries, bands=CONTENT_LENGTH_BANDS, bins=RETENTION_BINS):
+        self.queries = queries
+        self.bands = bands
+        self.bins = bins
+        self.metrics = []
+
+    def build_query(self, metrics):
+        declarations = ["$k: int"]
+        blocks = ["metrics(func: has(metric)) @groupby(metric) { count: count(uid) }"]
+        for index, _ in enumerate(metrics):
+            declarations.append(f"$m{index}: string")
+            blocks.append(f"""top{index}(func: eq(metric, $m{index}), orderdesc: engagement_count, first: $k) {{
+                uid
+                post_id
+                metric
+                engagement_count
+            }}""")
+
+        blocks.append("posts as var(func: has(retention_time))")
+        for index in range(len(self.bands) - 1):
+            declarations += [f"$b{index}lo: int", f"$b{index}hi: int"]
+            blocks.append(f"""var(func: uid(posts)) @filter(ge(content_length, $b{index}lo) AND lt(content_length, $b{index}hi)) {{
+                r{index} as retention_time
+                e{index} as engagement_count
+                w{index} as math(r{index} * e{index})
+            }}
+            band{index}_posts(func: uid(r{index})) {{ count(uid) }}
+            band{index}() {{
+                mean: avg(val(r{index}))
+                weighted: sum(val(w{index}))
+                engagement: sum(val(e{index}))
+            }}""")
+        for index in range(len(self.bins) - 1):
+            declarations += [f"$h{index}lo: float", f"$h{index}hi: float"]
+            blocks.append(f"hist{index}(func: uid(posts)) "
+                          f"@filter(ge(retention_time, $h{index}lo) AND lt(retention_time, $h{index}hi)) {{ count(uid) }}")
+        return f"query report({', '.join(declarations)}) {{\n" + "\n".join(blocks) + "\n}"
+
+    def variables(self, metrics, k):
+        variables = {"$k": k}
+        for index, metric in enumerate(metrics):
+            variables[f"$m{index}"] = metric
+        for index in range(len(self.bands) - 1):
+            variables[f"$b{index}lo"], variables[f"$b{index}hi"] = self.bands[index], self.bands[index + 1]
+        for index in range(len(self.bins) - 1):
+            variables[f"$h{index}lo"], variables[f"$h{index}hi"] = self.bins[index], self.bins[index + 1]
+        return variables
+
+    def run(self, k=5, txn=None):
+        metrics = list(self.metrics)
+        res = self.queries.query(self.build_query(metrics), self.variables(metrics, k), txn)
+        metric_posts = {row["metric"]: row["count"]
+                        for group in res.get("metrics", []) for row in group.get("@groupby", [])}
+        if set(metric_posts) - set(metrics):
+            # new metrics showed up, run again so that every metric gets its top-K block
+            self.metrics = sorted(metric_posts)
+            return self.run(k, txn)
+
+        return PostReport(
+            metric_posts=metric_posts,
+            top_posts={metric: [to_record(TopPost, node) for node in res.get(f"top{index}", [])]
+                       for index, metric in enumerate(metrics) if metric in metric_posts},
+            retention_bands=[self._band(res, index) for index in range(len(self.bands) - 1)],
+            retention_histogram=[HistogramBin(self.bins[index], self.bins[index + 1], _count(res, f"hist{index}"))
+                                 for index in range(len(self.bins) - 1)],
+        )
+
+    def _band(self, res, index):
+        aggregates = {}
+        for row in res.get(f"band{index}", []):
+            aggregates.update(row)
+        engagement = aggregates.get("engagement") or 0
+        return RetentionBand(
+            self.bands[index], self.bands[index + 1], _count(res, f"band{index}_posts"),
+            aggregates.get("mean") or 0.0,
+            aggregates.get("weighted", 0.0) / engagement if engagement else 0.0,
+        )
+
+
+def _count(res, block):
+    rows = res.get(block) or [{}]
+    return rows[0].get("count", 0)
@@ -0,0 +1,209 @@
+import numpy as np
+
+from dgraph_client import with_retries
+
+FLUSH_PAIRS = 1 << 20
+TAG_BATCH = 500
+EDGE_BATCH = 5000
+
+
+class PairCounts:
+    """
+    Sparse tag co-occurrence counts.
+
+    Tags get int ids, a pair is one int64 code (low id << 32 | high id), and
+    the codes seen are kept sorted and unique next to their counts. New pairs
+    are buffered and merged in with np.unique every `flush_pairs` pairs, so
+    memory grows with the distinct pairs, not with the posts.
+    """
+
+    def __init__(self, flush_pairs=FLUSH_PAIRS):
+        self.flush_pairs = flush_pairs
+        self.ids = {}
+        self.names = []
+        self.posts = []  # posts per tag id
+        self.codes = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self._pending = []
+
+    def add(self, tags):
+        ids = sorted({self._id(tag) for tag in tags})
+        for position, low in enumerate(ids):
+            self.posts[low] += 1
+            self._pending.extend(low << 32 | high for high in ids[position + 1:])
+        if len(self._pending) >= self.flush_pairs:
+            self._flush()
+
+    def _id(self, tag):
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            tag_id = self.ids[tag] = len(self.names)
+            self.names.append(tag)
+            self.posts.append(0)
+        return tag_id
+
+    def _flush(self):
+        if not self._pending:
+            return
+        codes = np.concatenate([self.codes, np.array(self._pending, dtype=np.int64)])
+        counts = np.concatenate([self.counts, np.ones(len(self._pending), dtype=np.int64)])
+        self._pending = []
+        self.codes, inverse = np.unique(codes, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts).astype(np.int64)
+
+    @property
+    def n_pairs(self):
+        self._flush()
+        return len(self.codes)
+
+    def edges(self):
+        """(source ids, target ids, counts) of both directions of every pair, sorted by source."""
+        self._flush()
+        low, high = self.codes >> 32, self.codes & 0xFFFFFFFF
+        sources = np.concatenate([low, high])
+        order = np.argsort(sources, kind="stable")
+        return (sources[order], np.concatenate([high, low])[order],
+                np.concatenate([self.counts, self.counts])[order])
+
+
+class TagGraph:
+    """
+    Tag nodes linked by `co_occurs` edges, weighted by a `weight` facet with the
+    number of posts carrying both tags. Each pair is stored in both directions so
+    the related tags of any tag are one traversal of its edges, sorted by weight.
+
+    The posts table has no time-ordered key to read new posts from, so an update
+    counts the pairs of every post again and writes only what changed: the post
+    counts and weights that differ from the stored graph, and the deletions of the
+    edges no pair backs any more. Late posts, deleted posts and replayed ingests are
+    therefore counted right, and batches are committed on their own, an update
+    stopped halfway is completed by the next one. A full update clears every edge
+    first and writes them all.
+    """
+
+    def __init__(self, client, queries):
+        self.client = client
+        self.queries = queries
+
+    def update(self, read_posts, full=False):
+        """Count the tag pairs of the (tags,) rows of read_posts() and write the changes."""
+        counts, posts = PairCounts(), 0
+        for (tags,) in read_posts():
+            if tags:
+                counts.add(tags)
+                posts += 1
+        if full:
+            self._clear()
+        tags, edges = self._read_graph()
+        uids, written_tags = self._write_tags(counts, tags)
+        written, removed = self._write_edges(counts, uids, edges)
+        print(f"Counted {posts} tagged posts: {len(counts.names)} tags and {counts.n_pairs} tag pairs. "
+              f"Wrote {written_tags} tags and {written} edges, removed {removed} edges.")
+        return posts
+
+    def related(self, tag, k=10, txn=None):
+        """The `k` tags seen most often with `tag`, as (tag, posts together) pairs."""
+        query = """
+            query related($tag: string, $k: int) {
+                tag(func: eq(tag_name, $tag)) {
+                    co_occurs (first: $k) @facets(orderdesc: weight) {
+                        tag_name
+                    }
+                }
+            }
+        """
+        nodes = self.queries.query(query, {"$tag": tag, "$k": k}, txn).get("tag", [])
+        neighbors = nodes[0].get("co_occurs", []) if nodes else []
+        return [(node["tag_name"], node.get("co_occurs|weight", 0)) for node in neighbors]
+
+    def _read_graph(self):
+        """The stored Tag nodes by name, as (uid, post_count), and the weights by (source uid, target uid)."""
+        query = """
+            query tags($first: int, $after: string) {
+                tags(func: type(Tag), first: $first, after: $after) {
+                    uid
+                    tag_name
+                    post_count
+                    co_occurs @facets(weight) {
+                        uid
+                    }
+                }
+            }
+        """
+        tags, edges = {}, {}
+        with self.queries.snapshot() as txn:
+            for node in self.queries.paginate(query, "tags", txn=txn, page_size=TAG_BATCH):
+                tags[node["tag_name"]] = (node["uid"], node.get("post_count", 0))
+                for neighbor in node.get("co_occurs", []):
+                    edges[node["uid"], neighbor["uid"]] = neighbor.get("co_occurs|weight", 0)
+        return tags, edges
+
+    def _clear(self):
+        uids = [uid for uid, _ in self._read_graph()[0].values()]
+        for batch in _batches(uids, TAG_BATCH):
+            nodes = [{"uid": uid, "co_occurs": None} for uid in batch]
+            self._in_own_txn(lambda txn: txn.mutate(del_obj=nodes, timeout=self.queries.timeout))
+
+    def _write_tags(self, counts, tags):
+        """Create the new Tag nodes and set the post counts that changed, returns the uids by tag id."""
+        uids = {}
+        changed = [tag_id for tag_id, name in enumerate(counts.names)
+                   if tags.get(name, (None, None))[1] != counts.posts[tag_id]]
+        for tag_id, name in enumerate(counts.names):
+            if name in tags:
+                uids[tag_id] = tags[name][0]
+        for batch in _batches(changed, TAG_BATCH):
+            nodes = [{"uid": uids.get(tag_id, f"_:t{tag_id}"), "dgraph.type": "Tag", "tag_name": counts.names[tag_id],
+                      "post_count": counts.posts[tag_id]} for tag_id in batch]
+            assigned = self._in_own_txn(lambda txn: txn.mutate(set_obj=nodes, timeout=self.queries.timeout).uids)
+            for tag_id in batch:
+                uids.setdefault(tag_id, assigned.get(f"t{tag_id}"))
+        # tags no post carries any more keep their node, with no posts and no edges
+        gone = [uid for name, (uid, post_count) in tags.items() if name not in counts.ids and post_count]
+        for batch in _batches(gone, TAG_BATCH):
+            nodes = [{"uid": uid, "post_count": 0} for uid in batch]
+            self._in_own_txn(lambda txn: txn.mutate(set_obj=nodes, timeout=self.queries.timeout))
+        return uids, len(changed) + len(gone)
+
+    def _write_edges(self, counts, uids, edges):
+        """Set the weights that changed and delete the edges left without posts, returns both counts."""
+        sources, targets, weights = counts.edges()
+        changed = {}
+        written = 0
+        for source, target, weight in zip(sources.tolist(), targets.tolist(), weights.tolist()):
+            key = (uids[source], uids[target])
+            if edges.pop(key, None) != weight:
+                changed.setdefault(key[0], []).append({"uid": key[1], "co_occurs|weight": weight})
+                written += 1
+        # the edges left in `edges` have no post behind them
+        stale = {}
+        for source_uid, target_uid in edges:
+            stale.setdefault(source_uid, []).append({"uid": target_uid})
+        for mutation, nodes in (("set_obj", changed), ("del_obj", stale)):
+            batch, size = [], 0
+            for source_uid, neighbors in nodes.items():
+                batch.append({"uid": source_uid, "co_occurs": neighbors})
+                size += len(neighbors)
+                if size >= EDGE_BATCH:
+                    self._in_own_txn(lambda txn: txn.mutate(**{mutation: batch}, timeout=self.queries.timeout))
+                    batch, size = [], 0
+            if batch:
+                self._in_own_txn(lambda txn: txn.mutate(**{mutation: batch}, timeout=self.queries.timeout))
+        return written, len(edges)
+
+    def _in_own_txn(self, write):
+        def attempt():
+            txn = self.client.txn()
+            try:
+                result = write(txn)
+                txn.commit(timeout=self.queries.timeout)
+                return result
+            finally:
+                txn.discard()
+        return with_retries(attempt, self.queries.max_retries)
+
+
+def _batches(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,173 @@
+from collections import Counter
+from datetime import datetime, timezone
+
+import pydgraph
+
+from dgraph_client import with_retries
+from dgraph_query import FIRST_UID, TrendBucket, to_variable, parse_datetime
+
+GRANULARITIES = ("day", "week", "month", "year")
+ROLLUP_ID = "engagement_trends"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MUTATION_BATCH = 500
+
+
+def bucket_keys(timestamp):
+    """Integer bucket of a timestamp for every granularity, e.g. day=20240115, week=202403."""
+    iso_year, iso_week, _ = timestamp.isocalendar()
+    return {
+        "day": timestamp.year * 10000 + timestamp.month * 100 + timestamp.day,
+        "week": iso_year * 100 + iso_week,
+        "month": timestamp.year * 100 + timestamp.month,
+        "year": timestamp.year,
+    }
+
+
+class TrendRollup:
+    """
+    Aggregates Engagement timestamps into Trend nodes.
+
+    The watermark is the highest Engagement uid rolled up: only engagements with
+    a higher uid are read, whatever their timestamp, so backfills and replayed
+    logs are counted. Their counts are added to the existing buckets and the
+    watermark moves forward in the same transaction, so an aborted run leaves
+    nothing half applied.
+
+    Uids follow insertion only roughly: each alpha leases its own block of them,
+    and a transaction may commit after one holding higher uids was rolled up.
+    Such engagements are missed until a full run, which recounts every
+    engagement and replaces the buckets.
+    """
+
+    def __init__(self, client, queries):
+        self.client = client
+        self.queries = queries
+
+    def run(self, full=False):
+        """Roll up the engagements added since the last run, or recount them all with `full`."""
+        try:
+            total, newest = with_retries(lambda: self._run_once(full), self.queries.max_retries)
+        except pydgraph.AbortedError:
+            print("Trend rollup kept conflicting with other writers, it will be retried on the next run.")
+            return 0
+        if newest is None:
+            print("No new engagements to roll up.")
+            return 0
+        print(f"{'Recounted' if full else 'Rolled up'} {total} engagements, the newest from {newest.isoformat()}.")
+        return total
+
+    def watermark(self):
+        """Timestamp of the newest engagement rolled up, EPOCH before the first run."""
+        with self.queries.snapshot() as txn:
+            return self._read_state(txn)[1]
+
+    def _run_once(self, full):
+        txn = self.client.txn()
+        try:
+            state_uid, watermark, last_uid = self._read_state(txn)
+            counts, newest, last_uid = self._count_engagements(txn, FIRST_UID if full else last_uid)
+            if newest is None and not full:
+                return 0, None
+            if not full:
+                newest = max(newest, watermark)
+
+            for granularity in GRANULARITIES:
+                self._apply(txn, granularity, counts[granularity], replace=full)
+
+            state = {"uid": state_uid or "_:state", "dgraph.type": "RollupState", "rollup_id": ROLLUP_ID,
+                     "watermark": to_variable(newest or EPOCH), "last_uid": last_uid}
+            txn.mutate(set_obj=state, timeout=self.queries.timeout)
+            txn.commit(timeout=self.queries.timeout)
+        finally:
+            txn.discard()
+        return sum(counts["day"].values()), newest
+
+    def _read_state(self, txn):
+        """(state uid, newest timestamp, highest engagement uid) of the rollup."""
+        query = """
+            query state($rollup: string) {
+                state(func: eq(rollup_id, $rollup)) {
+                    uid
+                    watermark
+                    last_uid
+                }
+            }
+        """
+        nodes = self.queries.query(query, {"$rollup": ROLLUP_ID}, txn).get("state", [])
+        if not nodes:
+            return None, EPOCH, FIRST_UID
+        state = nodes[0]
+        watermark = parse_datetime(state["watermark"]) if "watermark" in state else EPOCH
+        return state["uid"], watermark, state.get("last_uid", FIRST_UID)
+
+    def _count_engagements(self, txn, after):
+        """Bucket counts, newest timestamp and highest uid of the engagements with a uid above `after`."""
+        query = """
+            query engagements($first: int, $after: string) {
+                engagements(func: type(Engagement), first: $first, after: $after) {
+                    uid
+                    timestamp
+                }
+            }
+        """
+        counts = {granularity: Counter() for granularity in GRANULARITIES}
+        newest = None
+        for node in self.queries.paginate(query, "engagements", txn=txn, after=after):
+            after = node["uid"]
+            if "timestamp" not in node:
+                continue
+            timestamp = parse_datetime(node["timestamp"])
+            for granularity, key in bucket_keys(timestamp).items():
+                counts[granularity][key] += 1
+            if newest is None or timestamp > newest:
+                newest = timestamp
+        return counts, newest, after
+
+    def _apply(self, txn, granularity, deltas, replace=False):
+        """
+        Add `deltas` to the buckets of one granularity, or make them the counts with
+        `replace`, and refresh every percentage.
+        """
+        existing = _trend_nodes(self.queries, granularity, txn=txn)
+        uids = {node[granularity]: node["uid"] for node in existing}
+        totals = {} if replace else {node[granularity]: node.get("engagement_count", 0) for node in existing}
+        for period, delta in deltas.items():
+            totals[period] = totals.get(period, 0) + delta
+        # a recount drops the buckets no engagement falls in any more
+        stale = [{"uid": uid} for period, uid in uids.items() if period not in totals]
+        for start in range(0, len(stale), MUTATION_BATCH):
+            txn.mutate(del_obj=stale[start:start + MUTATION_BATCH], timeout=self.queries.timeout)
+        grand_total = sum(totals.values())
+
+        nodes = []
+        for period, count in totals.items():
+            nodes.append({
+                "uid": uids.get(period, f"_:{granularity}{period}"),
+                "dgraph.type": "Trend",
+                "trend_id": f"{granularity}:{period}",
+                granularity: period,
+                "engagement_count": count,
+                "engagement_percentage": round(100.0 * count / grand_total, 4) if grand_total else 0.0,
+            })
+        for start in range(0, len(nodes), MUTATION_BATCH):
+            txn.mutate(set_obj=nodes[start:start + MUTATION_BATCH], timeout=self.queries.timeout)
+
+
+def _trend_nodes(queries, granularity, first_period=0, last_period=99999999, txn=None):
+    query = f"""
+        query trends($from: int, $to: int) {{
+            trends(func: between({granularity}, $from, $to), orderasc: {granularity}) {{
+                uid
+                {granularity}
+                engagement_count
+                engagement_percentage
+            }}
+        }}
+    """
+    return queries.query(query, {"$from": first_period, "$to": last_period}, txn).get("trends", [])
+
+
+def read_trends(queries, granularity, first_period=0, last_period=99999999, txn=None):
+    """Pre-aggregated Trend buckets of one granularity, read through its int index."""
+    return [TrendBucket(node[granularity], node.get("engagement_count", 0), node.get("engagement_percentage"))
+            for node in _trend_nodes(queries, granularity, first_period, last_period, txn)]
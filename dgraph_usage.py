@@ -0,0 +1,98 @@
+from array import array
+from contextlib import nullcontext
+from typing import NamedTuple
+
+import numpy as np
+
+HORIZONS = ("daily_usage", "weekly_usage", "monthly_usage", "yearly_usage")
+PERCENTILES = (50, 90, 99)
+HISTOGRAM_BINS = 20
+POWER_USER_FRACTION = 0.01
+PAGE_SIZE = 5000
+
+
+class UsageStats(NamedTuple):
+    horizon: str
+    users: int
+    mean: float
+    stddev: float
+    p50: float
+    p90: float
+    p99: float
+    histogram: list
+    bin_edges: list
+    power_user_share: float
+
+
+def horizon_stats(horizon, values, bins=HISTOGRAM_BINS, power_fraction=POWER_USER_FRACTION):
+    """Distribution of one usage horizon, users without a value are ignored."""
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return UsageStats(horizon, 0, 0.0, 0.0, 0.0, 0.0, 0.0, [], [], 0.0)
+    p50, p90, p99 = np.percentile(values, PERCENTILES)
+    counts, edges = np.histogram(values, bins=bins)
+    # share of the total usage coming from the heaviest `power_fraction` of users
+    power_users = max(1, int(len(values) * power_fraction))
+    total = values.sum()
+    heaviest = np.partition(values, len(values) - power_users)[-power_users:].sum()
+    return UsageStats(horizon, int(len(values)), float(values.mean()), float(values.std()),
+                      float(p50), float(p90), float(p99), counts.tolist(), edges.tolist(),
+                      float(heaviest / total) if total else 0.0)
+
+
+class UsageDistribution:
+    """
+    Streams the four usage predicates into one preallocated (users x 4) float
+    array and computes the distributions with NumPy, so memory is 32 bytes per
+    user plus one row index per (user, interest) pair when segmenting.
+    """
+
+    def __init__(self, queries, page_size=PAGE_SIZE):
+        self.queries = queries
+        self.page_size = page_size
+
+    def _count_users(self, txn):
+        res = self.queries.query("{ total(func: has(daily_usage)) { count(uid) } }", txn=txn)
+        return res["total"][0]["count"] if res.get("total") else 0
+
+    def load(self, by_interest=False, txn=None):
+        """Return the usage matrix and, with `by_interest`, row indexes per interest."""
+        interests_field = "interests" if by_interest else ""
+        query = f"""
+            query usage($first: int, $after: string) {{
+                usage(func: has(daily_usage), first: $first, after: $after) {{
+                    uid
+                    daily_usage
+                    weekly_usage
+                    monthly_usage
+                    yearly_usage
+                    {interests_field}
+                }}
+            }}
+        """
+        with nullcontext(txn) if txn is not None else self.queries.snapshot() as txn:
+            matrix = np.full((self._count_users(txn), len(HORIZONS)), np.nan)
+            segments = {}
+            row = 0
+            for node in self.queries.paginate(query, "usage", txn=txn, page_size=self.page_size):
+                if row == len(matrix):
+                    # users added between the count and the scan
+                    matrix = np.concatenate([matrix, np.full((self.page_size, len(HORIZONS)), np.nan)])
+                for column, horizon in enumerate(HORIZONS):
+                    value = node.get(horizon)
+                    if value is not None:
+                        matrix[row, column] = value
+                for interest in node.get("interests", ()) if by_interest else ():
+                    segments.setdefault(interest.strip().lower(), array("I")).append(row)
+                row += 1
+        return matrix[:row], segments
+
+    def compute(self, by_interest=False, txn=None):
+        matrix, segments = self.load(by_interest, txn)
+        overall = {horizon: horizon_stats(horizon, matrix[:, column]) for column, horizon in enumerate(HORIZONS)}
+        by_segment = {}
+        for interest, rows in segments.items():
+            rows = np.frombuffer(rows, dtype=np.uint32)
+            by_segment[interest] = {horizon: horizon_stats(horizon, matrix[rows, column])
+                                    for column, horizon in enumerate(HORIZONS)}
+        return overall, by_segment
@@ -0,0 +1,318 @@
+"""
+Fast reset of the three stores, and fixtures to reset them to a known dataset.
+
+Resetting drops instead of deleting: the Mongo collections are dropped and
+their indexes recreated, every Cassandra table is truncated at once, and Dgraph
+drops all its data before the schema is applied again. The stores are reset
+concurrently.
+
+A fixture is a directory holding the bulk export of a populated dataset:
+- mongo/<collection>.bson: the documents as concatenated BSON, like mongodump.
+- cassandra/<table>.pickle: the column names, then the rows in chunks of tuples.
+- dgraph.jsonl: one node per line, its uid edges pointing at the exported uids.
+- dgraph_facets.jsonl: the edges carrying facets again, with their facets.
+- manifest.json: written last, a directory without one holds an incomplete save.
+
+Restoring resets a store and bulk loads its files: unordered insert_many of raw
+BSON per chunk, prepared writes to every Cassandra table at once with
+`concurrency` in flight per table, and batched Dgraph mutations, the nodes first
+and their edges once every node has its new uid.
+"""
+import json
+import os
+import pickle
+import struct
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from cassandra.query import SimpleStatement
+
+from cassandra_model import TABLES, WRITE_CONCURRENCY, insert_statement
+from dgraph_client import with_retries
+from dgraph_loader import MUTATION_BATCH
+from mongo_model import COLLECTIONS
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+STORES = ("mongo", "cassandra", "dgraph")
+FETCH_SIZE = 5000
+CHUNK_ROWS = 10000
+DGRAPH_FILE = "dgraph.jsonl"
+DGRAPH_FACETS_FILE = "dgraph_facets.jsonl"
+OUTPUT_BUFFER = 1 << 20
+
+_RAW = CodecOptions(document_class=RawBSONDocument)
+_DGRAPH_NODES = """
+    query nodes($first: int, $after: string) {
+        nodes(func: has(dgraph.type), first: $first, after: $after) {
+            uid
+            dgraph.type
+            expand(_all_) {
+                uid
+            }
+        }
+    }
+"""
+# expand(_all_) leaves the facets out, edges with facets are exported again with them
+_DGRAPH_FACET_EDGES = """
+    query edges($first: int, $after: string) {
+        nodes(func: has(co_occurs), first: $first, after: $after) {
+            uid
+            co_occurs @facets(weight) {
+                uid
+            }
+        }
+    }
+"""
+
+
+def _each(models, action, name, metrics=None):
+    """Run `action(store, model)` for every store at once, returns one row per store."""
+    def run(store, model):
+        start = time.perf_counter()
+        with metrics.operation(f"{name}_{store}") if metrics is not None else nullcontext():
+            row = action(store, model) or {}
+        return {"store": store, "action": name, **row, "seconds": round(time.perf_counter() - start, 3)}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(models))) as executor:
+        futures = [executor.submit(run, store, model) for store, model in models.items()]
+    # every store has finished here, the first failure is raised
+    return [future.result() for future in futures]
+
+
+def reset(models, metrics=None):
+    """Empty every store of `models` ({"mongo": MongoModel, ...}) concurrently."""
+    return _each(models, lambda store, model: model.clean_database(), "reset", metrics)
+
+
+# Save
+
+def save(directory, models, metrics=None):
+    """Export every store of `models` into the fixture `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    # a fixture being overwritten is incomplete until its new manifest is written
+    _remove(os.path.join(directory, MANIFEST))
+    savers = {"mongo": _save_mongo, "cassandra": _save_cassandra, "dgraph": _save_dgraph}
+    rows = _each(models, lambda store, model: {"counts": savers[store](directory, model)}, "save_fixture", metrics)
+    manifest = {"version": FORMAT_VERSION, "created_at": datetime.now(timezone.utc).isoformat(),
+                "stores": {row["store"]: row["counts"] for row in rows}}
+    _write_manifest(directory, manifest)
+    return rows
+
+
+def _save_mongo(directory, model):
+    os.makedirs(os.path.join(directory, "mongo"), exist_ok=True)
+    counts = {}
+    for name in COLLECTIONS:
+        # raw documents are written as they come off the wire, without decoding
+        documents = model.db.get_collection(name, codec_options=_RAW).find(batch_size=FETCH_SIZE)
+        with open(os.path.join(directory, "mongo", f"{name}.bson"), "wb", buffering=OUTPUT_BUFFER) as output:
+            counts[name] = 0
+            for document in documents:
+                output.write(document.raw)
+                counts[name] += 1
+    return counts
+
+
+def _save_cassandra(directory, model):
+    os.makedirs(os.path.join(directory, "cassandra"), exist_ok=True)
+    with ThreadPoolExecutor(max_workers=len(TABLES)) as executor:
+        counts = executor.map(lambda table: _save_table(directory, model, table), TABLES)
+        return dict(zip(TABLES, counts))
+
+
+def _save_table(directory, model, table):
+    result = model._scan(SimpleStatement(f"SELECT * FROM social_media.{table}", fetch_size=FETCH_SIZE))
+    count = 0
+    with open(os.path.join(directory, "cassandra", f"{table}.pickle"), "wb", buffering=OUTPUT_BUFFER) as output:
+        pickle.dump(tuple(result.column_names), output, protocol=pickle.HIGHEST_PROTOCOL)
+        chunk = []
+        for row in result:
+            chunk.append(row)
+            if len(chunk) == CHUNK_ROWS:
+                pickle.dump(chunk, output, protocol=pickle.HIGHEST_PROTOCOL)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            pickle.dump(chunk, output, protocol=pickle.HIGHEST_PROTOCOL)
+            count += len(chunk)
+    return count
+
+
+def _save_dgraph(directory, model):
+    counts = {}
+    with model.queries.snapshot() as txn:
+        for name, query, file_name in (("nodes", _DGRAPH_NODES, DGRAPH_FILE),
+                                       ("facet_nodes", _DGRAPH_FACET_EDGES, DGRAPH_FACETS_FILE)):
+            counts[name] = 0
+            with open(os.path.join(directory, file_name), "w", buffering=OUTPUT_BUFFER) as output:
+                for node in model.queries.paginate(query, "nodes", txn=txn, page_size=MUTATION_BATCH):
+                    output.write(json.dumps(node) + "\n")
+                    counts[name] += 1
+    return counts
+
+
+# Restore
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No fixture in {directory}, or its save did not finish.")
+    with open(path) as manifest:
+        return json.load(manifest)
+
+
+def restore(directory, models, concurrency=WRITE_CONCURRENCY, metrics=None):
+    """Reset every store of `models` and load its data from the fixture `directory`."""
+    saved = load_manifest(directory)["stores"]
+    missing = [store for store in models if store not in saved]
+    if missing:
+        raise ValueError(f"The fixture in {directory} has no {', '.join(missing)} data.")
+    loaders = {"mongo": _restore_mongo, "cassandra": _restore_cassandra, "dgraph": _restore_dgraph}
+
+    def restore_store(store, model):
+        model.clean_database()
+        return {"counts": loaders[store](directory, model, concurrency)}
+
+    return _each(models, restore_store, "restore_fixture", metrics)
+
+
+def _bson_documents(path):
+    """The documents of a .bson file, each kept as its raw bytes."""
+    with open(path, "rb", buffering=OUTPUT_BUFFER) as source:
+        while True:
+            header = source.read(4)
+            if not header:
+                return
+            size, = struct.unpack("<i", header)
+            yield RawBSONDocument(header + source.read(size - 4))
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _restore_mongo(directory, model, concurrency):
+    counts = {}
+    for name in COLLECTIONS:
+        path = os.path.join(directory, "mongo", f"{name}.bson")
+        counts[name] = 0
+        if os.path.exists(path):
+            for chunk in _chunks(_bson_documents(path), CHUNK_ROWS):
+                counts[name] += len(model.db[name].insert_many(chunk, ordered=False).inserted_ids)
+    model.cache.invalidate("mongo.users", "mongo.posts")
+    model.timeline.clear()
+    return counts
+
+
+def _restore_cassandra(directory, model, concurrency):
+    tables = [table for table in TABLES if os.path.exists(os.path.join(directory, "cassandra", f"{table}.pickle"))]
+    with ThreadPoolExecutor(max_workers=max(1, len(tables))) as executor:
+        counts = dict(zip(tables, executor.map(lambda table: _restore_table(directory, model, table, concurrency),
+                                               tables)))
+    model.cache.invalidate("cassandra")
+    return counts
+
+
+def _restore_table(directory, model, table, concurrency):
+    count = 0
+
+    def rows(source):
+        nonlocal count
+        while True:
+            try:
+                chunk = pickle.load(source)
+            except EOFError:
+                return
+            count += len(chunk)
+            yield from chunk
+
+    with open(os.path.join(directory, "cassandra", f"{table}.pickle"), "rb", buffering=OUTPUT_BUFFER) as source:
+        statement = insert_statement(model.session, table, pickle.load(source))
+        model._write_all(statement, rows(source), concurrency)
+    return count
+
+
+def _is_edge(value):
+    if isinstance(value, list):
+        return bool(value) and isinstance(value[0], dict)
+    return isinstance(value, dict)
+
+
+def _dgraph_nodes(directory, file_name=DGRAPH_FILE):
+    path = os.path.join(directory, file_name)
+    if not os.path.exists(path):
+        return
+    with open(path, buffering=OUTPUT_BUFFER) as source:
+        for line in source:
+            yield json.loads(line)
+
+
+def _mutate(model, nodes):
+    return with_retries(lambda: model.client.txn().mutate(set_obj=nodes, commit_now=True,
+                                                          timeout=model.settings.timeout),
+                        model.settings.max_retries).uids
+
+
+def _restore_dgraph(directory, model, concurrency):
+    # blank node names only hold within a mutation, so the edges go in a second pass over the new uids
+    uids = {}
+    for chunk in _chunks(_dgraph_nodes(directory), MUTATION_BATCH):
+        nodes = [{name: value for name, value in node.items() if not _is_edge(value)} for node in chunk]
+        for node in nodes:
+            node["uid"] = f"_:n{node['uid'][2:]}"
+        for name, uid in _mutate(model, nodes).items():
+            uids["0x" + name[1:]] = uid
+    edges = 0
+
+    def edges_of(node, count=True):
+        nonlocal edges
+        edge_node = {"uid": uids[node["uid"]]}
+        for name, value in node.items():
+            if _is_edge(value):
+                # facets are the "<predicate>|<facet>" keys of the target
+                targets = [{**target, "uid": uids[target["uid"]]}
+                           for target in (value if isinstance(value, list) else [value]) if target["uid"] in uids]
+                if targets:
+                    edge_node[name] = targets if isinstance(value, list) else targets[0]
+                    edges += len(targets) if count else 0
+        return edge_node if len(edge_node) > 1 else None
+
+    for chunk in _chunks(filter(None, map(edges_of, _dgraph_nodes(directory))), MUTATION_BATCH):
+        _mutate(model, chunk)
+    # setting an edge again adds its facets
+    for chunk in _chunks(filter(None, map(lambda node: edges_of(node, count=False),
+                                              _dgraph_nodes(directory, DGRAPH_FACETS_FILE))), MUTATION_BATCH):
+        _mutate(model, chunk)
+    model.cache.clear()
+    return {"nodes": len(uids), "edges": edges}
+
+
+def _write_manifest(directory, manifest):
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "w") as output:
+            json.dump(manifest, output, indent=2)
+        os.replace(temporary, os.path.join(directory, MANIFEST))
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
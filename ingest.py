@@ -0,0 +1,394 @@
+"""
+Resumable bulk ingestion of engagement event logs into Cassandra.
+
+An event log is a JSON Lines or CSV file, optionally gzipped, with one event
+per line and a `type` of post, comment, like or share:
+
+    {"type": "post", "post_id": "...", "user_id": "...", "content": "...", "timestamp": "2024-06-01T12:00:00Z",
+     "tags": ["music"]}
+    {"type": "comment", "comment_id": "...", "post_id": "...", "user_id": "...", "content": "...", "timestamp": ...}
+    {"type": "like", "post_id": "...", "user_id": "...", "timestamp": 1717243200}
+
+CSV files carry the same fields as columns under a header row, tags separated
+by "|". Timestamps are ISO 8601 or epoch seconds (milliseconds above 1e11).
+
+Each event becomes the rows of the denormalized tables the loader writes:
+posts, user_posts, posts_by_tag and user_activity for a post; comments,
+post_comments and user_activity for a comment; likes (and user_activity) or
+shares for a like or share. The like, comment and share counts of posts are
+those carried by the post event, engagements are not counted into them.
+
+A reader thread hands batches of lines to the writer through a bounded queue,
+and at most `concurrency` prepared writes are in flight, so memory stays flat
+whatever the size of the log. Once every write of a batch is acknowledged the
+byte offset after it is saved to the checkpoint file; a crashed run restarts
+from there. Cassandra writes are upserts, so the batch replayed after a crash
+rewrites the rows it had written rather than adding more. Rows are only as
+distinct as their primary keys though: user_activity is keyed by (user_id,
+timestamp), so of two events of a user at the same timestamp, which is the
+same second for logs with second timestamps, only the last one's activity is
+kept, and likes and shares keep one row per post and user. Malformed lines go
+to a dead-letter JSON Lines file with their offset and error; the checkpoint
+records its size, and resuming truncates it back to that size, a run from the
+start empties it, so the replayed lines do not add their dead letters twice.
+
+Parsing and binding run at some tens of thousands of events per second per
+process, so `ingest_file` splits an uncompressed log into byte ranges
+ingested by as many processes, each resuming from a checkpoint of its own.
+"""
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+from cassandra_model import WRITE_CONCURRENCY, insert_statement
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional, the stdlib decoder also accepts bytes
+    _loads = json.loads
+
+BATCH_LINES = 5000
+QUEUE_BATCHES = 8
+READ_BUFFER = 1 << 20
+REPORT_SECONDS = 10
+TAG_SEPARATOR = "|"
+# activity ids of the events without one, stable across replays
+ACTIVITY_NAMESPACE = uuid.UUID("5d0b7f52-8a3e-4b8e-9a53-0c2f3d1e7a41")
+FORMATS = ("jsonl", "csv")
+
+
+def input_format(path):
+    """csv for .csv and .csv.gz files, jsonl otherwise."""
+    name = path[:-3] if path.endswith(".gz") else path
+    return "csv" if name.endswith(".csv") else "jsonl"
+
+
+def parse_timestamp(value):
+    """Naive UTC datetime of an ISO 8601 string or epoch seconds/milliseconds."""
+    if isinstance(value, str) and not value.lstrip("-").replace(".", "", 1).isdigit():
+        timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None) if timestamp.tzinfo else timestamp
+    seconds = float(value)
+    if abs(seconds) > 1e11:
+        seconds /= 1000
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+def _uuid(event, field):
+    value = event.get(field)
+    if value in (None, ""):
+        raise ValueError(f"missing {field}")
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+def _compressed(path):
+    with open(path, "rb") as probe:
+        return probe.read(2) == b"\x1f\x8b"
+
+
+def _tags(value):
+    if not value:
+        return set()
+    if isinstance(value, str):
+        return {tag for tag in value.split(TAG_SEPARATOR) if tag}
+    return set(value)
+
+
+def _count(event, field):
+    value = event.get(field)
+    return int(value) if value not in (None, "") else 0
+
+
+class EventIngest:
+    """
+    Ingests the lines of `path` starting in the byte range [start, end), the whole
+    file by default, see ingest_file for several ranges in parallel.
+    """
+
+    def __init__(self, session, path, checkpoint=None, dead_letter=None, file_format=None,
+                 concurrency=WRITE_CONCURRENCY, batch_lines=BATCH_LINES, queue_batches=QUEUE_BATCHES, start=0,
+                 end=None):
+        self.session = session
+        self.path = path
+        self.start = start
+        self.end = end
+        self.checkpoint = checkpoint or f"{path}.checkpoint.json"
+        self.dead_letter = dead_letter or f"{path}.dead.jsonl"
+        self.format = file_format or input_format(path)
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown format {self.format!r}, expected one of {', '.join(FORMATS)}")
+        self.concurrency = concurrency
+        self.batch_lines = batch_lines
+        self.queue_batches = queue_batches
+        self._stop = threading.Event()
+        self._header = None
+
+        def insert(table, columns):
+            return insert_statement(session, table, columns)
+
+        self.posts = insert("posts", ("post_id", "user_id", "content", "timestamp", "like_count", "comment_count",
+                                      "share_count", "tags"))
+        self.user_posts = insert("user_posts", ("post_id", "user_id", "content", "timestamp"))
+        self.posts_by_tag = insert("posts_by_tag", ("tag", "post_id", "like_count", "share_count", "comment_count"))
+        self.comments = insert("comments", ("comment_id", "post_id", "user_id", "content", "timestamp"))
+        self.post_comments = insert("post_comments", ("post_id", "comment_id", "user_id", "content", "timestamp"))
+        self.likes = insert("likes", ("post_id", "user_id", "timestamp"))
+        self.shares = insert("shares", ("post_id", "user_id", "timestamp"))
+        self.activity = insert("user_activity", ("user_id", "activity_id", "type", "target_id", "timestamp"))
+
+    # Checkpoint
+
+    def load_checkpoint(self):
+        """
+        (byte offset, events ingested, dead letters, dead-letter file size) saved for
+        this input, zeros without one. The size is None in checkpoints that predate it.
+        """
+        try:
+            with open(self.checkpoint) as checkpoint:
+                state = json.load(checkpoint)
+        except (OSError, ValueError):
+            return 0, 0, 0, 0
+        if (state.get("input"), state.get("start"), state.get("end")) != (os.path.abspath(self.path), self.start,
+                                                                           self.end):
+            return 0, 0, 0, 0
+        return state["offset"], state["events"], state["dead_letters"], state.get("dead_letter_bytes")
+
+    def save_checkpoint(self, offset, events, dead_letters, dead_letter_bytes):
+        directory = os.path.dirname(os.path.abspath(self.checkpoint))
+        # write to a temporary file first so a crash never leaves a partial checkpoint
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w") as output:
+            json.dump({"input": os.path.abspath(self.path), "start": self.start, "end": self.end, "offset": offset,
+                       "events": events,
+                       "dead_letters": dead_letters, "dead_letter_bytes": dead_letter_bytes, "updated": datetime.now(timezone.utc).isoformat()}, output)
+        os.replace(temporary, self.checkpoint)
+
+    # Reading
+
+    def _open(self):
+        if _compressed(self.path):
+            # offsets count decompressed bytes, resuming decompresses up to the checkpoint
+            return io.BufferedReader(gzip.open(self.path, "rb"), READ_BUFFER)
+        return open(self.path, "rb", buffering=READ_BUFFER)
+
+    def _put(self, batches, item):
+        while not self._stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _read(self, offset, batches):
+        """Reader thread: (start offset, lines) batches, then None, or the exception raised."""
+        try:
+            with self._open() as stream:
+                first = 0
+                if self.format == "csv":
+                    header = stream.readline()
+                    self._header = next(csv.reader([header.decode("utf-8")]))
+                    first = len(header)
+                if self.start > first:
+                    # the range starts with the first line beginning at or after `start`
+                    stream.seek(self.start - 1)
+                    first = self.start - 1 + len(stream.readline())
+                offset = max(offset, first)
+                stream.seek(offset)
+                batch, start, position = [], offset, offset
+                for line in stream:
+                    if self.end is not None and position >= self.end:
+                        break
+                    position += len(line)
+                    batch.append(line)
+                    if len(batch) == self.batch_lines:
+                        self._put(batches, (start, batch))
+                        start, batch = position, []
+                    if self._stop.is_set():
+                        return
+                if batch:
+                    self._put(batches, (start, batch))
+            self._put(batches, None)
+        except BaseException as e:
+            self._put(batches, e)
+
+    def _decode(self, line):
+        if self.format == "csv":
+            values = next(csv.reader([line.decode("utf-8")]))
+            if len(values) != len(self._header):
+                raise ValueError(f"{len(values)} fields, the header has {len(self._header)}")
+            return dict(zip(self._header, values))
+        event = _loads(line)
+        if not isinstance(event, dict):
+            raise ValueError("not a JSON object")
+        return event
+
+    # Mapping
+
+    def rows(self, event):
+        """(prepared statement, parameters) of every row written for an event."""
+        kind = event.get("type")
+        user_id = _uuid(event, "user_id")
+        timestamp = parse_timestamp(event["timestamp"]) if event.get("timestamp") not in (None, "") else None
+        if timestamp is None:
+            raise ValueError("missing timestamp")
+        if kind == "post":
+            post_id = _uuid(event, "post_id")
+            content = event.get("content") or ""
+            likes, comments, shares = (_count(event, field) for field in ("like_count", "comment_count",
+                                                                           "share_count"))
+            tags = _tags(event.get("tags"))
+            rows = [(self.posts, (post_id, user_id, content, timestamp, likes, comments, shares, tags)),
+                    (self.user_posts, (post_id, user_id, content, timestamp))]
+            rows += [(self.posts_by_tag, (tag, post_id, likes, shares, comments)) for tag in tags]
+            target = post_id
+        elif kind == "comment":
+            comment_id, post_id = _uuid(event, "comment_id"), _uuid(event, "post_id")
+            content = event.get("content") or ""
+            rows = [(self.comments, (comment_id, post_id, user_id, content, timestamp)),
+                    (self.post_comments, (post_id, comment_id, user_id, content, timestamp))]
+            target = comment_id
+        elif kind == "like":
+            post_id = _uuid(event, "post_id")
+            rows = [(self.likes, (post_id, user_id, timestamp))]
+            target = post_id
+        elif kind == "share":
+            # like the loader, shares are not recorded as user activity
+            return [(self.shares, (_uuid(event, "post_id"), user_id, timestamp))]
+        else:
+            raise ValueError(f"unknown event type {kind!r}")
+        activity_id = (_uuid(event, "activity_id") if event.get("activity_id")
+                       else uuid.uuid5(ACTIVITY_NAMESPACE, f"{kind}:{user_id}:{target}:{timestamp.isoformat()}"))
+        rows.append((self.activity, (user_id, activity_id, kind, target, timestamp)))
+        return rows
+
+    # Run
+
+    def run(self, restart=False):
+        """Ingest from the checkpoint, or from the start with `restart`. Returns the run's counters."""
+        offset, events, dead_letters, dead_letter_bytes = (0, 0, 0, 0) if restart else self.load_checkpoint()
+        resumed_from = offset
+        if offset:
+            print(f"Resuming {self.path} at byte {offset} ({events} events already ingested).")
+        batches = queue.Queue(maxsize=self.queue_batches)
+        reader = threading.Thread(target=self._read, args=(offset, batches), name="ingest-reader", daemon=True)
+        self._stop.clear()
+        reader.start()
+        start = last_report = time.perf_counter()
+        run_events = statements = run_dead = 0
+        pending = deque()
+        try:
+            with open(self.dead_letter, "a") as dead:
+                # drop the dead letters written after the checkpoint, the lines they came from are read again
+                if dead_letter_bytes is not None and dead.tell() > dead_letter_bytes:
+                    dead.truncate(dead_letter_bytes)
+                    dead.seek(dead_letter_bytes)
+                while True:
+                    item = batches.get()
+                    if item is None:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    line_offset, lines = item
+                    for line in lines:
+                        line_start, line_offset = line_offset, line_offset + len(line)
+                        if not line.strip():
+                            continue
+                        try:
+                            rows = self.rows(self._decode(line))
+                        except Exception as e:
+                            dead.write(json.dumps({"offset": line_start, "error": str(e),
+                                                   "line": line.decode("utf-8", "replace").rstrip("\r\n")}) + "\n")
+                            run_dead += 1
+                            continue
+                        run_events += 1
+                        for statement, parameters in rows:
+                            if len(pending) == self.concurrency:
+                                pending.popleft().result()
+                            pending.append(self.session.execute_async(statement, parameters))
+                            statements += 1
+                    # the checkpoint only moves past lines whose writes are all acknowledged
+                    while pending:
+                        pending.popleft().result()
+                    dead.flush()
+                    offset = line_offset
+                    self.save_checkpoint(offset, events + run_events, dead_letters + run_dead, dead.tell())
+                    now = time.perf_counter()
+                    if now - last_report >= REPORT_SECONDS:
+                        last_report = now
+                        print(f"{run_events} events, {run_events / (now - start):,.0f} events/s, "
+                              f"{(offset - resumed_from) / 2 ** 20 / (now - start):.1f} MB/s, "
+                              f"{run_dead} dead letters")
+        finally:
+            self._stop.set()
+            reader.join()
+        seconds = time.perf_counter() - start
+        rate = run_events / seconds if seconds else 0.0
+        print(f"Ingested {run_events} events ({statements} rows) in {seconds:.1f}s, {rate:,.0f} events/s, "
+              f"{run_dead} dead letters, checkpoint at byte {offset}.")
+        return {"input": self.path, "events": run_events, "rows": statements, "dead_letters": run_dead,
+                "total_events": events + run_events, "resumed_from": resumed_from, "offset": offset,
+                "seconds": seconds, "events_per_s": rate}
+
+
+def _ingest_part(path, options, restart):
+    """Process entry point: ingest one byte range over a connection of its own."""
+    from cassandra_model import CassandraModel
+    # like the parent in batch mode, keep stdout for the rows
+    with redirect_stdout(sys.stderr):
+        model = CassandraModel()
+        model.connect_to_cassandra()
+        try:
+            return EventIngest(model.session, path, **options).run(restart)
+        finally:
+            model.close_connection()
+
+
+def ingest_file(session, path, workers=1, checkpoint=None, dead_letter=None, restart=False, **options):
+    """
+    Ingest `path` over `session`, or with `workers` > 1 split it into that many byte
+    ranges, each ingested by a process with its own connection, checkpoint and
+    dead-letter file (suffixed -<part>-of-<workers>). A gzipped log cannot be
+    split and always runs in this process. Returns the counters of the run.
+    """
+    if workers <= 1 or _compressed(path):
+        if workers > 1:
+            print("Compressed logs cannot be split, ingesting in one process.")
+        return EventIngest(session, path, checkpoint, dead_letter, **options).run(restart)
+    checkpoint = checkpoint or f"{path}.checkpoint.json"
+    dead_letter = dead_letter or f"{path}.dead.jsonl"
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    # spawned, the driver's threads of this process must not be forked
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_ingest_part, path,
+                                   dict(options, checkpoint=_part_path(checkpoint, part, workers),
+                                        dead_letter=_part_path(dead_letter, part, workers),
+                                        start=size * part // workers, end=size * (part + 1) // workers),
+                                   restart)
+                   for part in range(workers)]
+        results = [future.result() for future in futures]
+    seconds = time.perf_counter() - start
+    total = {name: sum(result[name] for result in results)
+             for name in ("events", "rows", "dead_letters", "total_events")}
+    print(f"Ingested {total['events']} events with {workers} workers in {seconds:.1f}s, "
+          f"{total['events'] / seconds:,.0f} events/s, {total['dead_letters']} dead letters.")
+    return dict(input=path, workers=workers, seconds=seconds, events_per_s=total["events"] / seconds, **total)
+
+
+def _part_path(path, part, parts):
+    root, extension = os.path.splitext(path)
+    return f"{root}-{part + 1}-of-{parts}{extension}"
@@ -0,0 +1,422 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Latency bucket upper bounds in microseconds, roughly x2.5 apart from 50us to 30s
+LATENCY_BUCKETS_US = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+                      1000000, 2500000, 5000000, 10000000, 30000000)
+N_PLUS_ONE_THRESHOLD = int(os.getenv("METRICS_N_PLUS_ONE_THRESHOLD", 50))
+
+_current_operation = ContextVar("current_operation", default=None)
+
+
+class Histogram:
+    __slots__ = ("counts", "total_us", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_US) + 1)
+        self.total_us = 0.0
+        self.count = 0
+
+    def observe(self, value_us):
+        self.counts[bisect_left(LATENCY_BUCKETS_US, value_us)] += 1
+        self.total_us += value_us
+        self.count += 1
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(LATENCY_BUCKETS_US + (float("inf"),), self.counts):
+            running += count
+            yield bound, running
+
+
+class StatementStats:
+    __slots__ = ("histogram", "calls", "errors", "rows", "bytes")
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.bytes = 0
+
+
+class OperationScope:
+    __slots__ = ("name", "statements", "sample")
+
+    def __init__(self, name):
+        self.name = name
+        self.statements = 0
+        self.sample = None
+
+
+class Metrics:
+    """
+    Per-operation statement metrics.
+
+    Every wrapped driver call is recorded under (operation, store, call), where
+    operation is the menu operation running at the time. An operation issuing
+    more than `n_plus_one_threshold` statements is flagged as a likely N+1.
+    """
+
+    def __init__(self, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.stats = {}
+        self.operations = {}
+        self.n_plus_one = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def operation(self, name):
+        scope = OperationScope(name)
+        token = _current_operation.set(scope)
+        start = time.perf_counter_ns()
+        try:
+            yield scope
+        finally:
+            _current_operation.reset(token)
+            elapsed_us = (time.perf_counter_ns() - start) / 1000
+            with self._lock:
+                histogram = self.operations.get(name)
+                if histogram is None:
+                    histogram = self.operations[name] = Histogram()
+                histogram.observe(elapsed_us)
+                if scope.statements > self.n_plus_one_threshold:
+                    flagged = self.n_plus_one.setdefault(name, {"occurrences": 0, "max_statements": 0})
+                    flagged["occurrences"] += 1
+                    flagged["max_statements"] = max(flagged["max_statements"], scope.statements)
+                    flagged["sample_statement"] = " ".join(str(scope.sample).split())[:200]
+
+    @contextmanager
+    def resumed(self, scope):
+        """Record this context's calls under `scope`, an operation timed by another thread or task."""
+        token = _current_operation.set(scope)
+        try:
+            yield scope
+        finally:
+            _current_operation.reset(token)
+
+    def current_scope(self):
+        """The operation running in this context, for calls completing on another thread."""
+        return _current_operation.get()
+
+    def record(self, store, call, elapsed_ns, rows=0, size=0, error=False, statement=None, scope=None,
+               pipelined=False):
+        """Record a driver call, `pipelined` calls overlap others and do not count towards N+1."""
+        scope = scope or _current_operation.get()
+        operation = scope.name if scope is not None else "-"
+        key = (operation, store, call)
+        # the driver pools and run-all workers record from several threads at once
+        with self._lock:
+            if scope is not None and not pipelined:
+                scope.statements += 1
+                # the repeated statement of an N+1 is usually the last one issued
+                scope.sample = statement
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = StatementStats()
+            stats.histogram.observe(elapsed_ns / 1000)
+            stats.calls += 1
+            stats.rows += rows
+            stats.bytes += size
+            stats.errors += error
+
+    def add_rows(self, store, call, rows):
+        scope = _current_operation.get()
+        with self._lock:
+            stats = self.stats.get((scope.name if scope is not None else "-", store, call))
+            if stats is not None:
+                stats.rows += rows
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            "statements": [
+                {"operation": operation, "store": store, "call": call, "calls": stats.calls,
+                 "errors": stats.errors, "rows": stats.rows, "bytes": stats.bytes,
+                 "total_ms": stats.histogram.total_us / 1000,
+                 "buckets_us": dict((str(bound), count) for bound, count in stats.histogram.cumulative())}
+                for (operation, store, call), stats in sorted(self.stats.items())
+            ],
+            "operations": [
+                {"operation": name, "calls": histogram.count, "total_ms": histogram.total_us / 1000,
+                 "buckets_us": dict((str(bound), count) for bound, count in histogram.cumulative())}
+                for name, histogram in sorted(self.operations.items())
+            ],
+            "n_plus_one": self.n_plus_one,
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as output:
+            json.dump(self.snapshot(), output, indent=2)
+
+    def prometheus_text(self):
+        with self._lock:
+            return self._prometheus_text()
+
+    def _prometheus_text(self):
+        lines = [
+            "# HELP sma_statement_duration_seconds Driver call latency per menu operation.",
+            "# TYPE sma_statement_duration_seconds histogram",
+        ]
+        for (operation, store, call), stats in sorted(self.stats.items()):
+            labels = f'operation="{operation}",store="{store}",call="{call}"'
+            lines += _histogram_lines("sma_statement_duration_seconds", labels, stats.histogram)
+        for name, kind, attribute in (("sma_statement_errors_total", "counter", "errors"),
+                                      ("sma_statement_rows_total", "counter", "rows"),
+                                      ("sma_statement_bytes_total", "counter", "bytes")):
+            lines.append(f"# TYPE {name} {kind}")
+            for (operation, store, call), stats in sorted(self.stats.items()):
+                lines.append(f'{name}{{operation="{operation}",store="{store}",call="{call}"}} '
+                             f'{getattr(stats, attribute)}')
+        lines += ["# HELP sma_operation_duration_seconds Menu operation latency.",
+                  "# TYPE sma_operation_duration_seconds histogram"]
+        for name, histogram in sorted(self.operations.items()):
+            lines += _histogram_lines("sma_operation_duration_seconds", f'operation="{name}"', histogram)
+        lines.append("# TYPE sma_n_plus_one_total counter")
+        for name, flagged in sorted(self.n_plus_one.items()):
+            lines.append(f'sma_n_plus_one_total{{operation="{name}"}} {flagged["occurrences"]}')
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(metric, labels, histogram):
+    lines = []
+    for bound, running in histogram.cumulative():
+        le = "+Inf" if bound == float("inf") else f"{bound / 1e6:g}"
+        lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {running}')
+    lines.append(f"{metric}_sum{{{labels}}} {histogram.total_us / 1e6:.6f}")
+    lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+# Driver wrappers
+
+class _CountingRows:
+    """Iterates a result set and adds the rows to the statement once iteration ends."""
+
+    def __init__(self, result, metrics, store, call):
+        self._result = result
+        self._metrics = metrics
+        self._store = store
+        self._call = call
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def __iter__(self):
+        rows = 0
+        try:
+            for row in self._result:
+                rows += 1
+                yield row
+        finally:
+            self._metrics.add_rows(self._store, self._call, rows)
+
+    def __next__(self):
+        row = next(self._result)
+        self._metrics.add_rows(self._store, self._call, 1)
+        return row
+
+    def __len__(self):
+        return len(self._result)
+
+    def __bool__(self):
+        return bool(self._result)
+
+    def __getitem__(self, index):
+        return self._result[index]
+
+    def one(self):
+        row = self._result.one()
+        self._metrics.add_rows(self._store, self._call, row is not None)
+        return row
+
+    def all(self):
+        return list(self)
+
+
+class InstrumentedSession:
+    """Cassandra session proxy timing every execute() and execute_async()."""
+
+    def __init__(self, session, metrics):
+        self._session = session
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def execute(self, query, *args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            result = self._session.execute(query, *args, **kwargs)
+        except Exception:
+            self._metrics.record("cassandra", "execute", time.perf_counter_ns() - start, error=True, statement=query)
+            raise
+        self._metrics.record("cassandra", "execute", time.perf_counter_ns() - start, statement=query)
+        return _CountingRows(result, self._metrics, "cassandra", "execute")
+
+    def execute_async(self, query, *args, **kwargs):
+        """Timed from the call until the response arrives, recorded by a callback on the future."""
+        metrics, scope = self._metrics, self._metrics.current_scope()
+        start = time.perf_counter_ns()
+        future = self._session.execute_async(query, *args, **kwargs)
+
+        def done(result, error=False):
+            metrics.record("cassandra", "execute_async", time.perf_counter_ns() - start, error=error,
+                           statement=query, scope=scope, pipelined=True)
+        future.add_callbacks(done, lambda exception: done(None, error=True))
+        return future
+
+
+class _CountingCursor:
+    def __init__(self, cursor, metrics, call):
+        self._cursor = cursor
+        self._metrics = metrics
+        self._call = call
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if name in ("sort", "limit", "skip", "batch_size", "hint", "max_time_ms"):
+            return lambda *args, **kwargs: _CountingCursor(attribute(*args, **kwargs), self._metrics, self._call)
+        return attribute
+
+    def __iter__(self):
+        rows = 0
+        try:
+            for document in self._cursor:
+                rows += 1
+                yield document
+        finally:
+            self._metrics.add_rows("mongo", self._call, rows)
+
+    def __next__(self):
+        document = next(self._cursor)
+        self._metrics.add_rows("mongo", self._call, 1)
+        return document
+
+    def __len__(self):
+        return len(self._cursor)
+
+    def __bool__(self):
+        return bool(self._cursor)
+
+    def __getitem__(self, index):
+        return self._cursor[index]
+
+
+class InstrumentedCollection:
+    """Mongo collection proxy timing every method call, cursors count the documents read."""
+
+    def __init__(self, collection, metrics):
+        self._collection = collection
+        self._metrics = metrics
+        self._name = collection.name
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+        call = f"{self._name}.{name}"
+        metrics = self._metrics
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception:
+                metrics.record("mongo", call, time.perf_counter_ns() - start, error=True, statement=call)
+                raise
+            metrics.record("mongo", call, time.perf_counter_ns() - start, rows=name == "find_one" and result is not None,
+                           statement=call)
+            if name in ("find", "aggregate"):
+                return _CountingCursor(result, metrics, call)
+            return result
+        return timed
+
+
+class _InstrumentedTxn:
+    def __init__(self, txn, metrics):
+        self._txn = txn
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._txn, name)
+
+    def _timed(self, call, function, *args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            res = function(*args, **kwargs)
+        except Exception:
+            self._metrics.record("dgraph", call, time.perf_counter_ns() - start, error=True,
+                                 statement=args[0] if args else call)
+            raise
+        self._metrics.record("dgraph", call, time.perf_counter_ns() - start, size=len(getattr(res, "json", b"") or b""),
+                             statement=args[0] if args else call)
+        return res
+
+    def query(self, *args, **kwargs):
+        return self._timed("query", self._txn.query, *args, **kwargs)
+
+    def mutate(self, *args, **kwargs):
+        return self._timed("mutate", self._txn.mutate, *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        return self._timed("commit", self._txn.commit, *args, **kwargs)
+
+
+class InstrumentedDgraphClient:
+    """Dgraph client proxy whose transactions time query/mutate/commit."""
+
+    def __init__(self, client, metrics):
+        self._client = client
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def txn(self, *args, **kwargs):
+        return _InstrumentedTxn(self._client.txn(*args, **kwargs), self._metrics)
+
+
+METRICS = Metrics()
+
+
+def current_operation():
+    """Name of the operation running in this context, None outside of Metrics.operation()."""
+    scope = _current_operation.get()
+    return scope.name if scope is not None else None
+
+
+def enabled():
+    return os.getenv("METRICS_ENABLED", "").lower() in ("1", "true", "yes", "on")
+
+
+def instrument(mongo_model=None, cassandra_model=None, dgraph_model=None, metrics=METRICS):
+    """Swap the models' driver handles for instrumented proxies."""
+    if mongo_model is not None:
+        mongo_model.users_collection = InstrumentedCollection(mongo_model.users_collection, metrics)
+        mongo_model.posts_collection = InstrumentedCollection(mongo_model.posts_collection, metrics)
+        mongo_model.post_daily_stats = InstrumentedCollection(mongo_model.post_daily_stats, metrics)
+    if cassandra_model is not None and cassandra_model.session is not None:
+        cassandra_model.session = InstrumentedSession(cassandra_model.session, metrics)
+    if dgraph_model is not None and dgraph_model.client is not None:
+        dgraph_model.attach_client(InstrumentedDgraphClient(dgraph_model.client, metrics))
+    return metrics
+
+
+def export_metrics(metrics):
+    """Write the metrics to METRICS_JSON_FILE / METRICS_PROMETHEUS_FILE when set."""
+    json_path = os.getenv("METRICS_JSON_FILE")
+    if json_path:
+        metrics.write_json(json_path)
+    prometheus_path = os.getenv("METRICS_PROMETHEUS_FILE")
+    if prometheus_path:
+        with open(prometheus_path, "w") as output:
+            output.write(metrics.prometheus_text())
@@ -1,7 +1,33 @@
-from mongo_model import MongoModel
+import sys
+from contextlib import nullcontext
+
+import cli
+import instrumentation
+import materializer
+import profiling
+import slow_queries
+from mongo_model import MongoModel, show_language_counts
 from cassandra_model import CassandraModel
 from dgraph_model import DgraphModel
 
+OPERATION_NAMES = {
+    1: "create_user", 2: "delete_user", 3: "login", 4: "logout", 5: "change_password",
+    6: "change_notifications", 7: "change_language", 8: "most_used_language", 9: "create_post",
+    10: "delete_a_post", 11: "see_your_posts", 12: "see_posts_from_people", 13: "get_list_of_users",
+    14: "populate_mongo", 15: "clean_mongo", 16: "follower_number_analysis", 17: "user_interaction_patterns",
+    18: "trend_analysis_of_topics", 19: "user_sentiment_analysis", 20: "content_type_performance",
+    21: "most_engaging_post_types", 22: "keyword_influence_on_engagement", 23: "follower_to_engagement_ratio",
+    24: "average_response_time_to_comments", 25: "time_to_first_engagement", 26: "top_shared_posts",
+    27: "populate_cassandra", 28: "analyze_platform_usage", 29: "view_daily_engagement_trends",
+    30: "view_weekly_engagement_trends", 31: "view_monthly_engagement_trends", 32: "view_yearly_engagement_trends",
+    33: "cluster_users_by_interests", 34: "identify_inactive_users", 35: "analyze_post_retention",
+    36: "find_top_performing_post", 37: "populate_dgraph", 38: "rollup_engagement_trends",
+    39: "refresh_interest_clusters", 40: "record_inactive_users", 41: "rank_influencers", 42: "show_metrics",
+    43: "show_profile_summary", 44: "show_materialized_jobs", 45: "post_analytics", 46: "post_activity",
+    47: "update_tag_graph", 48: "related_tags",
+}
+
+
 def print_menu(current_username):
     print("\n=== Social Media Analytics System ===")
     print(f"MongoDB current user: {current_username}")
@@ -42,9 +68,208 @@ def print_menu(current_username):
     print("35. Analyze Post Retention (Dgraph)")
     print("36. Find Top Performing Post (Dgraph)")
     print("37. Populate Database with Sample Data (Dgraph)")
+    print("38. Roll up Engagement Trends (Dgraph)")
+    print("39. Refresh Interest Clusters (Dgraph)")
+    print("40. Record Inactive Users and Summary (Dgraph)")
+    print("41. Rank Influencers (Dgraph)")
+    print("42. Show Query Metrics")
+    print("43. Show Profile Summary")
+    print("44. Show Materialized Jobs")
+    print("45. Post Analytics (MongoDB)")
+    print("46. Posting Activity by Day (MongoDB)")
+    print("47. Update Tag Co-occurrence Graph (Cassandra -> Dgraph)")
+    print("48. Related Tags (Dgraph)")
     print("0. Exit")
 
 
+def served(materialized, job):
+    """The materialized result of `job` when fresh enough, None to compute it now."""
+    entry = materialized.fresh(job) if materialized is not None else None
+    if entry is not None:
+        print(f"(materialized {job}, {materializer.freshness(entry)})")
+    return entry
+
+
+def view_trends(dgraph_model, materialized, view):
+    entry = served(materialized, "engagement-trends")
+    if entry is None:
+        getattr(dgraph_model, f"view_{view}_engagement_trends")()
+        return
+    for bucket in entry.result[view]:
+        print(f"Period: {bucket.period}, Engagement: {bucket.count}, Percentage: {bucket.percentage}%")
+
+
+def run_option(option, mongo_model, cassandra_model, dgraph_model, materialized=None, runner=None):
+    # MongoDB
+    if option == 1:
+        mongo_model.create_user()
+    elif option == 2:
+        mongo_model.delete_user()
+    elif option == 3:
+        mongo_model.login()
+    elif option == 4:
+        mongo_model.logout()
+    elif option == 5:
+        mongo_model.change_password()
+    elif option == 6:
+        mongo_model.change_notifications()
+    elif option == 7:
+        mongo_model.change_language()
+    elif option == 8:
+        entry = served(materialized, "language-stats")
+        if entry is not None:
+            show_language_counts(entry.result)
+        else:
+            mongo_model.most_used_language()
+    elif option == 9:
+        mongo_model.create_post()
+    elif option == 10:
+        mongo_model.delete_a_post()
+    elif option == 11:
+        mongo_model.see_your_posts()
+    elif option == 12:
+        mongo_model.see_posts_from_people()
+    elif option == 13:
+        mongo_model.get_list_of_users()
+    elif option == 14:
+        mongo_model.populate_database()
+    elif option == 15:
+        mongo_model.clean_database()
+    # Cassandra
+    elif option == 16:
+        cassandra_model.follower_number_analysis()
+    elif option == 17:
+        cassandra_model.user_interaction_patterns()
+    elif option == 18:
+        entry = served(materialized, "tag-trends")
+        if entry is not None:
+            for row in entry.result[:10]:
+                print(f"Tag: {row['tag']}, Post Count: {row['post_count']}, New Posts: {row['new_posts']}")
+        else:
+            cassandra_model.trend_analysis_of_topics()
+    elif option == 19:
+        print("\nPerforming User Sentiment Analysis...")
+        entry = served(materialized, "sentiment")
+        sentiment_results = entry.result if entry is not None else cassandra_model.user_sentiment_analysis()
+        for result in sentiment_results:
+            print(f"Post ID: {result['post_id']}")
+            print(f"Content: {result['content']}")
+            print(f"Sentiment: {result['sentiment']}\n")
+    elif option == 20:
+        cassandra_model.content_type_performance()
+    elif option == 21:
+        tag = input("Enter the hashtag to analyze: ").strip()
+        if tag:
+            print(f"\nFetching most engaging post types for the hashtag: {tag}")
+            cassandra_model.most_engaging_post_types(tag)
+        else:
+            print("Hashtag cannot be empty. Please try again.")
+    elif option == 22:
+        cassandra_model.keyword_influence_on_engagement()
+    elif option == 23:
+        entry = served(materialized, "user-engagement")
+        if entry is not None:
+            for row in entry.result:
+                print(f"User ID: {row['user_id']}, Ratio: {row['ratio']:.2f}")
+        else:
+            cassandra_model.follower_to_engagement_ratio()
+    elif option == 24:
+        cassandra_model.average_response_time_to_comments()
+    elif option == 25:
+        cassandra_model.time_to_first_engagement()
+    elif option == 26:
+        cassandra_model.top_shared_posts()
+    elif option == 27:
+        print("\nPopulating the Cassandra database with random test data...")
+        cassandra_model.populate_database()
+        print("Database populated successfully!")
+    # Dgraph
+    elif option == 28:
+        by_interest = input("Segment by interest? (yes/no): ").strip().lower() == "yes"
+        dgraph_model.analyze_platform_usage(by_interest)
+    elif option == 29:
+        view_trends(dgraph_model, materialized, "daily")
+    elif option == 30:
+        view_trends(dgraph_model, materialized, "weekly")
+    elif option == 31:
+        view_trends(dgraph_model, materialized, "monthly")
+    elif option == 32:
+        view_trends(dgraph_model, materialized, "yearly")
+    elif option == 33:
+        dgraph_model.cluster_users_by_interests()
+    elif option == 34:
+        days = int(input("Inactive for how many days? (e.g., 30, 90, 180): ").strip())
+        entry = served(materialized, "inactive-users") if days == materializer.INACTIVE_DAYS else None
+        if entry is not None:
+            for record in entry.result:
+                print(f"User ID: {record.user_id}, Name: {record.name}, Last Active: {record.last_active}, "
+                      f"Inactive for: {record.inactivity_duration} days")
+        else:
+            dgraph_model.identify_inactive_users(days)
+    elif option == 35:
+        dgraph_model.analyze_post_retention()
+    elif option == 36:
+        dgraph_model.find_top_performing_post()
+    elif option == 37:
+        print("\nPopulating the Dgraph database with sample data...")
+        dgraph_model.populate_database()
+    elif option == 38:
+        dgraph_model.rollup_engagement_trends()
+    elif option == 39:
+        full = input("Re-fit every cluster from scratch? (yes/no): ").strip().lower() == "yes"
+        dgraph_model.refresh_interest_clusters(full)
+    elif option == 40:
+        days = int(input("Inactive for how many days? (e.g., 30, 90, 180): ").strip())
+        dgraph_model.record_inactive_users(days)
+        dgraph_model.inactive_users_summary()
+    elif option == 41:
+        dgraph_model.rank_influencers()
+        dgraph_model.top_influencers()
+    elif option == 42:
+        if instrumentation.enabled():
+            print(instrumentation.METRICS.prometheus_text())
+        else:
+            print("Metrics are off, start the program with METRICS_ENABLED=1.")
+        if runner is not None:
+            print(runner.prometheus_text())
+    elif option == 43:
+        rows = profiling.summarize()
+        if not rows:
+            print(f"No profiles in {profiling.PROFILE_DIR}, start the program with PROFILE_ENABLED=1.")
+        for row in rows:
+            print(f"{row['time_rank']}. {row['operation']}: {row['runs']} runs, {row['cumulative_s']:.2f}s profiled, "
+                  f"peak {row['peak_mb']:.1f} MB (memory rank {row['memory_rank']})")
+            for function in row["top_functions"]:
+                print(f"     {function['function']}: {function['own_s']:.3f}s own, {function['calls']} calls")
+    elif option == 44:
+        rows = runner.status() if runner is not None else materializer.status()
+        for row in rows:
+            if not row["runs"]:
+                print(f"{row['job']}: not materialized yet")
+                continue
+            lag = "sweeping" if row["lag_s"] is None else f"lag {row['lag_s']:.0f}s"
+            print(f"{row['job']} ({row['store']}, every {row['interval_s']:.0f}s): {row['runs']} runs, "
+                  f"last took {row['duration_s']:.2f}s, {lag}, {row['coverage']:.0%} covered, "
+                  f"watermark {row['watermark']}")
+            if row.get("last_error"):
+                print(f"     last error: {row['last_error']}")
+    elif option == 45:
+        mongo_model.post_analytics()
+    elif option == 46:
+        first_day = int(input("First day (e.g., 20240101): ").strip())
+        last_day = int(input("Last day (e.g., 20241231): ").strip())
+        mongo_model.post_activity(first_day, last_day)
+    elif option == 47:
+        full = input("Clear every edge and write them all again? (yes/no): ").strip().lower() == "yes"
+        dgraph_model.update_tag_graph(cassandra_model, full)
+    elif option == 48:
+        tag = input("Enter the hashtag: ").strip()
+        dgraph_model.related_tags(tag)
+    # Else
+    else:
+        print("Invalid option. Please try again.")
+
+
 def main():
     mongo_model = MongoModel()
 
@@ -54,6 +279,23 @@ def main():
     dgraph_model = DgraphModel()
     dgraph_model.connect_to_dgraph()
 
+    # slow-query proxies first, they need the driver objects themselves
+    if slow_queries.enabled():
+        slow_queries.attach(mongo_model, cassandra_model, dgraph_model)
+    metrics = None
+    if instrumentation.enabled():
+        metrics = instrumentation.instrument(mongo_model, cassandra_model, dgraph_model)
+    elif slow_queries.enabled():
+        # not exported, only names the operation of each slow statement
+        metrics = instrumentation.Metrics()
+    profiler = profiling.Profiler() if profiling.enabled() else None
+    materialized = materializer.MaterializedStore() if materializer.serving() else None
+    runner = None
+    if materializer.enabled():
+        runner = materializer.Runner({"mongo": mongo_model, "cassandra": cassandra_model, "dgraph": dgraph_model},
+                                     results=materialized, metrics=metrics)
+        runner.start()
+
     while(True):
         print_menu(mongo_model.current_username)
         try:
@@ -61,109 +303,27 @@ def main():
             if option == 0:
                 print("Exiting the program. Goodbye!")
                 break
-            # MongoDB
-            elif option == 1:
-                mongo_model.create_user()
-            elif option == 2:
-                mongo_model.delete_user()
-            elif option == 3:
-                mongo_model.login()
-            elif option == 4:
-                mongo_model.logout()
-            elif option == 5:
-                mongo_model.change_password()
-            elif option == 6:
-                mongo_model.change_notifications()
-            elif option == 7:
-                mongo_model.change_language()
-            elif option == 8:
-                mongo_model.most_used_language()
-            elif option == 9:
-                mongo_model.create_post()
-            elif option == 10:
-                mongo_model.delete_a_post()
-            elif option == 11:
-                mongo_model.see_your_posts()
-            elif option == 12:
-                mongo_model.see_posts_from_people()
-            elif option == 13:
-                mongo_model.get_list_of_users()
-            elif option == 14:
-                mongo_model.populate_database()
-            elif option == 15:
-                mongo_model.clean_database()
-            # Cassandra
-            elif option == 16:
-                cassandra_model.follower_number_analysis()
-            elif option == 17:
-                cassandra_model.user_interaction_patterns()
-            elif option == 18:
-                cassandra_model.trend_analysis_of_topics()
-            elif option == 19:
-                print("\nPerforming User Sentiment Analysis...")
-                sentiment_results = cassandra_model.user_sentiment_analysis()
-                for result in sentiment_results:
-                    print(f"Post ID: {result['post_id']}")
-                    print(f"Content: {result['content']}")
-                    print(f"Sentiment: {result['sentiment']}\n")
-            elif option == 20:
-                cassandra_model.content_type_performance()
-            elif option == 21:
-                tag = input("Enter the hashtag to analyze: ").strip()
-                if tag:
-                    print(f"\nFetching most engaging post types for the hashtag: {tag}")
-                    cassandra_model.most_engaging_post_types(tag)
-                else:
-                    print("Hashtag cannot be empty. Please try again.")
-            elif option == 22:
-                cassandra_model.keyword_influence_on_engagement()
-            elif option == 23:
-                cassandra_model.follower_to_engagement_ratio()
-            elif option == 24:
-                cassandra_model.average_response_time_to_comments()
-            elif option == 25:
-                cassandra_model.time_to_first_engagement()
-            elif option == 26:
-                cassandra_model.top_shared_posts()
-            elif option == 27:
-                print("\nPopulating the Cassandra database with random test data...")
-                cassandra_model.populate_database()
-                print("Database populated successfully!")
-            # Dgraph
-            elif option == 28:
-                dgraph_model.analyze_platform_usage()
-            elif option == 29:
-                dgraph_model.view_daily_engagement_trends()
-            elif option == 30:
-                dgraph_model.view_weekly_engagement_trends()
-            elif option == 31:
-                dgraph_model.view_monthly_engagement_trends()
-            elif option == 32:
-                dgraph_model.view_yearly_engagement_trends()
-            elif option == 33:
-                dgraph_model.cluster_users_by_interests()
-            elif option == 34:
-                dgraph_model.identify_inactive_users()
-            elif option == 35:
-                dgraph_model.analyze_post_retention()
-            elif option == 36:
-                dgraph_model.find_top_performing_post()
-            elif option == 37:
-                # dgraph_model
-                pass
-            # Else
-            else:
-                print("Invalid option. Please try again.")
+            name = OPERATION_NAMES.get(option, f"option_{option}")
+            scope = metrics.operation(name) if metrics is not None else nullcontext()
+            profile = profiler.operation(name) if profiler is not None else nullcontext()
+            with scope, profile:
+                run_option(option, mongo_model, cassandra_model, dgraph_model, materialized, runner)
         except ValueError:
             print("Error: Please enter a valid number.")
         except Exception as e:
             print(f"Unexpected error: {e}")
-    
+
+    if runner is not None:
+        runner.stop()
+    if instrumentation.enabled():
+        instrumentation.export_metrics(metrics)
     cassandra_model.close_connection()
     dgraph_model.close_connection()
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(cli.main(sys.argv[1:]))
     try:
         main()
     except Exception as e:
@@ -0,0 +1,447 @@
+"""
+Background refresh of the slow analytics into materialized results.
+
+Each job recomputes one analytic on its own schedule and keeps, next to the
+result, a watermark of the data already folded in, so a cycle reads only what
+is new:
+
+    tag-trends         Cassandra tags, last_used watermark: posts tagged since the previous cycle
+    user-engagement    Cassandra posts and users, token-range sweep
+    sentiment          Cassandra posts, token-range sweep, known posts are not scored again
+    inactive-users     Dgraph last_active index: users crossing the cutoff or active again
+    engagement-trends  Dgraph Trend rollup (Engagement uid watermark in RollupState) and the four trend views
+    language-stats     Mongo users, ObjectId watermark
+
+Cassandra tables have no time index to read "everything after" from, so the
+Cassandra jobs sweep the token ring instead: a cycle reads the
+MATERIALIZE_RANGES_PER_CYCLE ranges after the token watermark and replaces
+their share of the result. The data of such a result is as old as its least
+recently swept range. Timestamp watermarks do not see updates and deletes,
+so every MATERIALIZE_FULL_EVERY-th run of those jobs recomputes from scratch.
+
+Results and watermarks are pickled per job to MATERIALIZE_DIR: a restarted
+runner resumes where it stopped, and the menu and `materialized` read the last
+result without touching the stores.
+"""
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple
+
+from cassandra_model import TOKEN_MIN, TOKEN_SPLITS, sentiment_of, token_ranges
+from dgraph_inactivity import cutoff_for
+from dgraph_query import parse_datetime
+from instrumentation import Histogram
+from records import Columns
+
+MATERIALIZE_DIR = os.getenv("MATERIALIZE_DIR", "materialized")
+RANGES_PER_CYCLE = int(os.getenv("MATERIALIZE_RANGES_PER_CYCLE", 64))
+STORE_CONCURRENCY = int(os.getenv("MATERIALIZE_STORE_CONCURRENCY", 1))
+FULL_EVERY = int(os.getenv("MATERIALIZE_FULL_EVERY", 24))
+# results older than this are recomputed by the menu instead of served
+MAX_AGE = float(os.getenv("MATERIALIZE_MAX_AGE", 3600))
+INACTIVE_DAYS = 90
+TICK = 1.0
+TREND_VIEWS = ("daily", "weekly", "monthly", "yearly")
+
+
+def enabled():
+    """Run the jobs in the background of the menu."""
+    return os.getenv("MATERIALIZE_ENABLED", "").lower() in ("1", "true", "yes", "on")
+
+
+def serving():
+    """Answer the menu options from the materialized results, refreshed here or by `main.py materialize`."""
+    return enabled() or os.getenv("MATERIALIZE_SERVE", "").lower() in ("1", "true", "yes", "on")
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+class Materialized(NamedTuple):
+    result: object
+    watermark: object  # newest timestamp, ObjectId or token folded in
+    state: object  # what the job needs to fold in the next batch
+    as_of: datetime  # the result reflects the stores as of then, None until a sweep covers the ring
+    coverage: float = 1.0  # share of the token ring swept at least once
+    refreshed_at: datetime = None
+    duration_s: float = None
+    runs: int = 0
+
+
+class Job(NamedTuple):
+    name: str
+    store: str
+    interval: float  # seconds between refreshes
+    refresh: Callable  # (model, previous Materialized or None, full) -> Materialized
+    rows: Callable  # result -> rows of dicts
+    help: str
+    full_every: int = FULL_EVERY  # 0 never forces a full refresh
+
+
+# Cassandra
+
+def _tag_trends(model, previous, full):
+    """Every tag's post count and the posts tagged since the previous refresh."""
+    as_of = _now()
+    columns = Columns("tag, post_count, last_used")
+    counts = previous.state if previous is not None and not full else None
+    watermark = previous.watermark if counts is not None else None
+    rows, newest = [], watermark
+    # one row per tag, read whole
+    for tag, post_count, last_used in model.read_token_range("tags", columns, TOKEN_MIN, 2 ** 63 - 1, key="tag"):
+        changed = last_used is not None and (watermark is None or last_used > watermark)
+        new_posts = post_count - counts.get(tag, 0) if counts is not None and changed else 0
+        rows.append({"tag": tag, "post_count": post_count, "new_posts": new_posts, "last_used": last_used})
+        if last_used is not None and (newest is None or last_used > newest):
+            newest = last_used
+    rows.sort(key=lambda row: (row["new_posts"], row["post_count"]), reverse=True)
+    return Materialized(rows, newest, {row["tag"]: row["post_count"] for row in rows}, as_of)
+
+
+def _sweep(model, previous, full, read_range):
+    """
+    Read the ranges after the token watermark, the whole ring on a first or full
+    refresh, with read_range(model, low, high, previous partial or None) -> partial.
+    Returns the partials of every range swept so far, the watermark, the oldest
+    sweep time once the ring is covered, and the coverage.
+    """
+    ranges = token_ranges()
+    partials = dict(previous.state) if previous is not None else {}
+    if previous is None or full:
+        selected = range(len(ranges))
+    else:
+        start = next((index for index, (low, _) in enumerate(ranges) if low >= previous.watermark), 0)
+        selected = [(start + offset) % len(ranges) for offset in range(min(RANGES_PER_CYCLE, len(ranges)))]
+    for index in selected:
+        low, high = ranges[index]
+        previous_partial = partials.get(index, (None, None))[1]
+        partials[index] = (_now(), read_range(model, low, high, previous_partial))
+    as_of = min(swept for swept, _ in partials.values()) if len(partials) == TOKEN_SPLITS else None
+    return partials, ranges[index][1], as_of, len(partials) / TOKEN_SPLITS
+
+
+def _engagement_range(model, low, high, _):
+    engagement = Counter()
+    for user_id, like_count, comment_count in model.read_token_range(
+            "posts", "user_id, like_count, comment_count", low, high):
+        engagement[user_id] += (like_count or 0) + (comment_count or 0)
+    followers = dict(model.read_token_range("users", "user_id, followers_count", low, high, key="user_id"))
+    return engagement, followers
+
+
+def _user_engagement(model, previous, full):
+    """follower_to_engagement_ratio, posts and users swept by token range."""
+    partials, watermark, as_of, coverage = _sweep(model, previous, full, _engagement_range)
+    engagement, followers = Counter(), {}
+    for _, (range_engagement, range_followers) in partials.values():
+        engagement.update(range_engagement)
+        followers.update(range_followers)
+    results = []
+    for user_id, total_engagement in engagement.items():
+        followers_count = followers.get(user_id) or 0
+        results.append({"user_id": user_id, "total_engagement": total_engagement, "followers_count": followers_count,
+                        "ratio": total_engagement / followers_count if followers_count else 0})
+    return Materialized(results, watermark, partials, as_of, coverage)
+
+
+def _sentiment_range(model, low, high, known):
+    known = known or {}
+    scored = {}
+    for post_id, content in model.read_token_range("posts", "post_id, content", low, high):
+        # posts scored in an earlier sweep keep their score unless their content changed
+        score = known.get(post_id)
+        if score is None or score[0] != content:
+            score = (content, sentiment_of(content))
+        scored[post_id] = score
+    return scored
+
+
+def _sentiment(model, previous, full):
+    """user_sentiment_analysis, posts swept by token range."""
+    partials, watermark, as_of, coverage = _sweep(model, previous, full, _sentiment_range)
+    results = [{"post_id": post_id, "content": content, "sentiment": sentiment}
+               for _, scored in partials.values() for post_id, (content, sentiment) in scored.items()]
+    return Materialized(results, watermark, partials, as_of, coverage)
+
+
+# Dgraph
+
+def _inactive_users(model, previous, full):
+    """Users not active in the last INACTIVE_DAYS days, updated from the changes since the previous run."""
+    now = _now()
+    if previous is None or full:
+        users = {user.uid: user for user in model.identify_inactive_users(INACTIVE_DAYS, show=False, now=now)}
+    else:
+        users = {user.uid: user for user in previous.result}
+        for uid in model.users_active_since(previous.watermark):
+            users.pop(uid, None)
+        for user in model.identify_inactive_users(INACTIVE_DAYS, show=False, now=now,
+                                                  active_after=cutoff_for(INACTIVE_DAYS, previous.watermark)):
+            users[user.uid] = user
+    results = [user._replace(inactivity_duration=(now - parse_datetime(user.last_active)).days)
+               for user in users.values()]
+    return Materialized(results, now, None, now)
+
+
+def _engagement_trends(model, previous, full):
+    """Roll up the new engagements and read the four trend views when they changed."""
+    as_of = _now()
+    rolled_up = model.rollup_engagement_trends(full)
+    if previous is not None and not full and not rolled_up:
+        trends = previous.result
+    else:
+        with model.queries.snapshot() as txn:
+            trends = {view: getattr(model, f"view_{view}_engagement_trends")(txn=txn, show=False)
+                      for view in TREND_VIEWS}
+    return Materialized(trends, model.engagement_trends_watermark(), None, as_of)
+
+
+# MongoDB
+
+def _language_stats(model, previous, full):
+    """most_used_language, adding the users inserted since the previous run."""
+    as_of = _now()
+    if previous is None or full:
+        counts, newest = model.language_counts_since()
+    else:
+        delta, newest = model.language_counts_since(previous.watermark)
+        counts = Counter(previous.state)
+        counts.update(delta)
+    counts = dict(counts)
+    return Materialized({"eng": counts.get("eng", 0), "esp": counts.get("esp", 0)}, newest, counts, as_of)
+
+
+JOBS = (
+    Job("tag-trends", "cassandra", 60, _tag_trends, lambda result: result,
+        "post count of every tag and the posts tagged since the previous refresh"),
+    Job("user-engagement", "cassandra", 300, _user_engagement, lambda result: result,
+        "engagement per follower for each user", full_every=0),
+    Job("sentiment", "cassandra", 600, _sentiment, lambda result: result, "sentiment of every post", full_every=0),
+    Job("inactive-users", "dgraph", 3600, _inactive_users, lambda result: result,
+        f"users not active in the last {INACTIVE_DAYS} days"),
+    Job("engagement-trends", "dgraph", 300, _engagement_trends,
+        lambda result: [dict(view=view, **bucket._asdict()) for view, buckets in result.items() for bucket in buckets],
+        "daily, weekly, monthly and yearly engagement"),
+    Job("language-stats", "mongo", 300, _language_stats,
+        lambda result: [{"language": language, "users": users} for language, users in result.items()],
+        "users per language"),
+)
+JOBS_BY_NAME = {job.name: job for job in JOBS}
+
+
+def interval_of(job):
+    """The job's interval, overridden by MATERIALIZE_<JOB>_INTERVAL, e.g. MATERIALIZE_TAG_TRENDS_INTERVAL."""
+    return float(os.getenv(f"MATERIALIZE_{job.name.upper().replace('-', '_')}_INTERVAL", job.interval))
+
+
+class MaterializedStore:
+    """The last Materialized entry of each job, one pickle per job."""
+
+    def __init__(self, directory=MATERIALIZE_DIR):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.pickle")
+
+    def load(self, name):
+        try:
+            with open(self._path(name), "rb") as input_file:
+                return pickle.load(input_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, name, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file first so readers never see a partial pickle
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as output:
+                pickle.dump(entry, output, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self._path(name))
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def discard(self, name):
+        """Drop the entry of `name`, e.g. once its store was reset under its watermark."""
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def fresh(self, name, max_age=MAX_AGE):
+        """The entry of `name` when it covers the whole ring and its data is at most `max_age` seconds old."""
+        entry = self.load(name)
+        if entry is None or entry.as_of is None or (_now() - entry.as_of).total_seconds() > max_age:
+            return None
+        return entry
+
+
+def lag_s(entry, now=None):
+    """Age of the data behind an entry, None while a sweep has not covered the ring."""
+    return None if entry.as_of is None else ((now or _now()) - entry.as_of).total_seconds()
+
+
+def freshness(entry):
+    """One line describing how fresh a materialized result is."""
+    lag = lag_s(entry)
+    if lag is None:
+        return f"refreshed {entry.refreshed_at:%Y-%m-%d %H:%M:%S} UTC, {entry.coverage:.0%} of the posts swept so far"
+    return f"as of {entry.as_of:%Y-%m-%d %H:%M:%S} UTC, {lag:.0f}s old"
+
+
+class JobStats:
+    __slots__ = ("durations", "failures", "last_error")
+
+    def __init__(self):
+        self.durations = Histogram()
+        self.failures = 0
+        self.last_error = None
+
+
+class Runner:
+    """
+    Refreshes the jobs on their schedules. A job never overlaps itself and at most
+    `concurrency` jobs per store run at once. `stores` maps a store name to its
+    model through get(), e.g. cli.Stores or a plain dict.
+    """
+
+    def __init__(self, stores, jobs=JOBS, results=None, metrics=None, concurrency=STORE_CONCURRENCY):
+        self.stores = stores
+        self.jobs = {job.name: job for job in jobs}
+        self.results = results or MaterializedStore()
+        self.metrics = metrics
+        self.stats = {name: JobStats() for name in self.jobs}
+        self._limits = {job.store: threading.BoundedSemaphore(concurrency) for job in jobs}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_job(self, name, full=False):
+        """Refresh one job now, returns its entry or None when it failed or was already running."""
+        if not self._claim(name):
+            return None
+        return self._run(name, full)
+
+    def _claim(self, name):
+        with self._lock:
+            if name in self._running:
+                return False
+            self._running.add(name)
+            return True
+
+    def _run(self, name, full=False):
+        job = self.jobs[name]
+        stats = self.stats[name]
+        try:
+            with self._limits[job.store]:
+                previous = self.results.load(name)
+                runs = previous.runs if previous is not None else 0
+                full = full or bool(job.full_every and runs and runs % job.full_every == 0)
+                scope = self.metrics.operation(f"materialize_{name.replace('-', '_')}") if self.metrics else nullcontext()
+                start = time.perf_counter()
+                with scope:
+                    entry = job.refresh(self.stores.get(job.store), previous, full)
+                duration = time.perf_counter() - start
+                entry = entry._replace(refreshed_at=_now(), duration_s=duration, runs=runs + 1)
+                self.results.save(name, entry)
+            stats.durations.observe(duration * 1e6)
+            return entry
+        except Exception as e:
+            stats.failures += 1
+            stats.last_error = str(e)
+            print(f"Materializing {name} failed: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._running.discard(name)
+
+    def _first_runs(self):
+        """Monotonic time of each job's next run, resuming the schedule of the stored results."""
+        now, wall = time.monotonic(), _now()
+        schedule = {}
+        for name, job in self.jobs.items():
+            entry = self.results.load(name)
+            elapsed = (wall - entry.refreshed_at).total_seconds() if entry is not None else None
+            schedule[name] = now if elapsed is None else now + max(0.0, interval_of(job) - elapsed)
+        return schedule
+
+    def run_forever(self):
+        """Schedule the jobs until stop() is called."""
+        schedule = self._first_runs()
+        with ThreadPoolExecutor(max_workers=len(self.jobs), thread_name_prefix="materialize") as executor:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                for name, job in self.jobs.items():
+                    if schedule[name] <= now and self._claim(name):
+                        schedule[name] = now + interval_of(job)
+                        executor.submit(self._run, name)
+                self._stop.wait(TICK)
+
+    def start(self):
+        """Run the scheduler on a daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="materializer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self):
+        """One row per job: schedule, last refresh, duration, lag and failures."""
+        rows = status(self.results, self.jobs.values())
+        for row in rows:
+            stats = self.stats[row["job"]]
+            row.update(running=row["job"] in self._running, failures=stats.failures, last_error=stats.last_error,
+                       mean_duration_s=(stats.durations.total_us / stats.durations.count / 1e6
+                                        if stats.durations.count else None))
+        return rows
+
+    def prometheus_text(self):
+        lines = ["# HELP sma_materialized_lag_seconds Age of the data behind each materialized result.",
+                 "# TYPE sma_materialized_lag_seconds gauge"]
+        rows = self.status()
+        lines += [f'sma_materialized_lag_seconds{{job="{row["job"]}"}} {row["lag_s"]:.3f}'
+                  for row in rows if row["lag_s"] is not None]
+        lines.append("# TYPE sma_materialized_coverage gauge")
+        lines += [f'sma_materialized_coverage{{job="{row["job"]}"}} {row["coverage"]}'
+                  for row in rows if row["coverage"] is not None]
+        lines.append("# TYPE sma_materialize_duration_seconds summary")
+        for name, stats in sorted(self.stats.items()):
+            lines.append(f'sma_materialize_duration_seconds_sum{{job="{name}"}} {stats.durations.total_us / 1e6:.6f}')
+            lines.append(f'sma_materialize_duration_seconds_count{{job="{name}"}} {stats.durations.count}')
+        lines.append("# TYPE sma_materialize_failures_total counter")
+        lines += [f'sma_materialize_failures_total{{job="{name}"}} {stats.failures}'
+                  for name, stats in sorted(self.stats.items())]
+        return "\n".join(lines) + "\n"
+
+
+def status(results=None, jobs=JOBS):
+    """Stored state of each job, without a running Runner."""
+    results = results or MaterializedStore()
+    now = _now()
+    rows = []
+    for job in jobs:
+        entry = results.load(job.name)
+        rows.append({
+            "job": job.name, "store": job.store, "interval_s": interval_of(job),
+            "runs": entry.runs if entry else 0,
+            "refreshed_at": entry.refreshed_at if entry else None,
+            "as_of": entry.as_of if entry else None,
+            "lag_s": lag_s(entry, now) if entry else None,
+            "coverage": entry.coverage if entry else None,
+            "duration_s": entry.duration_s if entry else None,
+            "watermark": str(entry.watermark) if entry and entry.watermark is not None else None,
+        })
+    return rows
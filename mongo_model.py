@@ -1,64 +1,75 @@
 import os
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
-from datetime import datetime
 import pymongo
 
-class User:
-    def __init__(self, username:str, password:str):
-        self.username = username
-        self.password = password
-        self.creation_date = datetime.now()
-        self.notifications = "on" # on of of
-        self.language = "ENG" # ENG or ESP
+from records import Post, User, documents
+from result_cache import ResultCache, cached
+from timeline import Timeline
+
+DB_NAME = 'iteso'
+# every collection of the database, dropped by clean_database and copied by fixtures.py
+COLLECTIONS = ("users", "posts", "post_daily_stats")
+TOP_POSTERS = 10
+# server error code of a unique index violation
+DUPLICATE_KEY = 11000
+# day of a post as an int, e.g. 20240601, and the length of its text
+_DAY = {"$toInt": {"$dateToString": {"format": "%Y%m%d", "date": "$creation_date"}}}
+_TEXT_LENGTH = {"$strLenCP": {"$ifNull": ["$text", ""]}}
+
+
+def day_of(timestamp):
+    return int(f"{timestamp:%Y%m%d}")
+
+
+def show_language_counts(counts):
+    count_eng, count_esp = counts["eng"], counts["esp"]
+    # Determine the most used language and the second most used
+    if count_eng > count_esp:
+        print(f"The most used language is 'eng' with {count_eng} users.")
+        print(f"The second most used language is 'esp' with {count_esp} users.")
+    elif count_esp > count_eng:
+        print(f"The most used language is 'esp' with {count_esp} users.")
+        print(f"The second most used language is 'eng' with {count_eng} users.")
+    else:
+        print(f"Both languages are used equally, with {count_eng} users each.")
+
+
+def _insert_new(collection, documents):
+    """Insert what is not there yet, unordered, and return the documents inserted."""
+    try:
+        collection.insert_many(documents, ordered=False)
+        return documents
+    except pymongo.errors.BulkWriteError as e:
+        if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+            raise
+        skipped = {error["index"] for error in e.details["writeErrors"]}
+        return [document for index, document in enumerate(documents) if index not in skipped]
 
-    def to_dict(self):
-        return {
-            "username": self.username,
-            "password": self.password,
-            "creation_date": self.creation_date,
-            "notifications": self.notifications,
-            "language": self.language,
-        }
-
-class Post:
-    def __init__(self, title:str, text:str, username:str):
-        self.title = title
-        self.text = text
-        self.username = username
-        self.creation_date = datetime.now()
-
-    def to_dict(self):
-        return {
-            "title": self.title,
-            "text": self.text,
-            "username": self.username,
-            "creation_date": self.creation_date
-        }
 
 class MongoModel:
-    def __init__(self):
+    def __init__(self, client=None):
         self.current_username = None
+        self.cache = ResultCache()
+        self.timeline = Timeline(self._newest_posts)
 
         # .env
         MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
-        DB_NAME = 'iteso'
 
         try:
-            # Try to connect to MongoDB
-            client = MongoClient(MONGODB_URI)
+            # Try to connect to MongoDB, unless a client (e.g. mongomock for benchmarks) is given
+            client = client or MongoClient(MONGODB_URI)
             
             # Check the connection
             client.admin.command('ping')  # If successful, it will respond with "ok: 1"
             
             # Successful connection, access the database and collections
-            db = client[DB_NAME]
-            self.users_collection = db["users"]
-            self.posts_collection = db["posts"]
-            
-            # Create indexes
-            self.users_collection.create_index("username", unique=True)
-            self.posts_collection.create_index("title", unique=True)
+            self.db = client[DB_NAME]
+            self.users_collection = self.db["users"]
+            self.posts_collection = self.db["posts"]
+            # bucket pattern: one document per user per day with the count and text length of its posts
+            self.post_daily_stats = self.db["post_daily_stats"]
+            self.create_indexes()
 
             print("MongoDB connection successful.")
             
@@ -69,6 +80,14 @@ class MongoModel:
             print(f"Unexpected error: {e}")
             exit(1)  # Stop the script if any other error occurs
 
+    def create_indexes(self):
+        self.users_collection.create_index("username", unique=True)
+        self.posts_collection.create_index("title", unique=True)
+        # newest-first timelines walk this index backwards
+        self.posts_collection.create_index("creation_date")
+        self.post_daily_stats.create_index([("username", 1), ("day", 1)], unique=True)
+        self.post_daily_stats.create_index("day")
+
     def create_user(self):
         try:
             username = input("Enter the username: ").strip()
@@ -77,6 +96,7 @@ class MongoModel:
             user = User(username, password)
 
             result = self.users_collection.insert_one(user.to_dict())
+            self.cache.invalidate("mongo.users")
             print(f"User created with ID: {result.inserted_id}")
         except pymongo.errors.DuplicateKeyError:
             print("Error: A user with this email already exists.")
@@ -100,6 +120,7 @@ class MongoModel:
                 result = self.users_collection.delete_one({"username": self.current_username})
 
                 if result.deleted_count == 1:
+                    self.cache.invalidate("mongo.users")
                     print(f"User '{self.current_username}' has been successfully deleted.")
                     self.current_username = None
                 else:
@@ -230,26 +251,150 @@ class MongoModel:
             {"username": self.current_username},
             {"$set": {"language": new_language}}
         )
+        self.cache.invalidate("mongo.users")
 
         print(f"Your language has been successfully updated to '{new_language}'.")
 
 
-    def most_used_language(self):
-        # Count the number of users with language set to 'eng'
-        count_eng = self.users_collection.count_documents({"language": "eng"})
-        
-        # Count the number of users with language set to 'esp'
-        count_esp = self.users_collection.count_documents({"language": "esp"})
-        
-        # Determine the most used language and the second most used
-        if count_eng > count_esp:
-            print(f"The most used language is 'eng' with {count_eng} users.")
-            print(f"The second most used language is 'esp' with {count_esp} users.")
-        elif count_esp > count_eng:
-            print(f"The most used language is 'esp' with {count_esp} users.")
-            print(f"The second most used language is 'eng' with {count_eng} users.")
-        else:
-            print(f"Both languages are used equally, with {count_eng} users each.")
+    def most_used_language(self, show=True):
+        counts = self._language_counts()
+        if show:
+            show_language_counts(counts)
+        return counts
+
+
+    @cached("most_used_language", ttl=300, tags=("mongo.users",))
+    def _language_counts(self):
+        # Count the number of users with language set to 'eng' and 'esp'
+        return {
+            "eng": self.users_collection.count_documents({"language": "eng"}),
+            "esp": self.users_collection.count_documents({"language": "esp"}),
+        }
+
+
+    def language_counts_since(self, last_id=None):
+        """
+        Users per language inserted after the `_id` `last_id`, all of them without it,
+        and the newest `_id` read. ObjectIds grow with insertion time, so the counts
+        of successive calls add up, updates and deletes aside.
+        """
+        match = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        counts, newest = {}, last_id
+        for group in self.users_collection.aggregate([{"$match": match},
+                                                      {"$group": {"_id": "$language", "users": {"$sum": 1},
+                                                                  "newest": {"$max": "$_id"}}}]):
+            counts[group["_id"]] = group["users"]
+            if newest is None or group["newest"] > newest:
+                newest = group["newest"]
+        return counts, newest
+
+
+    def post_analytics(self, top=TOP_POSTERS, show=True):
+        """Totals, posts per user, top posters and posts per month, in one $facet aggregation."""
+        report = self._post_analytics(top)
+        if show:
+            totals = report["totals"]
+            print(f"Posts: {totals['posts']} by {totals['users']} users, {totals['avg_posts_per_user']:.2f} per user "
+                  f"(at most {totals['max_posts_per_user']}), average text length {totals['avg_text_length']:.1f}")
+            print("Top posters:")
+            for row in report["top_posters"]:
+                print(f"  {row['username']}: {row['posts']} posts")
+            print("Posts per month:")
+            for row in report["monthly"]:
+                print(f"  {row['month']}: {row['posts']}")
+        return report
+
+
+    @cached("post_analytics", ttl=300, tags=("mongo.posts",))
+    def _post_analytics(self, top):
+        pipeline = [{"$facet": {
+            "totals": [{"$group": {"_id": None, "posts": {"$sum": 1}, "text_length": {"$avg": _TEXT_LENGTH},
+                                   "first": {"$min": "$creation_date"}, "last": {"$max": "$creation_date"}}}],
+            "per_user": [{"$group": {"_id": "$username", "posts": {"$sum": 1}}},
+                         {"$group": {"_id": None, "users": {"$sum": 1}, "average": {"$avg": "$posts"},
+                                     "most": {"$max": "$posts"}}}],
+            "top_posters": [{"$group": {"_id": "$username", "posts": {"$sum": 1}}},
+                            {"$sort": {"posts": -1, "_id": 1}}, {"$limit": top}],
+            "monthly": [{"$group": {"_id": {"$dateToString": {"format": "%Y-%m", "date": "$creation_date"}},
+                                    "posts": {"$sum": 1}}},
+                        {"$sort": {"_id": 1}}],
+        }}]
+        # $facet answers a single document
+        facets = list(self.posts_collection.aggregate(pipeline, allowDiskUse=True))[0]
+        totals = facets["totals"][0] if facets["totals"] else {}
+        per_user = facets["per_user"][0] if facets["per_user"] else {}
+        return {
+            "totals": {"posts": totals.get("posts", 0), "users": per_user.get("users", 0),
+                       "avg_posts_per_user": per_user.get("average") or 0,
+                       "max_posts_per_user": per_user.get("most", 0),
+                       "avg_text_length": totals.get("text_length") or 0,
+                       "first_post": totals.get("first"), "last_post": totals.get("last")},
+            "top_posters": [{"username": row["_id"], "posts": row["posts"]} for row in facets["top_posters"]],
+            "monthly": [{"month": row["_id"], "posts": row["posts"]} for row in facets["monthly"]],
+        }
+
+
+    def post_activity(self, first_day=0, last_day=99999999, top=TOP_POSTERS, show=True):
+        """
+        Posts per day between the days `first_day` and `last_day` (e.g. 20240601), with
+        the top posters and totals of the range, read from the post_daily_stats buckets.
+        """
+        report = self._post_activity(first_day, last_day, top)
+        if show:
+            totals = report["totals"]
+            print(f"Posts: {totals['posts']} by {totals['users']} users over {totals['days']} days, "
+                  f"average text length {totals['avg_text_length']:.1f}")
+            print("Top posters:")
+            for row in report["top_posters"]:
+                print(f"  {row['username']}: {row['posts']} posts")
+            print("Posts per day:")
+            for row in report["daily"]:
+                print(f"  {row['day']}: {row['posts']} posts by {row['users']} users")
+        return report
+
+
+    @cached("post_activity", ttl=300, tags=("mongo.posts",))
+    def _post_activity(self, first_day, last_day, top):
+        pipeline = [
+            {"$match": {"day": {"$gte": first_day, "$lte": last_day}, "posts": {"$gt": 0}}},
+            {"$facet": {
+                "totals": [{"$group": {"_id": None, "posts": {"$sum": "$posts"},
+                                       "text_length": {"$sum": "$text_length"}}}],
+                # distinct users counted by grouping, an $addToSet of them would grow past the document limit
+                "users": [{"$group": {"_id": "$username"}}, {"$count": "users"}],
+                "daily": [{"$group": {"_id": "$day", "posts": {"$sum": "$posts"}, "users": {"$sum": 1}}},
+                          {"$sort": {"_id": 1}}],
+                "top_posters": [{"$group": {"_id": "$username", "posts": {"$sum": "$posts"}}},
+                                {"$sort": {"posts": -1, "_id": 1}}, {"$limit": top}],
+            }},
+        ]
+        facets = list(self.post_daily_stats.aggregate(pipeline, allowDiskUse=True))[0]
+        totals = facets["totals"][0] if facets["totals"] else {"posts": 0, "text_length": 0}
+        users = facets["users"][0]["users"] if facets["users"] else 0
+        return {
+            # the daily facet has one row per day of the range with posts
+            "totals": {"posts": totals["posts"], "users": users, "days": len(facets["daily"]),
+                       "avg_text_length": totals["text_length"] / totals["posts"] if totals["posts"] else 0},
+            "daily": [{"day": row["_id"], "posts": row["posts"], "users": row["users"]} for row in facets["daily"]],
+            "top_posters": [{"username": row["_id"], "posts": row["posts"]} for row in facets["top_posters"]],
+        }
+
+
+    def rebuild_post_daily_stats(self):
+        """Recompute every bucket from the posts, after bulk loads that bypass add_post."""
+        self.posts_collection.aggregate([
+            {"$group": {"_id": {"username": "$username", "day": _DAY}, "posts": {"$sum": 1},
+                        "text_length": {"$sum": _TEXT_LENGTH}}},
+            {"$project": {"_id": 0, "username": "$_id.username", "day": "$_id.day", "posts": 1, "text_length": 1}},
+            # $out swaps the collection in once complete and keeps its indexes
+            {"$out": "post_daily_stats"},
+        ], allowDiskUse=True)
+
+
+    def _count_post(self, post, sign):
+        self.post_daily_stats.update_one(
+            {"username": post["username"], "day": day_of(post["creation_date"])},
+            {"$inc": {"posts": sign, "text_length": sign * len(post.get("text") or "")}}, upsert=True)
 
 
     def create_post(self):
@@ -265,23 +410,12 @@ class MongoModel:
             print("Error: Title and text cannot be empty.")
             return
 
-        # Check if a post with the same title already exists
-        existing_post = self.posts_collection.find_one({"title": title})
-
-        if existing_post:
-            print(f"Error: A post with the title '{title}' already exists.")
-            return
-
         try:
-            # Create the Post object
-            post = Post(title=title, text=text, username=self.current_username)
-
-            # Insert the post into the database
-            result = self.posts_collection.insert_one(post.to_dict())
-            print(f"Post created with ID: {result.inserted_id}")
+            post = self.add_post(self.current_username, title, text)
+            print(f"Post created with ID: {post['_id']}")
 
         except pymongo.errors.DuplicateKeyError:
-            # This will catch if another post was inserted with the same title due to race condition
+            # The unique index on title rejects a second post with the same title
             print(f"Error: A post with the title '{title}' already exists.")
         except Exception as e:
             print(f"Unexpected error while creating the post: {e}")
@@ -299,26 +433,13 @@ class MongoModel:
             print("Error: Title cannot be empty.")
             return
 
-        # Find the post in the database based on the title
-        post = self.posts_collection.find_one({"title": title})
-
-        if post is None:
+        try:
+            self.remove_post(self.current_username, title)
+            print(f"Post with title '{title}' has been deleted.")
+        except LookupError:
             print(f"Error: No post found with the title '{title}'.")
-            return
-
-        # Verify that the current user is the one who created the post
-        if post["username"] != self.current_username:
+        except PermissionError:
             print("Error: You can only delete posts that you created.")
-            return
-
-        try:
-            # Delete the post from the database
-            result = self.posts_collection.delete_one({"title": title})
-
-            if result.deleted_count == 1:
-                print(f"Post with title '{title}' has been deleted.")
-            else:
-                print("Error: Failed to delete the post.")
         except Exception as e:
             print(f"Unexpected error while deleting the post: {e}")
 
@@ -374,16 +495,16 @@ class MongoModel:
             print("Error: Invalid input. Please enter a valid number.")
             return
 
-        # Find all posts, sorted by creation_date (oldest first), with a limit
-        posts = list(self.posts_collection.find().sort("creation_date", 1).limit(limit))
+        # Newest posts of everyone else, served from the timeline cache
+        posts = self.home_timeline(self.current_username, limit)
 
         # Check if any posts are returned
-        if posts == 0:
+        if not posts:
             print("No posts available.")
             return
 
         # Display the posts
-        print(f"\nAll posts from people:")
+        print(f"\nLatest posts from people:")
         for post in posts:
             print(f"\nTitle: {post['title']}")
             print(f"Text: {post['text']}")
@@ -392,18 +513,21 @@ class MongoModel:
             print("-" * 40)  # Separator for readability
 
 
-    def get_list_of_users(self):
+    def get_list_of_users(self, show=True):
         # Query the users_collection and only project the "username" field
         users = list(self.users_collection.find({}, {"_id": 0, "username": 1}))  # Exclude _id, include username
+        if not show:
+            return users
         
         if len(users) == 0:
             print("No users found.")
-            return
+            return users
 
         # Print all the usernames
         print("\nList of usernames:")
         for user in users:
             print(user['username'])
+        return users
 
 
     def populate_database(self):
@@ -427,34 +551,37 @@ class MongoModel:
         ]
 
         try:
-            for user in users:
-                self.users_collection.insert_one(user.to_dict())
-        except pymongo.errors.DuplicateKeyError:
-            print("Error: A user with this email already exists.")
+            if len(_insert_new(self.users_collection, [user.to_dict() for user in users])) < len(users):
+                print("Error: A user with this email already exists.")
         except ValueError:
             print("Error: Invalid age. Please try again.")
         except Exception as e:
             print(f"Unexpected error: {e}")
-        
+
         try:
-            for post in posts:
-                self.posts_collection.insert_one(post.to_dict())
-        except pymongo.errors.DuplicateKeyError:
-            # This will catch if another post was inserted with the same title due to race condition
-            print(f"Error: A post with the title already exists.")
+            documents = [post.to_dict() for post in posts]
+            inserted = _insert_new(self.posts_collection, documents)
+            # only the posts actually inserted go into the daily buckets
+            for document in inserted:
+                self._count_post(document, 1)
+            if len(inserted) < len(documents):
+                print("Error: A post with the title already exists.")
         except Exception as e:
             print(f"Unexpected error while creating the post: {e}")
-        
+
+        self.cache.invalidate("mongo.users", "mongo.posts")
+        self.timeline.clear()
         print("Done")
 
         
     def clean_database(self):
-        # Delete all users and posts from their respective collections
+        # Drop the collections instead of deleting document by document, then recreate their indexes
         try:
-            # Remove all users
-            self.users_collection.delete_many({})
-            # Remove all posts
-            self.posts_collection.delete_many({})
+            for name in COLLECTIONS:
+                self.db.drop_collection(name)
+            self.create_indexes()
+            self.cache.invalidate("mongo.users", "mongo.posts")
+            self.timeline.clear()
             
             # Log out the current user
             self.current_username = None
@@ -462,4 +589,106 @@ class MongoModel:
             print("Database cleaned and user logged out.")
             
         except Exception as e:
-            print(f"An error occurred while cleaning the database: {e}")
\ No newline at end of file
+            print(f"An error occurred while cleaning the database: {e}")
+
+    def load_dataset(self, dataset):
+        """Insert the users and posts of a SyntheticDataset, one insert_many per chunk."""
+        inserted = duplicates = 0
+        for collection, documents in self._dataset_documents(dataset):
+            try:
+                inserted += len(collection.insert_many(documents, ordered=False).inserted_ids)
+            except pymongo.errors.BulkWriteError as e:
+                # usernames and titles already present are skipped, the rest of the chunk is inserted
+                inserted += e.details["nInserted"]
+                duplicates += len(e.details["writeErrors"])
+        self.rebuild_post_daily_stats()
+        self.cache.invalidate("mongo.users", "mongo.posts")
+        self.timeline.clear()
+        print(f"Inserted {inserted} documents ({duplicates} already present), seed {dataset.seed}.")
+
+    def _dataset_documents(self, dataset):
+        for chunk in dataset.users():
+            yield self.users_collection, documents(User, chunk, creation_date="joined_date")
+        for chunk in dataset.posts():
+            yield self.posts_collection, documents(Post, chunk, text="content", creation_date="timestamp")
+
+
+    # Non-interactive operations, used by the HTTP service. They take the user explicitly,
+    # raise instead of printing and return plain documents.
+
+    def add_user(self, username, password):
+        if not username or not password:
+            raise ValueError("Username and password cannot be empty.")
+        user = User(username, password).to_dict()
+        self.users_collection.insert_one(user)
+        self.cache.invalidate("mongo.users")
+        return {key: value for key, value in user.items() if key not in ("_id", "password")}
+
+    def remove_user(self, username):
+        if self.users_collection.delete_one({"username": username}).deleted_count == 0:
+            raise LookupError(f"User '{username}' not found.")
+        self.cache.invalidate("mongo.users")
+
+    def authenticate(self, username, password):
+        user = self.users_collection.find_one({"username": username}, {"password": 1})
+        return user is not None and user["password"] == password
+
+    def update_settings(self, username, password=None, notifications=None, language=None, current_password=None):
+        """Change the settings of `username`, a new password needs the current one."""
+        changes = {}
+        if password:
+            if not current_password or not self.authenticate(username, current_password):
+                raise PermissionError("Incorrect current password.")
+            changes["password"] = password
+        if notifications is not None:
+            if notifications not in ("on", "off"):
+                raise ValueError("Notifications must be 'on' or 'off'.")
+            changes["notifications"] = notifications
+        if language is not None:
+            if language not in ("eng", "esp"):
+                raise ValueError("Language must be 'eng' or 'esp'.")
+            changes["language"] = language
+        if not changes:
+            raise ValueError("Nothing to update.")
+        if self.users_collection.update_one({"username": username}, {"$set": changes}).matched_count == 0:
+            raise LookupError(f"User '{username}' not found.")
+        self.cache.invalidate("mongo.users")
+
+    def add_post(self, username, title, text):
+        if not title or not text:
+            raise ValueError("Title and text cannot be empty.")
+        post = Post(title=title, text=text, username=username).to_dict()
+        self.posts_collection.insert_one(post)
+        self._count_post(post, 1)
+        self.cache.invalidate("mongo.posts")
+        self.timeline.added(post)
+        return post
+
+    def remove_post(self, username, title):
+        """Delete a post of `username`, LookupError if it does not exist, PermissionError if it is someone else's."""
+        post = self.posts_collection.find_one_and_delete({"title": title, "username": username},
+                                                         {"username": 1, "text": 1, "creation_date": 1})
+        if post is not None:
+            self._count_post(post, -1)
+            self.cache.invalidate("mongo.posts")
+            self.timeline.removed(title)
+            return
+        if self.posts_collection.find_one({"title": title}, {"_id": 1}) is None:
+            raise LookupError(f"No post found with the title '{title}'.")
+        raise PermissionError("You can only delete posts that you created.")
+
+    def posts_by(self, username, limit=10):
+        return list(self.posts_collection.find({"username": username}, {"_id": 0})
+                    .sort("creation_date", 1).limit(limit))
+
+    def recent_posts(self, limit=10):
+        """The `limit` newest posts, newest first."""
+        return self._newest_posts(limit)
+
+    def home_timeline(self, username, limit=10):
+        """The `limit` newest posts written by anyone but `username`, see timeline.py."""
+        return self.timeline.page(username, limit)
+
+    def _newest_posts(self, limit, exclude=None):
+        query = {"username": {"$ne": exclude}} if exclude is not None else {}
+        return list(self.posts_collection.find(query, {"_id": 0}).sort("creation_date", -1).limit(limit))
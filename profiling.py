@@ -0,0 +1,142 @@
+"""
+On-demand CPU and memory profiling of menu operations and batch commands.
+
+With PROFILE_ENABLED=1 (or `main.py --profile <command>`) a PROFILE_SAMPLE_RATE
+share of the operations runs under cProfile and tracemalloc. Each profiled run
+writes `<operation>-<time>-<pid>.prof` (open it with pstats or snakeviz) to
+PROFILE_DIR and appends a line to its summary.jsonl: wall time, time seen by
+the profiler, peak traced memory, and the source lines holding the most memory
+allocated during the operation when it returns.
+
+Profiles are taken one at a time: cProfile only sees the thread it runs in,
+and tracemalloc peaks are process wide, so operations overlapping a profiled
+one (run-all workers) run unprofiled.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 1.0))
+TOP_LINES = int(os.getenv("PROFILE_TOP_LINES", 10))
+SUMMARY_FILE = "summary.jsonl"
+TOP_FUNCTIONS = 5
+
+
+def enabled():
+    return os.getenv("PROFILE_ENABLED", "").lower() in ("1", "true", "yes", "on")
+
+
+class Profiler:
+    def __init__(self, directory=PROFILE_DIR, sample_rate=SAMPLE_RATE, top_lines=TOP_LINES):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.top_lines = top_lines
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def operation(self, name):
+        """Profile the body when sampled and no other profile is running."""
+        if random.random() >= self.sample_rate or not self._lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            else:
+                tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                wall = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                after = tracemalloc.take_snapshot()
+                if started:
+                    tracemalloc.stop()
+                self._write(name, profile, wall, peak, after.compare_to(before, "lineno"))
+        finally:
+            self._lock.release()
+
+    def _write(self, name, profile, wall, peak, growth):
+        os.makedirs(self.directory, exist_ok=True)
+        now = datetime.now(timezone.utc)
+        path = os.path.join(self.directory, f"{name}-{now:%Y%m%dT%H%M%S%f}-{os.getpid()}.prof")
+        profile.dump_stats(path)
+        stats = pstats.Stats(profile)
+        entry = {
+            "operation": name,
+            "time": now.isoformat(),
+            "profile": os.path.basename(path),
+            "wall_s": wall,
+            "profiled_s": stats.total_tt,
+            "calls": stats.total_calls,
+            "peak_bytes": peak,
+            "top_lines": [{"line": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                           "bytes": stat.size_diff, "blocks": stat.count_diff}
+                          for stat in sorted(growth, key=lambda stat: stat.size_diff, reverse=True)[:self.top_lines]
+                          if stat.size_diff > 0],
+        }
+        # appends are serialized by the profile lock held by the caller
+        with open(os.path.join(self.directory, SUMMARY_FILE), "a") as output:
+            output.write(json.dumps(entry) + "\n")
+
+
+def summarize(directory=PROFILE_DIR, top_functions=TOP_FUNCTIONS):
+    """
+    One row per profiled operation, ranked by cumulative profiled time, with its rank
+    by peak memory, the functions with the most time of their own over every
+    profile of the operation, and the top lines of its largest run.
+    """
+    path = os.path.join(directory, SUMMARY_FILE)
+    if not os.path.exists(path):
+        return []
+    runs = {}
+    with open(path) as summary:
+        for line in summary:
+            entry = json.loads(line)
+            runs.setdefault(entry["operation"], []).append(entry)
+    rows = []
+    for operation, entries in runs.items():
+        largest = max(entries, key=lambda entry: entry["peak_bytes"])
+        rows.append({
+            "operation": operation,
+            "runs": len(entries),
+            "cumulative_s": sum(entry["profiled_s"] for entry in entries),
+            "mean_wall_s": sum(entry["wall_s"] for entry in entries) / len(entries),
+            "max_wall_s": max(entry["wall_s"] for entry in entries),
+            "peak_mb": largest["peak_bytes"] / 2 ** 20,
+            "top_functions": _top_functions(directory, entries, top_functions),
+            "top_lines": largest["top_lines"],
+        })
+    for rank, row in enumerate(sorted(rows, key=lambda row: row["peak_mb"], reverse=True), 1):
+        row["memory_rank"] = rank
+    rows.sort(key=lambda row: row["cumulative_s"], reverse=True)
+    for rank, row in enumerate(rows, 1):
+        row["time_rank"] = rank
+    return rows
+
+
+def _top_functions(directory, entries, count):
+    files = [os.path.join(directory, entry["profile"]) for entry in entries]
+    files = [path for path in files if os.path.exists(path)]
+    if not files:
+        return []
+    stats = pstats.Stats(*files)
+    # (primitive calls, calls, own time, cumulative time, callers) per function
+    ranked = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:count]
+    return [{"function": f"{os.path.basename(filename)}:{line}({function})", "own_s": own, "cumulative_s": cumulative,
+             "calls": calls}
+            for (filename, line, function), (_, calls, own, cumulative, _) in ranked]
@@ -0,0 +1,104 @@
+"""
+Compact record types of the users and posts the models hold in memory.
+
+Scans over large tables hold millions of users, posts and engagement rows at
+once, and there the per-object overhead dominates memory: a regular instance
+carries its own __dict__, a driver row its field names. The records below
+declare __slots__ so an instance is a fixed block of references.
+
+Rows that are only aggregated should not become objects at all. Cassandra
+scans read plain tuples and index them through `Columns`, and Mongo inserts
+build documents straight from the synthetic columns with `documents`.
+"""
+from datetime import datetime
+from operator import itemgetter
+
+
+class Record:
+    __slots__ = ()
+    # fields stored in a Mongo document, all of them when empty
+    DOCUMENT = ()
+
+    def astuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.DOCUMENT or self.__slots__}
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.astuple() == self.astuple()
+
+    # records are mutable and hold lists and sets (tags), so they compare by value but are not hashable
+    __hash__ = None
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+class User(Record):
+    __slots__ = ("username", "password", "creation_date", "notifications", "language", "user_id", "email",
+                 "followers_count", "following_count")
+    DOCUMENT = ("username", "password", "creation_date", "notifications", "language")
+
+    def __init__(self, username, password, creation_date=None, notifications="on", language="ENG", user_id=None,
+                 email=None, followers_count=0, following_count=0):
+        self.username = username
+        self.password = password
+        self.creation_date = creation_date or datetime.now()
+        self.notifications = notifications  # on or off
+        self.language = language  # ENG or ESP
+        self.user_id = user_id
+        self.email = email
+        self.followers_count = followers_count
+        self.following_count = following_count
+
+
+class Post(Record):
+    __slots__ = ("title", "text", "username", "creation_date", "post_id", "user_id", "tags", "like_count",
+                 "comment_count", "share_count")
+    DOCUMENT = ("title", "text", "username", "creation_date")
+
+    def __init__(self, title, text, username, creation_date=None, post_id=None, user_id=None, tags=(), like_count=0,
+                 comment_count=0, share_count=0):
+        self.title = title
+        self.text = text
+        self.username = username
+        self.creation_date = creation_date or datetime.now()
+        self.post_id = post_id
+        self.user_id = user_id
+        self.tags = tags
+        self.like_count = like_count
+        self.comment_count = comment_count
+        self.share_count = share_count
+
+
+class Columns:
+    """
+    Positions of the selected columns in tuple rows.
+
+        columns = Columns("user_id, like_count, comment_count")
+        for row in session.execute(f"SELECT {columns} FROM posts", execution_profile=TUPLE_ROWS):
+            engagement[row[columns.user_id]] += row[columns.like_count]
+    """
+
+    def __init__(self, names):
+        self.names = tuple(name.strip() for name in names.split(","))
+        for position, name in enumerate(self.names):
+            setattr(self, name, position)
+
+    def getter(self, *names):
+        """itemgetter of the named columns, one value or a tuple like itemgetter itself."""
+        return itemgetter(*(getattr(self, name) for name in names))
+
+    def __str__(self):
+        return ", ".join(self.names)
+
+
+def documents(record_type, columns, **sources):
+    """
+    Mongo documents of `record_type` from a dict of equal-length columns, without
+    building records. `sources` names the column of a field stored under another name.
+    """
+    fields = record_type.DOCUMENT or record_type.__slots__
+    return [dict(zip(fields, values)) for values in zip(*(columns[sources.get(field, field)] for field in fields))]
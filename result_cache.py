@@ -0,0 +1,187 @@
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ENTRIES = 256
+
+
+class ResultCache:
+    """
+    Analytic results keyed by analytic name and parameters.
+
+    Entries expire after their TTL, the least recently used ones are evicted
+    past `max_entries`, and each entry carries tags (e.g. "mongo.posts") so a
+    write path can drop every result it affects. With a directory the entries
+    are also pickled to disk and reused after a restart. Every value can be
+    overridden through RESULT_CACHE_ENABLED, RESULT_CACHE_SIZE and RESULT_CACHE_DIR.
+    """
+
+    def __init__(self, max_entries=None, directory=None, enabled=None):
+        if enabled is None:
+            enabled = os.getenv("RESULT_CACHE_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+        self.enabled = enabled
+        self.max_entries = max_entries or int(os.getenv("RESULT_CACHE_SIZE", MAX_ENTRIES))
+        self.directory = directory or os.getenv("RESULT_CACHE_DIR") or None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, tags, value)
+        self._lock = threading.Lock()
+        self._computing = {}  # key -> [lock, callers using it]
+        # bumped by invalidate() per tag and by clear(), a value computed across a bump is not stored
+        self._generations = {}
+        self._clears = 0
+
+    def get_or_compute(self, key, compute, ttl, tags=()):
+        """Cached value of `key`, concurrent misses on the same key compute it once."""
+        found, value = self._get(key)
+        if not found:
+            with self._lock:
+                computing = self._computing.setdefault(key, [threading.Lock(), 0])
+                computing[1] += 1
+            try:
+                with computing[0]:
+                    found, value = self._get(key)
+                    if not found:
+                        with self._lock:
+                            generation = self._generation(tags)
+                        value = compute()
+                        self._put(key, value, ttl, tags, generation)
+            finally:
+                with self._lock:
+                    computing[1] -= 1
+                    if not computing[1]:
+                        del self._computing[key]
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return value
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying one of `tags`."""
+        tags = set(tags)
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            for key in [key for key, (_, entry_tags, _) in self._entries.items() if tags & set(entry_tags)]:
+                del self._entries[key]
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(".pickle") and tags & set(name.split("-")[0].split("+")):
+                    _remove(os.path.join(self.directory, name))
+
+    def clear(self):
+        with self._lock:
+            self._clears += 1
+            self._entries.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(".pickle"):
+                    _remove(os.path.join(self.directory, name))
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return True, entry[2]
+                del self._entries[key]
+        if self.directory:
+            entry = self._load(key, now)
+            if entry is not None:
+                with self._lock:
+                    self._remember(key, entry)
+                return True, entry[2]
+        return False, None
+
+    def _put(self, key, value, ttl, tags, generation):
+        """Store the value unless its tags were invalidated since `generation` was read."""
+        entry = (time.time() + ttl, tuple(tags), value)
+        with self._lock:
+            if self._generation(tags) != generation:
+                return
+            self._remember(key, entry)
+        if self.directory:
+            self._store(key, entry)
+            # an invalidate() racing the write may have missed the file
+            with self._lock:
+                stale = self._generation(tags) != generation
+            if stale:
+                _remove(self._path(key, entry[1]))
+
+    def _generation(self, tags):
+        """Generation of `tags`, read under the lock."""
+        return self._clears, tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # Disk tier, file names carry the tags so invalidate() needs no index
+
+    def _path(self, key, tags):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{'+'.join(tags) or 'untagged'}-{digest}.pickle")
+
+    def _load(self, key, now):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        for name in os.listdir(self.directory):
+            if name.endswith(f"-{digest}.pickle"):
+                path = os.path.join(self.directory, name)
+                try:
+                    with open(path, "rb") as input_file:
+                        stored_key, entry = pickle.load(input_file)
+                except (OSError, EOFError, pickle.UnpicklingError):
+                    return None
+                if stored_key != key or entry[0] <= now:
+                    _remove(path)
+                    return None
+                return entry
+        return None
+
+    def _store(self, key, entry):
+        path = self._path(key, entry[1])
+        try:
+            # write to a temporary file first so readers never see a partial pickle
+            descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(descriptor, "wb") as output:
+                pickle.dump((key, entry), output, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+        except (OSError, pickle.PicklingError, TypeError):
+            pass  # the disk tier is best effort
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def cached(name, ttl, tags=()):
+    """
+    Cache a model method's result in the model's `cache` for `ttl` seconds.
+    The key is `name` plus the call arguments.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, "cache", None)
+            if cache is None or not cache.enabled:
+                return method(self, *args, **kwargs)
+            key = (name, args, tuple(sorted(kwargs.items())))
+            return cache.get_or_compute(key, lambda: method(self, *args, **kwargs), ttl, tags)
+        return wrapper
+    return decorator
@@ -0,0 +1,411 @@
+"""
+Asynchronous HTTP service over the three models: `python service.py --port 8080`.
+
+The drivers are blocking, so every call runs in a bounded thread pool per
+store. Each endpoint has its own concurrency limit, requests waiting longer
+than SERVICE_QUEUE_TIMEOUT for a slot get a 503. Analytics stream their rows
+as chunked JSON Lines.
+
+`POST /login` returns a token, sent back as `Authorization: Bearer <token>` by
+the routes marked *. They act as the user of the token, a user can only change
+or delete their own account and posts. Tokens are kept in memory for
+SERVICE_SESSION_TTL seconds, a restart logs everyone out.
+
+    GET    /analytics                        available analytics
+    GET    /analytics/{name}?days=&k=&tag=   rows of one analytic (see `main.py --help`)
+    GET    /users                            usernames
+    POST   /users                            {"username", "password"}
+    PATCH  /users/{username}               * {"password", "current_password", "notifications", "language"}
+    DELETE /users/{username}               *
+    POST   /login                            {"username", "password"}
+    POST   /logout                         *
+    GET    /users/{username}/posts?limit=
+    GET    /users/{username}/timeline?limit= newest posts of everyone else
+    GET    /posts?limit=
+    POST   /posts                          * {"title", "text"}
+    DELETE /posts/{title}                  *
+"""
+import argparse
+import asyncio
+import os
+import secrets
+import time
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from functools import partial
+from itertools import islice
+
+import pymongo
+from aiohttp import web
+
+import cli
+import instrumentation
+import slow_queries
+
+STORES = ("mongo", "cassandra", "dgraph")
+WORKERS = {store: int(os.getenv(f"SERVICE_{store.upper()}_WORKERS", 16)) for store in STORES}
+ANALYTIC_CONCURRENCY = int(os.getenv("SERVICE_ANALYTIC_CONCURRENCY", 4))
+REQUEST_CONCURRENCY = int(os.getenv("SERVICE_REQUEST_CONCURRENCY", 64))
+QUEUE_TIMEOUT = float(os.getenv("SERVICE_QUEUE_TIMEOUT", 30))
+SESSION_TTL = float(os.getenv("SERVICE_SESSION_TTL", 3600))
+STREAM_BATCH = 500
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 1000
+
+# offline commands read a snapshot path from their arguments, they stay CLI only
+ANALYTICS = {command.name: command for command in cli.COMMANDS if command.analytic and command.store in STORES}
+_TRUE = ("1", "true", "yes", "on")
+
+
+class Service:
+    """Models, one executor per store and the per-endpoint semaphores."""
+
+    def __init__(self, stores, workers=WORKERS, metrics=None):
+        self.stores = stores
+        self.metrics = metrics
+        self.executors = {store: ThreadPoolExecutor(max_workers=workers[store], thread_name_prefix=store)
+                          for store in STORES}
+        self._limits = {}
+        self.sessions = Sessions()
+
+    async def call(self, store, function, *args, **kwargs):
+        """Run a blocking model call in the store's executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executors[store], partial(function, *args, **kwargs))
+
+    async def model(self, store):
+        # connecting is blocking as well
+        return await self.call(store, self.stores.get, store)
+
+    @asynccontextmanager
+    async def limit(self, endpoint, concurrency=REQUEST_CONCURRENCY):
+        semaphore = self._limits.get(endpoint)
+        if semaphore is None:
+            semaphore = self._limits[endpoint] = asyncio.Semaphore(concurrency)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise web.HTTPServiceUnavailable(text=f"Too many concurrent requests to {endpoint}.",
+                                             headers={"Retry-After": "1"})
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+        self.stores.close()
+
+
+class Sessions:
+    """Bearer tokens issued at login. Only touched from the event loop, so no lock."""
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._tokens = {}  # token -> (username, expires at)
+
+    def issue(self, username):
+        now = time.monotonic()
+        for token in [token for token, (_, expires_at) in self._tokens.items() if expires_at <= now]:
+            del self._tokens[token]
+        token = secrets.token_urlsafe(32)
+        self._tokens[token] = (username, now + self.ttl)
+        return token
+
+    def username(self, token):
+        entry = self._tokens.get(token)
+        if entry is None or entry[1] <= time.monotonic():
+            self._tokens.pop(token, None)
+            return None
+        return entry[0]
+
+    def revoke(self, token):
+        self._tokens.pop(token, None)
+
+    def revoke_user(self, username):
+        for token in [token for token, (user, _) in self._tokens.items() if user == username]:
+            del self._tokens[token]
+
+
+def _token(request):
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else ""
+
+
+def _caller(request):
+    """Username of the request's token, 401 without a valid one."""
+    username = request.app["service"].sessions.username(_token(request))
+    if username is None:
+        raise web.HTTPUnauthorized(text="Log in and send the token as 'Authorization: Bearer <token>'.",
+                                   headers={"WWW-Authenticate": "Bearer"})
+    return username
+
+
+def _account_owner(request):
+    """The account of the path, when it is the caller's own."""
+    username = _caller(request)
+    if request.match_info["username"] != username:
+        raise web.HTTPForbidden(text="You can only change your own account.")
+    return username
+
+
+def _json(payload, status=200):
+    return web.Response(text=cli.to_json(payload), status=status, content_type="application/json")
+
+
+def _in_scope(metrics, scope, function, *args):
+    """Call `function` with its driver calls recorded under the operation `scope`, if any."""
+    if scope is None:
+        return function(*args)
+    with metrics.resumed(scope):
+        return function(*args)
+
+
+def _next_chunk(rows):
+    """The next STREAM_BATCH rows of the iterator `rows` as JSON Lines bytes, b"" once exhausted."""
+    lines = [cli.to_json(cli.as_dict(row)) for row in islice(rows, STREAM_BATCH)]
+    return ("\n".join(lines) + "\n").encode() if lines else b""
+
+
+async def _stream(request, service, store, rows, scope=None):
+    """
+    Chunked JSON Lines of the iterator `rows`. Batches are pulled and serialized in the
+    store's executor, the event loop only writes them. The driver calls made pulling
+    rows are recorded under the operation `scope`.
+    """
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    while True:
+        chunk = await service.call(store, _in_scope, service.metrics, scope, _next_chunk, rows)
+        if not chunk:
+            break
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+def _limit_param(request):
+    try:
+        limit = int(request.query.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit must be a number.")
+    if not 0 < limit <= MAX_LIMIT:
+        raise web.HTTPBadRequest(text=f"limit must be between 1 and {MAX_LIMIT}.")
+    return limit
+
+
+def _analytic_args(command, query):
+    """The command's CLI options read from the query string."""
+    args = Namespace()
+    for flag, options in command.arguments:
+        name = flag.lstrip("-").replace("-", "_")
+        value = query.get(name)
+        if value is None:
+            if options.get("required"):
+                raise web.HTTPBadRequest(text=f"Missing query parameter {name}.")
+            value = options.get("default", False if options.get("action") == "store_true" else None)
+        elif options.get("action") == "store_true":
+            value = value.lower() in _TRUE
+        elif "type" in options:
+            try:
+                value = options["type"](value)
+            except ValueError:
+                raise web.HTTPBadRequest(text=f"Invalid value for {name}.")
+        setattr(args, name, value)
+    return args
+
+
+async def _body(request, *required):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Expected a JSON body.")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Expected a JSON object.")
+    missing = [field for field in required if not body.get(field)]
+    if missing:
+        raise web.HTTPBadRequest(text=f"Missing {', '.join(missing)}.")
+    return body
+
+
+@web.middleware
+async def errors(request, handler):
+    """Map the model exceptions to HTTP statuses."""
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    except LookupError as e:
+        raise web.HTTPNotFound(text=str(e))
+    except PermissionError as e:
+        raise web.HTTPForbidden(text=str(e))
+    except pymongo.errors.DuplicateKeyError:
+        raise web.HTTPConflict(text="Already exists.")
+
+
+# Analytics
+
+async def list_analytics(request):
+    return _json([{"name": command.name, "store": command.store, "description": command.help,
+                   "parameters": [flag.lstrip("-").replace("-", "_") for flag, _ in command.arguments]}
+                  for command in ANALYTICS.values()])
+
+
+async def run_analytic(request):
+    command = ANALYTICS.get(request.match_info["name"])
+    if command is None:
+        raise web.HTTPNotFound(text="Unknown analytic.")
+    args = _analytic_args(command, request.query)
+    service = request.app["service"]
+    async with service.limit(f"analytics/{command.name}", ANALYTIC_CONCURRENCY):
+        model = await service.model(command.store)
+        name = command.name.replace("-", "_")
+        # the operation lasts until the last row is streamed, lazy analytics query while their rows are pulled
+        with service.metrics.operation(name) if service.metrics is not None else nullcontext() as scope:
+            rows = await service.call(command.store, _in_scope, service.metrics, scope,
+                                      lambda: iter(command.run(model, args)))
+            return await _stream(request, service, command.store, rows, scope)
+
+
+# MongoDB users and posts
+
+async def list_users(request):
+    service = request.app["service"]
+    async with service.limit("users"):
+        model = await service.model("mongo")
+        return _json(await service.call("mongo", model.get_list_of_users, False))
+
+
+async def create_user(request):
+    body = await _body(request, "username", "password")
+    service = request.app["service"]
+    async with service.limit("users"):
+        model = await service.model("mongo")
+        return _json(await service.call("mongo", model.add_user, body["username"], body["password"]), 201)
+
+
+async def update_user(request):
+    username = _account_owner(request)
+    body = await _body(request)
+    service = request.app["service"]
+    async with service.limit("users"):
+        model = await service.model("mongo")
+        await service.call("mongo", model.update_settings, username, body.get("password"),
+                           body.get("notifications"), body.get("language"), body.get("current_password"))
+    return _json({"updated": True})
+
+
+async def delete_user(request):
+    username = _account_owner(request)
+    service = request.app["service"]
+    async with service.limit("users"):
+        model = await service.model("mongo")
+        await service.call("mongo", model.remove_user, username)
+    service.sessions.revoke_user(username)
+    return web.Response(status=204)
+
+
+async def login(request):
+    body = await _body(request, "username", "password")
+    service = request.app["service"]
+    async with service.limit("login"):
+        model = await service.model("mongo")
+        if not await service.call("mongo", model.authenticate, body["username"], body["password"]):
+            raise web.HTTPUnauthorized(text="Incorrect username or password.")
+    return _json({"username": body["username"], "token": service.sessions.issue(body["username"]),
+                  "expires_in": int(service.sessions.ttl)})
+
+
+async def logout(request):
+    _caller(request)
+    request.app["service"].sessions.revoke(_token(request))
+    return web.Response(status=204)
+
+
+async def user_posts(request):
+    limit = _limit_param(request)
+    service = request.app["service"]
+    async with service.limit("posts"):
+        model = await service.model("mongo")
+        return _json(await service.call("mongo", model.posts_by, request.match_info["username"], limit))
+
+
+async def list_posts(request):
+    limit = _limit_param(request)
+    service = request.app["service"]
+    async with service.limit("posts"):
+        model = await service.model("mongo")
+        return _json(await service.call("mongo", model.recent_posts, limit))
+
+
+async def home_timeline(request):
+    limit = _limit_param(request)
+    service = request.app["service"]
+    async with service.limit("posts"):
+        model = await service.model("mongo")
+        return _json(await service.call("mongo", model.home_timeline, request.match_info["username"], limit))
+
+
+async def create_post(request):
+    username = _caller(request)
+    body = await _body(request, "title", "text")
+    service = request.app["service"]
+    async with service.limit("posts"):
+        model = await service.model("mongo")
+        post = await service.call("mongo", model.add_post, username, body["title"], body["text"])
+    post.pop("_id", None)
+    return _json(post, 201)
+
+
+async def delete_post(request):
+    username = _caller(request)
+    service = request.app["service"]
+    async with service.limit("posts"):
+        model = await service.model("mongo")
+        await service.call("mongo", model.remove_post, username, request.match_info["title"])
+    return web.Response(status=204)
+
+
+def create_app(stores=None, metrics=None):
+    app = web.Application(middlewares=[errors])
+    slow_log = slow_queries.SLOW_LOG if slow_queries.enabled() else None
+    service = Service(stores or cli.Stores(metrics, slow_log), metrics=metrics)
+    app["service"] = service
+    app.router.add_get("/analytics", list_analytics)
+    app.router.add_get("/analytics/{name}", run_analytic)
+    app.router.add_get("/users", list_users)
+    app.router.add_post("/users", create_user)
+    app.router.add_patch("/users/{username}", update_user)
+    app.router.add_delete("/users/{username}", delete_user)
+    app.router.add_post("/login", login)
+    app.router.add_post("/logout", logout)
+    app.router.add_get("/users/{username}/posts", user_posts)
+    app.router.add_get("/users/{username}/timeline", home_timeline)
+    app.router.add_get("/posts", list_posts)
+    app.router.add_post("/posts", create_post)
+    app.router.add_delete("/posts/{title}", delete_post)
+
+    async def shutdown(app):
+        await asyncio.get_running_loop().run_in_executor(None, service.close)
+        if metrics is not None:
+            instrumentation.export_metrics(metrics)
+    app.on_cleanup.append(shutdown)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Social media analytics HTTP service.")
+    parser.add_argument("--host", default=os.getenv("SERVICE_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVICE_PORT", 8080)))
+    args = parser.parse_args(argv)
+    metrics = instrumentation.METRICS if instrumentation.enabled() else None
+    web.run_app(create_app(metrics=metrics), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+Mergeable streaming sketches for the approximate analytics.
+
+Every sketch built with the same parameters can be merged with another, so
+partial sketches from parallel token-range scans combine into one answer.
+"""
+import hashlib
+import heapq
+import math
+import random
+import uuid
+
+import numpy as np
+
+Z_95 = 1.96
+
+
+def _digest(value, size):
+    if isinstance(value, uuid.UUID):
+        data = value.bytes
+    elif isinstance(value, bytes):
+        data = value
+    else:
+        data = str(value).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=size).digest()
+
+
+def hash64(value):
+    return int.from_bytes(_digest(value, 8), "little")
+
+
+class CountMinSketch:
+    """
+    Frequency estimates that never undercount. With probability 1 - exp(-depth)
+    an estimate exceeds the true count by at most e / width * total.
+    """
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self._rows = np.arange(depth, dtype=np.uint64)[:, None]
+
+    def _columns(self, items):
+        digests = np.frombuffer(b"".join(_digest(item, 16) for item in items), dtype="<u8").reshape(-1, 2)
+        # Kirsch-Mitzenmacher: `depth` hash functions from two, shape (depth, len(items))
+        return ((digests[:, 0] + self._rows * (digests[:, 1] | np.uint64(1))) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, item, count=1):
+        self.add_many([item], [count])
+
+    def add_many(self, items, counts):
+        if not items:
+            return
+        columns = self._columns(items)
+        counts = np.asarray(counts, dtype=np.int64)
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, item):
+        return self.estimate_many([item])[0]
+
+    def estimate_many(self, items):
+        if not items:
+            return []
+        columns = self._columns(items)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0).tolist()
+
+    @property
+    def error(self):
+        """Additive error bound of the estimates at 1 - exp(-depth) confidence."""
+        return math.e / self.width * self.total
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Count-Min sketches of different shapes cannot be merged.")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+
+class HeavyHitters:
+    """The k most frequent items: a Count-Min sketch plus a min-heap of candidates."""
+
+    def __init__(self, k=10, width=2048, depth=4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+        self._heap = []  # (estimate, item), may hold stale estimates
+
+    def add(self, item, count=1):
+        self.add_many([item], [count])
+
+    def add_many(self, items, counts):
+        self.sketch.add_many(items, counts)
+        for item, estimate in zip(items, self.sketch.estimate_many(items)):
+            if item in self.candidates or len(self.candidates) < self.k:
+                self.candidates[item] = estimate
+                heapq.heappush(self._heap, (estimate, item))
+                continue
+            # drop stale heap entries until the top one reflects its current estimate
+            while self.candidates.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if estimate > self._heap[0][0]:
+                _, evicted = heapq.heapreplace(self._heap, (estimate, item))
+                del self.candidates[evicted]
+                self.candidates[item] = estimate
+
+    def top(self):
+        """[(item, estimated count)], most frequent first."""
+        return sorted(self.candidates.items(), key=lambda entry: entry[1], reverse=True)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        items = list(set(self.candidates) | set(other.candidates))
+        estimates = zip(items, self.sketch.estimate_many(items))
+        self.candidates = dict(heapq.nlargest(self.k, estimates, key=lambda entry: entry[1]))
+        self._heap = [(estimate, item) for item, estimate in self.candidates.items()]
+        heapq.heapify(self._heap)
+        return self
+
+
+class HyperLogLog:
+    """
+    Distinct count estimate with a relative standard error of 1.04 / sqrt(2 ** precision).
+
+    Until it has seen 2 ** precision / 32 distinct values it keeps their hashes
+    and counts exactly, so the many small sets (engagers of one post) stay cheap.
+    """
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = None
+        self.hashes = set()
+        # rank of the first set bit is taken over at most 52 bits so float64 log2 stays exact
+        self._bits = min(52, 64 - precision)
+
+    @property
+    def sparse(self):
+        return self.registers is None
+
+    def add(self, value):
+        value_hash = hash64(value)
+        if self.sparse:
+            self.hashes.add(value_hash)
+            if len(self.hashes) > (1 << self.precision) // 32:
+                self._densify()
+            return
+        p, bits = self.precision, self._bits
+        rest = (value_hash & ((1 << (64 - p)) - 1)) >> (64 - p - bits)
+        rank = bits - rest.bit_length() + 1
+        index = value_hash >> (64 - p)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add_many(self, values):
+        self.add_hashes(np.fromiter((hash64(value) for value in values), dtype=np.uint64))
+
+    def add_hashes(self, hashes):
+        """Add values already hashed with `hash64`, given as a uint64 array."""
+        if self.sparse:
+            self.hashes.update(hashes.tolist())
+            if len(self.hashes) > (1 << self.precision) // 32:
+                self._densify()
+        else:
+            self._update_registers(hashes)
+
+    def _update_registers(self, hashes):
+        p, bits = self.precision, self._bits
+        index = (hashes >> np.uint64(64 - p)).astype(np.int64)
+        rest = (hashes & np.uint64((1 << (64 - p)) - 1)) >> np.uint64(64 - p - bits)
+        rank = np.full(len(rest), bits + 1, dtype=np.uint8)
+        non_zero = rest > 0
+        rank[non_zero] = bits - np.floor(np.log2(rest[non_zero].astype(np.float64))).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def _densify(self):
+        self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        self._update_registers(np.fromiter(self.hashes, dtype=np.uint64, count=len(self.hashes)))
+        self.hashes = set()
+
+    def estimate(self):
+        if self.sparse:
+            return float(len(self.hashes))
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)  # linear counting for small cardinalities
+        return float(raw)
+
+    @property
+    def relative_error(self):
+        return 0.0 if self.sparse else 1.04 / math.sqrt(1 << self.precision)
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise ValueError("HyperLogLogs of different precision cannot be merged.")
+        if self.sparse and other.sparse:
+            self.hashes |= other.hashes
+            if len(self.hashes) > (1 << self.precision) // 32:
+                self._densify()
+            return self
+        if self.sparse:
+            self._densify()
+        if other.sparse:
+            self._update_registers(np.fromiter(other.hashes, dtype=np.uint64, count=len(other.hashes)))
+        else:
+            np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+
+class ReservoirSample:
+    """Uniform sample of at most `size` items from a stream of unknown length (algorithm R)."""
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.items = []
+        self.seen = 0
+        self._random = random.Random(seed)
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            slot = self._random.randrange(self.seen)
+            if slot < self.size:
+                self.items[slot] = item
+
+    def merge(self, other):
+        """Uniform sample of both streams: draw from each in proportion to what it has seen."""
+        left, right = list(self.items), list(other.items)
+        self._random.shuffle(left)
+        self._random.shuffle(right)
+        left_seen, right_seen = self.seen, other.seen
+        merged = []
+        while len(merged) < self.size and (left or right):
+            if right and (not left or self._random.random() * (left_seen + right_seen) >= left_seen):
+                merged.append(right.pop())
+                right_seen -= 1
+            else:
+                merged.append(left.pop())
+                left_seen -= 1
+        self.items = merged
+        self.seen += other.seen
+        return self
+
+
+def proportion_interval(successes, n, population=None, z=Z_95):
+    """Wilson score interval of a sampled proportion, narrowed by the finite population correction."""
+    if n == 0:
+        return 0.0, 0.0, 1.0
+    share = successes / n
+    correction = math.sqrt((population - n) / (population - 1)) if population and population > n else 1.0
+    denominator = 1 + z * z / n
+    centre = (share + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(share * (1 - share) / n + z * z / (4 * n * n)) / denominator * correction
+    return share, max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def cluster_total(sampled_totals, total_clusters, z=Z_95):
+    """
+    Total over all clusters estimated from a simple random sample of them
+    (here token ranges), returned as (estimate, low, high).
+    """
+    sampled = len(sampled_totals)
+    if sampled == 0:
+        return 0.0, 0.0, 0.0
+    values = np.asarray(sampled_totals, dtype=np.float64)
+    estimate = float(values.mean() * total_clusters)
+    if sampled == total_clusters or sampled == 1:
+        return estimate, estimate, estimate
+    standard_error = total_clusters * float(values.std(ddof=1)) / math.sqrt(sampled) * math.sqrt(1 - sampled / total_clusters)
+    return estimate, max(0.0, estimate - z * standard_error), estimate + z * standard_error
@@ -0,0 +1,450 @@
+"""
+Slow-query log.
+
+Statements running longer than SLOW_QUERY_MS are written as JSON Lines to
+SLOW_QUERY_FILE, each with what the store can tell about how it ran:
+
+- Mongo: the explain() of the same command, its winning plan stages, and flags
+  for COLLSCAN and in-memory SORT stages.
+- Cassandra: the query trace (coordinator, replicas, partitions and ranges
+  read, event timeline). Only statements executed with trace=True have one,
+  SLOW_QUERY_TRACE_SAMPLE sets the share of statements traced.
+- Dgraph: the server latency breakdown of the response and the uids touched.
+
+Time is measured in the driver calls, paging and getMore included, not in the
+code consuming the rows.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import instrumentation
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 100))
+SLOW_QUERY_FILE = os.getenv("SLOW_QUERY_FILE", "slow_queries.jsonl")
+TRACE_SAMPLE = float(os.getenv("SLOW_QUERY_TRACE_SAMPLE", 0.1))
+MAX_ENTRIES = 1000      # entries kept in memory
+MAX_STATEMENTS = 1000   # distinct statements summarized
+STATEMENT_CHARS = 300
+TIMELINE_EVENTS = 50
+
+_SINGLE_PARTITION = re.compile(r"single-partition query", re.I)
+_RANGE_REQUESTS = re.compile(r"range requests on (\d+) ranges", re.I)
+_LIVE_ROWS = re.compile(r"read (\d+) live rows?", re.I)
+
+
+def enabled():
+    return os.getenv("SLOW_QUERY_ENABLED", "").lower() in ("1", "true", "yes", "on")
+
+
+def _text(statement):
+    return " ".join(str(statement).split())[:STATEMENT_CHARS]
+
+
+class SlowQueryLog:
+    """
+    Collects the statements slower than `threshold_ms`.
+
+    `capture_once` captures the plan of a statement the first time only, later
+    runs just add to its counts (used by the audit, which logs everything).
+    """
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, path=SLOW_QUERY_FILE, trace_sample=TRACE_SAMPLE,
+                 explain_verbosity="queryPlanner", capture_once=False):
+        self.threshold_ms = threshold_ms
+        self.path = path
+        self.trace_sample = trace_sample
+        self.explain_verbosity = explain_verbosity
+        self.capture_once = capture_once
+        self.entries = deque(maxlen=MAX_ENTRIES)
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def observe(self, store, call, statement, elapsed_ns, capture):
+        """Log the statement when it is slow, `capture()` returns its (plan, flags)."""
+        elapsed_ms = elapsed_ns / 1e6
+        if elapsed_ms < self.threshold_ms:
+            return
+        operation = instrumentation.current_operation() or "-"
+        text = _text(statement)
+        key = (store, operation, text)
+        with self._lock:
+            stats = self.statements.get(key)
+            first = stats is None
+            if first and len(self.statements) < MAX_STATEMENTS:
+                stats = self.statements[key] = {"store": store, "operation": operation, "call": call,
+                                                "statement": text, "calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                "flags": [], "plan": None}
+            if stats is not None:
+                stats["calls"] += 1
+                stats["total_ms"] += elapsed_ms
+                stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        if self.capture_once and not first:
+            return
+        try:
+            plan, flags = capture()
+        except Exception as e:
+            plan, flags = {"error": f"{type(e).__name__}: {e}"}, []
+        entry = {"time": datetime.now(timezone.utc).isoformat(), "store": store, "operation": operation,
+                 "call": call, "elapsed_ms": round(elapsed_ms, 3), "statement": text, "flags": flags, "plan": plan}
+        with self._lock:
+            if stats is not None:
+                stats["flags"], stats["plan"] = flags, plan
+            self.entries.append(entry)
+            if self.path:
+                with open(self.path, "a") as output:
+                    output.write(json.dumps(entry, default=str) + "\n")
+
+    def should_trace(self, statement):
+        """Whether to trace the next run of a Cassandra statement."""
+        if self.capture_once:
+            key = ("cassandra", instrumentation.current_operation() or "-", _text(statement))
+            if key in self.statements:
+                return False
+        return self.trace_sample >= 1 or random.random() < self.trace_sample
+
+    def summary(self):
+        """One row per statement, slowest first within each store."""
+        with self._lock:
+            rows = [dict(stats, total_ms=round(stats["total_ms"], 3), max_ms=round(stats["max_ms"], 3))
+                    for stats in self.statements.values()]
+        return sorted(rows, key=lambda row: (row["store"], -row["max_ms"]))
+
+
+# Mongo
+
+def explain_summary(explain):
+    """(plan, flags) of an explain() result: winning plan stages, index and document counts."""
+    stages, plans = [], []
+
+    def walk(node, in_plan):
+        if isinstance(node, dict):
+            if in_plan and "stage" in node:
+                stages.append(node["stage"])
+            if in_plan and node.get("indexName"):
+                indexes.add(node["indexName"])
+            for key, value in node.items():
+                if key == "winningPlan":
+                    plans.append(value)
+                walk(value, in_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, in_plan)
+
+    indexes = set()
+    walk(explain, False)
+    # pipeline stages the query layer could not absorb, a $sort there runs in memory
+    stages += [name for stage in explain.get("stages", ()) for name in stage if name == "$sort"]
+    flags = []
+    if "COLLSCAN" in stages:
+        flags.append("COLLSCAN")
+    if "SORT" in stages or "$sort" in stages:
+        # a SORT stage in the plan, or a $sort left in the pipeline, sorts in memory instead of using an index
+        flags.append("in-memory SORT")
+    plan = {"stages": stages, "indexes": sorted(indexes), "winning_plan": plans[0] if plans else None}
+    stats = explain.get("executionStats")
+    if stats:
+        plan.update(returned=stats.get("nReturned"), keys_examined=stats.get("totalKeysExamined"),
+                    docs_examined=stats.get("totalDocsExamined"), server_ms=stats.get("executionTimeMillis"))
+    return plan, flags
+
+
+def _sort_document(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return {key_or_list: direction if direction is not None else 1}
+    return dict(key_or_list)
+
+
+def _command(name, method, args, kwargs):
+    """The database command a collection method runs, for explain; None for inserts and index operations."""
+    def argument(position, keyword, default=None):
+        return args[position] if len(args) > position else kwargs.get(keyword, default)
+
+    if method in ("find", "find_one"):
+        command = {"find": name, "filter": argument(0, "filter") or {}}
+        projection = argument(1, "projection")
+        if projection:
+            command["projection"] = projection if isinstance(projection, dict) else dict.fromkeys(projection, 1)
+        if method == "find_one":
+            command["limit"] = 1
+        return command
+    if method == "count_documents":
+        return {"aggregate": name, "pipeline": [{"$match": argument(0, "filter") or {}},
+                                                {"$group": {"_id": 1, "n": {"$sum": 1}}}], "cursor": {}}
+    if method == "aggregate":
+        return {"aggregate": name, "pipeline": list(argument(0, "pipeline") or []), "cursor": {}}
+    if method == "distinct":
+        return {"distinct": name, "key": argument(0, "key"), "query": argument(1, "filter") or {}}
+    if method in ("update_one", "update_many"):
+        return {"update": name, "updates": [{"q": argument(0, "filter") or {}, "u": argument(1, "update"),
+                                             "multi": method == "update_many"}]}
+    if method in ("delete_one", "delete_many"):
+        return {"delete": name, "deletes": [{"q": argument(0, "filter") or {}, "limit": int(method == "delete_one")}]}
+    return None
+
+
+class _SlowCursor:
+    """Cursor proxy adding the time spent fetching batches, logged once iteration ends."""
+
+    def __init__(self, cursor, collection, call, command, elapsed_ns):
+        self._cursor = cursor
+        self._collection = collection
+        self._call = call
+        self._command = command
+        self._elapsed_ns = elapsed_ns
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if name not in ("sort", "limit", "skip", "hint", "batch_size", "max_time_ms"):
+            return attribute
+
+        def chained(*args, **kwargs):
+            command = dict(self._command)
+            if name == "sort":
+                command["sort"] = dict(command.get("sort", {}), **_sort_document(*args, **kwargs))
+            elif name in ("limit", "skip", "hint"):
+                command[name] = args[0] if args else next(iter(kwargs.values()))
+            return _SlowCursor(attribute(*args, **kwargs), self._collection, self._call, command, self._elapsed_ns)
+        return chained
+
+    def __iter__(self):
+        elapsed = self._elapsed_ns
+        cursor = iter(self._cursor)
+        try:
+            while True:
+                start = time.perf_counter_ns()
+                try:
+                    document = next(cursor)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter_ns() - start
+                yield document
+        finally:
+            self._collection._observe(self._call, self._command, elapsed)
+
+    def __next__(self):
+        # documents read one by one are logged once the cursor is exhausted
+        start = time.perf_counter_ns()
+        try:
+            document = next(self._cursor)
+        except StopIteration:
+            self._collection._observe(self._call, self._command, self._elapsed_ns + time.perf_counter_ns() - start)
+            raise
+        self._elapsed_ns += time.perf_counter_ns() - start
+        return document
+
+
+class SlowQueryCollection:
+    """Mongo collection proxy logging slow calls with the explain() of their command."""
+
+    def __init__(self, collection, log):
+        self._collection = collection
+        self._log = log
+        self._name = collection.name
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute) or name.startswith("_") or name in ("database", "with_options"):
+            return attribute
+        call = f"{self._name}.{name}"
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter_ns()
+            result = attribute(*args, **kwargs)
+            elapsed = time.perf_counter_ns() - start
+            command = _command(self._name, name, args, kwargs)
+            if name in ("find", "aggregate"):
+                return _SlowCursor(result, self, call, command, elapsed)
+            self._observe(call, command, elapsed)
+            return result
+        return timed
+
+    def _observe(self, call, command, elapsed_ns):
+        def capture():
+            if command is None:
+                return None, []
+            explain = self._collection.database.command("explain", command, verbosity=self._log.explain_verbosity)
+            return explain_summary(explain)
+        statement = f"{call} {json.dumps(command, default=str)}" if command is not None else call
+        self._log.observe("mongo", call, statement, elapsed_ns, capture)
+
+
+# Cassandra
+
+def trace_summary(traces):
+    """(plan, flags) of the query traces of a statement, one trace per page."""
+    traces = [trace for trace in traces if trace is not None]
+    if not traces:
+        return None, []
+    events = [event for trace in traces for event in trace.events]
+    descriptions = [event.description for event in events]
+    ranges = sum(int(match.group(1)) for match in map(_RANGE_REQUESTS.search, descriptions) if match)
+    plan = {
+        "coordinator": str(traces[0].coordinator),
+        "request_type": traces[0].request_type,
+        "pages": len(traces),
+        "duration_us": sum(trace.duration.total_seconds() * 1e6 for trace in traces if trace.duration),
+        "replicas": sorted({str(event.source) for event in events}),
+        "partitions": sum(1 for description in descriptions if _SINGLE_PARTITION.search(description)),
+        "ranges": ranges,
+        "live_rows": sum(int(match.group(1)) for match in map(_LIVE_ROWS.search, descriptions) if match),
+        "timeline": [{"source": str(event.source), "elapsed_us": event.source_elapsed.total_seconds() * 1e6
+                      if event.source_elapsed else None, "thread": event.thread_name, "activity": event.description}
+                     for event in events[:TIMELINE_EVENTS]],
+    }
+    return plan, ["range scan"] if ranges else []
+
+
+def statement_flags(query):
+    """Access-path warnings visible in the CQL text."""
+    text = query.upper()
+    flags = []
+    if "ALLOW FILTERING" in text:
+        flags.append("ALLOW FILTERING")
+    if "GROUP BY" in text:
+        flags.append("GROUP BY")
+    if " WHERE " not in f" {' '.join(text.split())} ":
+        flags.append("full table scan")
+    return flags
+
+
+def _query_string(query):
+    prepared = getattr(query, "prepared_statement", None)
+    return getattr(prepared or query, "query_string", query)
+
+
+class _SlowRows:
+    """Result proxy adding the time spent fetching later pages, logged once iteration ends."""
+
+    def __init__(self, result, session, query, elapsed_ns):
+        self._result = result
+        self._session = session
+        self._query = query
+        self._elapsed_ns = elapsed_ns
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def __iter__(self):
+        elapsed = self._elapsed_ns
+        rows = iter(self._result)
+        try:
+            while True:
+                start = time.perf_counter_ns()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter_ns() - start
+                yield row
+        finally:
+            self._session._observe(self._query, self._result, elapsed)
+
+    def one(self):
+        start = time.perf_counter_ns()
+        row = self._result.one()
+        self._session._observe(self._query, self._result, self._elapsed_ns + time.perf_counter_ns() - start)
+        return row
+
+    def all(self):
+        return list(self)
+
+
+class SlowQuerySession:
+    """Cassandra session proxy tracing a sample of the statements and logging the slow ones."""
+
+    def __init__(self, session, log):
+        self._session = session
+        self._log = log
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def execute(self, query, parameters=None, **kwargs):
+        if self._log.should_trace(_query_string(query)):
+            kwargs.setdefault("trace", True)
+        start = time.perf_counter_ns()
+        result = self._session.execute(query, parameters, **kwargs)
+        return _SlowRows(result, self, query, time.perf_counter_ns() - start)
+
+    def _observe(self, query, result, elapsed_ns):
+        text = _query_string(query)
+
+        def capture():
+            # an untraced statement has no traces, the stand-in sessions no trace support at all
+            get_traces = getattr(result, "get_all_query_traces", None)
+            plan, flags = trace_summary(get_traces()) if get_traces is not None else (None, [])
+            return plan, statement_flags(text) + flags
+        self._log.observe("cassandra", "execute", text, elapsed_ns, capture)
+
+
+# Dgraph
+
+def latency_summary(res, elapsed_ns):
+    """(plan, flags) of a Dgraph response: server latency breakdown and uids touched per predicate."""
+    latency = getattr(res, "latency", None)
+    if latency is None:
+        return None, []
+    plan = {name: getattr(latency, f"{name}_ns") / 1e6 for name in ("parsing", "processing", "encoding", "total")}
+    plan = {f"{name}_ms": value for name, value in plan.items()}
+    plan["network_ms"] = max(0.0, elapsed_ns / 1e6 - plan["total_ms"])
+    metrics = getattr(res, "metrics", None)
+    if metrics is not None:
+        plan["num_uids"] = dict(metrics.num_uids)
+    return plan, []
+
+
+class _SlowTxn:
+    def __init__(self, txn, log):
+        self._txn = txn
+        self._log = log
+
+    def __getattr__(self, name):
+        return getattr(self._txn, name)
+
+    def query(self, query, *args, **kwargs):
+        start = time.perf_counter_ns()
+        res = self._txn.query(query, *args, **kwargs)
+        elapsed = time.perf_counter_ns() - start
+        self._log.observe("dgraph", "query", query, elapsed, lambda: latency_summary(res, elapsed))
+        return res
+
+
+class SlowQueryDgraphClient:
+    """Dgraph client proxy whose transactions log slow queries with the server latency."""
+
+    def __init__(self, client, log):
+        self._client = client
+        self._log = log
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def txn(self, *args, **kwargs):
+        return _SlowTxn(self._client.txn(*args, **kwargs), self._log)
+
+
+SLOW_LOG = SlowQueryLog()
+
+
+def attach(mongo_model=None, cassandra_model=None, dgraph_model=None, log=SLOW_LOG):
+    """
+    Swap the models' driver handles for slow-query proxies. Attach before
+    instrumentation.instrument(), the proxies need the driver objects themselves.
+    """
+    if mongo_model is not None:
+        mongo_model.users_collection = SlowQueryCollection(mongo_model.users_collection, log)
+        mongo_model.posts_collection = SlowQueryCollection(mongo_model.posts_collection, log)
+        mongo_model.post_daily_stats = SlowQueryCollection(mongo_model.post_daily_stats, log)
+    if cassandra_model is not None and cassandra_model.session is not None:
+        cassandra_model.session = SlowQuerySession(cassandra_model.session, log)
+    if dgraph_model is not None and dgraph_model.client is not None:
+        dgraph_model.attach_client(SlowQueryDgraphClient(dgraph_model.client, log))
+    return log
@@ -0,0 +1,272 @@
+"""
+Columnar snapshots of the Cassandra tables.
+
+A snapshot is a directory with one raw little-endian NumPy file per column
+and a manifest.json describing them. The files can be memory-mapped, so a
+report only pages in the columns it reads.
+
+Column kinds:
+- id: UUIDs, stored as int32 codes into the 16-byte `ids` pool.
+- text: strings, stored as int32 codes into the UTF-8 `text` pool (offsets + data).
+- text_set: sets of strings, stored as int64 row offsets plus int32 codes.
+- int: int32 values, nulls stored as 0.
+- time: datetime64[ms] values, nulls stored as NaT.
+
+Missing ids and strings are stored as the code -1. The manifest is written
+last, so a directory without one holds an incomplete export.
+"""
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+from cassandra.query import SimpleStatement
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+FETCH_SIZE = 5000
+CHUNK_ROWS = 50000
+NULL_CODE = -1
+
+SCHEMA = {
+    "posts": (("post_id", "id"), ("user_id", "id"), ("content", "text"), ("timestamp", "time"),
+              ("like_count", "int"), ("comment_count", "int"), ("share_count", "int"), ("tags", "text_set")),
+    "users": (("user_id", "id"), ("username", "text"), ("joined_date", "time"), ("followers_count", "int"),
+              ("following_count", "int")),
+    "likes": (("post_id", "id"), ("user_id", "id"), ("timestamp", "time")),
+    "post_comments": (("post_id", "id"), ("comment_id", "id"), ("user_id", "id"), ("timestamp", "time")),
+    "user_activity": (("user_id", "id"), ("activity_id", "id"), ("type", "text"), ("target_id", "id"),
+                      ("timestamp", "time")),
+}
+_DTYPES = {"id": "<i4", "text": "<i4", "int": "<i4", "time": "<M8[ms]"}
+
+
+# Export
+
+class _PoolBuilder:
+    """Dictionary encoder, the code of a value is its position in the pool."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        if value is None:
+            return NULL_CODE
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _TableWriter:
+    def __init__(self, directory, table, columns, pools):
+        self.directory = directory
+        self.table = table
+        self.columns = columns
+        self.pools = pools
+        self.rows = 0
+        self.set_offset = {name: 0 for name, kind in columns if kind == "text_set"}
+        self.files = {}
+        for name, kind in columns:
+            if kind == "text_set":
+                self.files[name] = (self._open(f"{name}.offsets"), self._open(f"{name}.codes"))
+                np.zeros(1, dtype="<i8").tofile(self.files[name][0])
+            else:
+                self.files[name] = self._open(name)
+        self.buffer = []
+
+    def _open(self, suffix):
+        return open(os.path.join(self.directory, f"{self.table}.{suffix}.bin"), "wb")
+
+    def append(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) == CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        for position, (name, kind) in enumerate(self.columns):
+            values = [row[position] for row in self.buffer]
+            if kind == "id":
+                encode = self.pools["ids"].encode
+                array = np.fromiter((encode(value) for value in values), dtype="<i4", count=len(values))
+            elif kind == "text":
+                encode = self.pools["text"].encode
+                array = np.fromiter((encode(value) for value in values), dtype="<i4", count=len(values))
+            elif kind == "int":
+                array = np.fromiter((value or 0 for value in values), dtype="<i4", count=len(values))
+            elif kind == "time":
+                array = np.array(values, dtype="<M8[ms]")
+            else:
+                offsets_file, codes_file = self.files[name]
+                encode = self.pools["text"].encode
+                codes = [encode(tag) for value in values for tag in sorted(value or ())]
+                lengths = np.fromiter((len(value or ()) for value in values), dtype="<i8", count=len(values))
+                offsets = self.set_offset[name] + np.cumsum(lengths)
+                self.set_offset[name] = int(offsets[-1])
+                offsets.astype("<i8").tofile(offsets_file)
+                np.array(codes, dtype="<i4").tofile(codes_file)
+                continue
+            array.tofile(self.files[name])
+        self.rows += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        manifest = {"rows": self.rows, "columns": {}}
+        for name, kind in self.columns:
+            handles = self.files[name]
+            for handle in handles if isinstance(handles, tuple) else (handles,):
+                handle.close()
+            if kind == "text_set":
+                manifest["columns"][name] = {"kind": kind, "offsets": f"{self.table}.{name}.offsets.bin",
+                                             "codes": f"{self.table}.{name}.codes.bin",
+                                             "values": self.set_offset[name]}
+            else:
+                manifest["columns"][name] = {"kind": kind, "dtype": _DTYPES[kind],
+                                             "file": f"{self.table}.{name}.bin"}
+        return manifest
+
+
+def _write_pools(directory, pools):
+    ids = pools["ids"].values
+    np.frombuffer(b"".join(value.bytes for value in ids), dtype=np.uint8).tofile(
+        os.path.join(directory, "pool.ids.bin"))
+    encoded = [value.encode("utf-8") for value in pools["text"].values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    np.cumsum(np.fromiter((len(value) for value in encoded), dtype="<i8", count=len(encoded)), out=offsets[1:])
+    offsets.tofile(os.path.join(directory, "pool.text.offsets.bin"))
+    with open(os.path.join(directory, "pool.text.data.bin"), "wb") as data:
+        data.write(b"".join(encoded))
+    return {"ids": {"count": len(ids), "file": "pool.ids.bin", "width": 16},
+            "text": {"count": len(encoded), "offsets": "pool.text.offsets.bin", "data": "pool.text.data.bin"}}
+
+
+def export_snapshot(session, directory, tables=None, fetch_size=FETCH_SIZE):
+    """Stream the tables into a snapshot directory. Returns the row count per table."""
+    tables = tables or list(SCHEMA)
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    pools = {"ids": _PoolBuilder(), "text": _PoolBuilder()}
+    manifest = {"format": FORMAT_VERSION, "created_at": datetime.now(timezone.utc).isoformat(), "tables": {}}
+    for table in tables:
+        columns = SCHEMA[table]
+        writer = _TableWriter(directory, table, columns, pools)
+        query = SimpleStatement(f"SELECT {', '.join(name for name, _ in columns)} FROM {table}", fetch_size=fetch_size)
+        for row in session.execute(query):
+            writer.append(tuple(row))
+        manifest["tables"][table] = writer.close()
+        print(f"Exported {writer.rows} rows from {table}.")
+    manifest["pools"] = _write_pools(directory, pools)
+    temporary = manifest_path + ".tmp"
+    with open(temporary, "w") as output:
+        json.dump(manifest, output, indent=2)
+    os.replace(temporary, manifest_path)
+    return {table: entry["rows"] for table, entry in manifest["tables"].items()}
+
+
+# Reading
+
+def _map(path, dtype, count):
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+class IdPool:
+    def __init__(self, path, count):
+        self.count = count
+        self.data = _map(path, "V16", count)
+        self._index = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, code):
+        return None if code < 0 else uuid.UUID(bytes=self.data[code].tobytes())
+
+    def decode(self, codes):
+        """UUIDs of many codes with one gather."""
+        codes = np.asarray(codes)
+        raw = np.asarray(self.data)[np.maximum(codes, 0)].tobytes()
+        return [uuid.UUID(bytes=raw[start:start + 16]) if code >= 0 else None
+                for start, code in zip(range(0, len(raw), 16), codes.tolist())]
+
+    def code(self, value):
+        """Code of a UUID, -1 when it is not in the snapshot."""
+        if self._index is None:
+            self._index = {bytes(item): code for code, item in enumerate(self.data)}
+        return self._index.get(value.bytes, NULL_CODE)
+
+
+class TextPool:
+    def __init__(self, offsets_path, data_path, count):
+        self.count = count
+        self.offsets = _map(offsets_path, "<i8", count + 1) if count else np.zeros(1, dtype="<i8")
+        self.data = _map(data_path, np.uint8, int(self.offsets[-1]))
+        self._index = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, code):
+        if code < 0:
+            return None
+        return self.data[self.offsets[code]:self.offsets[code + 1]].tobytes().decode("utf-8")
+
+    def decode(self, codes):
+        return [self[code] for code in np.asarray(codes).tolist()]
+
+    def code(self, value):
+        """Code of a string, -1 when it is not in the snapshot."""
+        if self._index is None:
+            self._index = {self[code]: code for code in range(self.count)}
+        return self._index.get(value, NULL_CODE)
+
+
+class Snapshot:
+    """Read-only view of an exported snapshot, columns are memory-mapped on first use."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        path = os.path.join(directory, MANIFEST)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No complete snapshot in {directory}, run export-snapshot first.")
+        with open(path) as manifest:
+            self.manifest = json.load(manifest)
+        if self.manifest["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format {self.manifest['format']}.")
+        pools = self.manifest["pools"]
+        self.ids = IdPool(self._path(pools["ids"]["file"]), pools["ids"]["count"])
+        self.text = TextPool(self._path(pools["text"]["offsets"]), self._path(pools["text"]["data"]),
+                             pools["text"]["count"])
+        self._columns = {}
+
+    @property
+    def created_at(self):
+        return self.manifest["created_at"]
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def rows(self, table):
+        return self.manifest["tables"][table]["rows"]
+
+    def column(self, table, name):
+        """The column's array, or (offsets, codes) for a text_set column."""
+        key = (table, name)
+        if key not in self._columns:
+            entry = self.manifest["tables"][table]["columns"][name]
+            rows = self.rows(table)
+            if entry["kind"] == "text_set":
+                offsets = _map(self._path(entry["offsets"]), "<i8", rows + 1)
+                self._columns[key] = (offsets, _map(self._path(entry["codes"]), "<i4", entry["values"]))
+            else:
+                self._columns[key] = _map(self._path(entry["file"]), entry["dtype"], rows)
+        return self._columns[key]
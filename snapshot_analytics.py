@@ -0,0 +1,145 @@
+"""
+The Cassandra analytics as NumPy kernels over a columnar snapshot.
+
+Each function takes a `snapshot.Snapshot` and returns the rows of the
+matching CassandraModel method, possibly in another order, except for:
+
+- user_interaction_patterns, which counts the activities per type and UTC
+  hour instead of returning every activity row.
+- trend_analysis_of_topics, which counts the tags of the posts and returns
+  the ten most used, where the method returns ten rows of tag_popularity, a
+  table only populate writes.
+- content_type_performance and most_engaging_post_types, which read posts
+  instead of user_posts and posts_by_tag, so they agree with the method only
+  while those tables are in step with posts.
+
+Ids are only decoded for the rows returned.
+"""
+import numpy as np
+
+NAT = np.iinfo(np.int64).min  # datetime64 NaT as int64
+
+
+def _ms(column):
+    return np.asarray(column).view("<i8")
+
+
+def _set_rows(offsets):
+    """Row index of every value of a text_set column."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def follower_number_analysis(snapshot):
+    user_ids = snapshot.column("users", "user_id")
+    followers = snapshot.column("users", "followers_count")
+    following = snapshot.column("users", "following_count")
+    return [{"user_id": user_id, "followers_count": followers_count, "following_count": following_count}
+            for user_id, followers_count, following_count in zip(snapshot.ids.decode(user_ids), followers.tolist(),
+                                                                 following.tolist())]
+
+
+def user_interaction_patterns(snapshot):
+    """Activity count per type and hour of day (UTC)."""
+    types = np.asarray(snapshot.column("user_activity", "type"))
+    timestamps = _ms(snapshot.column("user_activity", "timestamp"))
+    valid = (timestamps != NAT) & (types >= 0)
+    hours = (timestamps[valid] // 3_600_000) % 24
+    type_codes, type_index = np.unique(types[valid], return_inverse=True)
+    counts = np.bincount(type_index * 24 + hours, minlength=len(type_codes) * 24).reshape(len(type_codes), 24)
+    return [{"type": snapshot.text[int(code)], "hour": hour, "activity_count": int(counts[row, hour])}
+            for row, code in enumerate(type_codes) for hour in range(24) if counts[row, hour]]
+
+
+def trend_analysis_of_topics(snapshot, k=10):
+    offsets, codes = snapshot.column("posts", "tags")
+    counts = np.bincount(codes, minlength=len(snapshot.text)) if len(codes) else np.zeros(0, dtype=np.int64)
+    top = _top_k(counts, k)
+    return [{"tag": snapshot.text[int(code)], "post_count": int(counts[code])} for code in top if counts[code]]
+
+
+def content_type_performance(snapshot):
+    """Posts per user."""
+    users = np.asarray(snapshot.column("posts", "user_id"))
+    counts = np.bincount(users[users >= 0], minlength=len(snapshot.ids))
+    codes = np.flatnonzero(counts)
+    return [{"user_id": user_id, "post_count": count}
+            for user_id, count in zip(snapshot.ids.decode(codes), counts[codes].tolist())]
+
+
+def most_engaging_post_types(snapshot, tag):
+    tag_code = snapshot.text.code(tag)
+    offsets, codes = snapshot.column("posts", "tags")
+    rows = _set_rows(np.asarray(offsets))[np.asarray(codes) == tag_code]
+    engagement = (np.asarray(snapshot.column("posts", "like_count"), dtype=np.int64)[rows]
+                  + np.asarray(snapshot.column("posts", "share_count"), dtype=np.int64)[rows]
+                  + np.asarray(snapshot.column("posts", "comment_count"), dtype=np.int64)[rows])
+    post_ids = np.asarray(snapshot.column("posts", "post_id"))[rows]
+    return [{"post_id": post_id, "total_engagement": total}
+            for post_id, total in zip(snapshot.ids.decode(post_ids), engagement.tolist())]
+
+
+def follower_to_engagement_ratio(snapshot):
+    n_ids = len(snapshot.ids)
+    authors = np.asarray(snapshot.column("posts", "user_id"))
+    valid = authors >= 0
+    engagement = (np.asarray(snapshot.column("posts", "like_count"), dtype=np.int64)
+                  + np.asarray(snapshot.column("posts", "comment_count"), dtype=np.int64))
+    totals = np.bincount(authors[valid], weights=engagement[valid], minlength=n_ids)
+    has_posts = np.bincount(authors[valid], minlength=n_ids) > 0
+    followers = np.zeros(n_ids, dtype=np.int64)
+    user_ids = np.asarray(snapshot.column("users", "user_id"))
+    followers[user_ids[user_ids >= 0]] = np.asarray(snapshot.column("users", "followers_count"))[user_ids >= 0]
+    ratios = np.divide(totals, followers, out=np.zeros(n_ids), where=followers > 0)
+    codes = np.flatnonzero(has_posts)
+    return [{"user_id": user_id, "total_engagement": int(total), "followers_count": count, "ratio": ratio}
+            for user_id, total, count, ratio in zip(snapshot.ids.decode(codes), totals[codes].tolist(),
+                                                    followers[codes].tolist(), ratios[codes].tolist())]
+
+
+def average_response_time_to_comments(snapshot):
+    n_ids = len(snapshot.ids)
+    post_time = np.full(n_ids, NAT, dtype=np.int64)
+    posts = np.asarray(snapshot.column("posts", "post_id"))
+    post_time[posts[posts >= 0]] = _ms(snapshot.column("posts", "timestamp"))[posts >= 0]
+    commented = np.asarray(snapshot.column("post_comments", "post_id"))
+    comment_time = _ms(snapshot.column("post_comments", "timestamp"))
+    known = commented >= 0
+    commented, comment_time = commented[known], comment_time[known]
+    published = post_time[commented]
+    delay = comment_time - published
+    # only comments made after the post count, as in the Cassandra analytic
+    valid = (published != NAT) & (comment_time != NAT) & (delay > 0)
+    counts = np.bincount(commented[valid], minlength=n_ids)
+    totals = np.bincount(commented[valid], weights=delay[valid], minlength=n_ids)
+    codes = np.flatnonzero(counts)
+    averages = totals[codes] / counts[codes] / 1000
+    return [{"post_id": post_id, "comment_count": count, "avg_response_seconds": average}
+            for post_id, count, average in zip(snapshot.ids.decode(codes), counts[codes].tolist(), averages.tolist())]
+
+
+def time_to_first_engagement(snapshot):
+    posts = np.asarray(snapshot.column("likes", "post_id"))
+    times = _ms(snapshot.column("likes", "timestamp"))
+    valid = (posts >= 0) & (times != NAT)
+    posts, times = posts[valid], times[valid]
+    order = np.lexsort((times, posts))
+    first_codes, first = np.unique(posts[order], return_index=True)
+    first_times = times[order][first].astype("datetime64[ms]").tolist()
+    return [{"post_id": post_id, "first_engagement_time": moment}
+            for post_id, moment in zip(snapshot.ids.decode(first_codes), first_times)]
+
+
+def top_shared_posts(snapshot, k=10):
+    shares = np.asarray(snapshot.column("posts", "share_count"))
+    top = np.array([row for row in _top_k(shares, k) if shares[row] > 0], dtype=np.int64)
+    post_ids = np.asarray(snapshot.column("posts", "post_id"))[top]
+    return [{"post_id": post_id, "share_count": count}
+            for post_id, count in zip(snapshot.ids.decode(post_ids), shares[top].tolist())]
+
+
+def _top_k(values, k):
+    """Indexes of the k largest values, largest first."""
+    if len(values) <= k:
+        return np.argsort(-values, kind="stable")
+    top = np.argpartition(-values, k)[:k]
+    return top[np.argsort(-values[top], kind="stable")]
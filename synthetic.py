@@ -0,0 +1,250 @@
+"""
+Seeded synthetic dataset shared by the three models.
+
+The same seed always yields the same users, posts, tags, comments, likes,
+shares and timestamps, whichever store loads them. Every column is sampled
+with NumPy for a whole chunk at once: authors and commenters follow a Zipf
+popularity over users, tags a Zipf popularity over TAGS, like counts a heavy
+tail, and text comes from pools generated once per dataset.
+
+Chunks are dicts of equal-length column lists (plain Python values, so the
+drivers can take them as they are). Each chunk draws from its own random
+stream, so chunks can be produced lazily and in any order.
+"""
+import uuid
+
+import numpy as np
+
+CHUNK_SIZE = 10_000
+START = np.datetime64("2024-01-01T00:00:00", "ms")
+SPAN_DAYS = 365
+DAY_MS = 86_400_000
+
+USER_EXPONENT = 1.1     # Zipf exponent of the authors/commenters popularity
+TAG_EXPONENT = 1.2
+LIKE_EXPONENT = 2.2     # like counts are zipf(LIKE_EXPONENT) - 1, about 3 per post
+MAX_LIKES = 5_000
+CONTENT_POOL = 4096
+COMMENT_POOL = 1024
+TITLE_POOL = 1024
+
+VOCABULARY = (
+    "today life good day time people world new love friends family work home music food coffee travel city "
+    "morning night dream goal learn grow share moment story photo video game book movie art design code data "
+    "team project idea future past simple small big best happy great beautiful quiet fresh bright calm strong "
+    "free open real true first last next every always never sometimes finally again together alone journey "
+    "road path step light water sun rain summer winter weekend holiday party game sport run walk read write "
+    "build start finish change focus believe enjoy create explore discover remember forget hope feel think"
+).split()
+TAGS = ("tech", "music", "travel", "food", "sports", "art", "fitness", "gaming", "news", "photography", "fashion",
+        "movies", "books", "science", "nature", "health", "business", "education", "design", "coding", "pets",
+        "cars", "history", "politics", "finance", "comedy", "diy", "cooking", "space", "crypto")
+LANGUAGES = ("ENG", "ESP")
+
+# random streams, one per table and chunk
+_TEXT, _POPULARITY, _USER_IDS, _USERS, _POSTS, _ENGAGEMENT = range(6)
+
+
+def _cdf(count, exponent, rng=None):
+    """Cumulative Zipf weights over `count` items, ranks shuffled when `rng` is given."""
+    ranks = np.arange(1, count + 1, dtype=np.float64)
+    if rng is not None:
+        rng.shuffle(ranks)
+    weights = ranks ** -exponent
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def _uuids(raw):
+    """UUIDs (version 4) from an (n, 16) uint8 array."""
+    raw = raw.copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    data = raw.tobytes()
+    return [uuid.UUID(bytes=data[start:start + 16]) for start in range(0, len(data), 16)]
+
+
+def _datetimes(milliseconds):
+    return milliseconds.astype("datetime64[ms]").tolist()
+
+
+def _split(values, counts):
+    """Lists of consecutive values, one per count."""
+    return [list(part) for part in np.split(values, np.cumsum(counts)[:-1])] if len(counts) else []
+
+
+def _group_positions(counts):
+    """Position of every repeated row within its group, for np.repeat(..., counts)."""
+    total = int(counts.sum())
+    return np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+class SyntheticDataset:
+    def __init__(self, users=1_000, posts=10_000, seed=None, chunk_size=CHUNK_SIZE, start=START, days=SPAN_DAYS):
+        if users < 1 or posts < 0:
+            raise ValueError("A dataset needs at least one user.")
+        # a random dataset can still be reproduced from `dataset.seed`
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy % 2 ** 63)
+        self.n_users = users
+        self.n_posts = posts
+        self.chunk_size = chunk_size
+        self.start = np.datetime64(start, "ms").astype(np.int64)
+        self.span = days * DAY_MS
+
+        rng = self._rng(_TEXT)
+        self.contents = self._sentences(rng, CONTENT_POOL, 12, 40)
+        self.comments = self._sentences(rng, COMMENT_POOL, 4, 16)
+        self.titles = [sentence.capitalize() for sentence in self._sentences(rng, TITLE_POOL, 3, 7)]
+        rng = self._rng(_POPULARITY)
+        self._user_cdf = _cdf(users, USER_EXPONENT, rng)
+        self._tag_cdf = _cdf(len(TAGS), TAG_EXPONENT)
+        self._liker_order = rng.permutation(users)
+        self._user_ids = self._rng(_USER_IDS).integers(0, 256, (users, 16), dtype=np.uint8)
+        self._user_uuids = None
+
+    def _rng(self, stream, chunk=0):
+        return np.random.default_rng([self.seed, stream, chunk])
+
+    @staticmethod
+    def _sentences(rng, count, shortest, longest):
+        lengths = rng.integers(shortest, longest + 1, count)
+        words = np.array(VOCABULARY)[rng.integers(0, len(VOCABULARY), int(lengths.sum()))]
+        return [" ".join(part) + "." for part in np.split(words, np.cumsum(lengths)[:-1])]
+
+    def _chunks(self, total):
+        for chunk, first in enumerate(range(0, total, self.chunk_size)):
+            yield chunk, np.arange(first, min(total, first + self.chunk_size))
+
+    # Users
+
+    def user_ids(self, indexes):
+        # built once, every like, share and comment refers to a user
+        if self._user_uuids is None:
+            self._user_uuids = _uuids(self._user_ids)
+        uuids = self._user_uuids
+        return [uuids[index] for index in np.asarray(indexes).tolist()]
+
+    @staticmethod
+    def usernames(indexes):
+        size = len(VOCABULARY)
+        return [f"{VOCABULARY[index % size]}_{VOCABULARY[(index * 7 + 3) % size]}{index}"
+                for index in np.asarray(indexes).tolist()]
+
+    def _pick_users(self, rng, count):
+        """User indexes drawn by popularity, repeats allowed."""
+        return np.searchsorted(self._user_cdf, rng.random(count), side="right").clip(max=self.n_users - 1)
+
+    def _pick_tags(self, rng, counts):
+        """Tag lists of 1 or more tags drawn by popularity, sorted and without repeats."""
+        flat = np.searchsorted(self._tag_cdf, rng.random(int(counts.sum())), side="right").clip(max=len(TAGS) - 1)
+        return [sorted({TAGS[code] for code in part}) for part in _split(flat, counts)]
+
+    def users(self):
+        """User chunks: profile, Mongo settings and Dgraph usage columns."""
+        for chunk, indexes in self._chunks(self.n_users):
+            rng = self._rng(_USERS, chunk)
+            count = len(indexes)
+            usernames = self.usernames(indexes)
+            daily = rng.lognormal(3.0, 0.8, count)
+            weekly = daily * 7 * rng.uniform(0.6, 1.2, count)
+            monthly = weekly * 4.3 * rng.uniform(0.7, 1.1, count)
+            joined = self.start - rng.integers(0, 3 * 365 * DAY_MS, count)
+            yield {
+                "index": indexes.tolist(),
+                "user_id": self.user_ids(indexes),
+                "username": usernames,
+                "email": [f"{username}@example.com" for username in usernames],
+                "password": [f"pw{index:08d}" for index in indexes.tolist()],
+                "joined_date": _datetimes(joined),
+                "followers_count": np.minimum(rng.zipf(1.6, count) - 1, 1_000_000).tolist(),
+                "following_count": rng.integers(0, 2_000, count).tolist(),
+                "language": np.array(LANGUAGES)[(rng.random(count) < 0.3).astype(np.int64)].tolist(),
+                "notifications": np.where(rng.random(count) < 0.8, "on", "off").tolist(),
+                "interests": self._pick_tags(rng, rng.integers(1, 6, count)),
+                "daily_usage": daily.round(2).tolist(),
+                "weekly_usage": weekly.round(2).tolist(),
+                "monthly_usage": monthly.round(2).tolist(),
+                "yearly_usage": (monthly * 12 * rng.uniform(0.7, 1.1, count)).round(2).tolist(),
+                "last_active": _datetimes(self.start + rng.integers(0, self.span, count)),
+            }
+
+    # Posts and their engagement
+
+    def posts(self):
+        """Post chunks, pass one to `engagement` for its comments, likes and shares."""
+        for chunk, indexes in self._chunks(self.n_posts):
+            rng = self._rng(_POSTS, chunk)
+            count = len(indexes)
+            authors = self._pick_users(rng, count)
+            content = rng.integers(0, CONTENT_POOL, count)
+            titles = rng.integers(0, TITLE_POOL, count)
+            likes = np.minimum(rng.zipf(LIKE_EXPONENT, count) - 1, min(MAX_LIKES, self.n_users))
+            comments = np.minimum(rng.poisson(0.3 * likes + 0.5), MAX_LIKES)
+            shares = rng.binomial(likes, 0.15)
+            timestamps = self.start + rng.integers(0, self.span, count)
+            metric = np.array(("likes", "comments", "shares"))[np.argmax(np.stack([likes, comments, shares]), axis=0)]
+            yield {
+                "chunk": chunk,
+                "index": indexes.tolist(),
+                "post_id": _uuids(rng.integers(0, 256, (count, 16), dtype=np.uint8)),
+                "activity_id": _uuids(rng.integers(0, 256, (count, 16), dtype=np.uint8)),
+                "author": authors.tolist(),
+                "user_id": self.user_ids(authors),
+                "username": self.usernames(authors),
+                "title": [f"{self.titles[title]} #{index}" for title, index in zip(titles.tolist(), indexes.tolist())],
+                "content": [self.contents[code] for code in content.tolist()],
+                "timestamp_ms": timestamps.tolist(),
+                "timestamp": _datetimes(timestamps),
+                "like_count": likes.tolist(),
+                "comment_count": comments.tolist(),
+                "share_count": shares.tolist(),
+                "views": (likes * rng.integers(5, 50, count) + rng.integers(0, 100, count)).tolist(),
+                "retention_time": rng.lognormal(3.0, 1.0, count).round(1).tolist(),
+                "metric": metric.tolist(),
+                "tags": self._pick_tags(rng, rng.integers(1, 6, count)),
+            }
+
+    def _distinct_users(self, rng, counts):
+        """For each count, that many different users, a run of the shuffled user order."""
+        offsets = np.repeat(rng.integers(0, self.n_users, len(counts)), counts)
+        return self._liker_order[(offsets + _group_positions(counts)) % self.n_users]
+
+    def engagement(self, posts):
+        """Comments, likes and shares of a post chunk, each a dict of columns with a `post` row index."""
+        rng = self._rng(_ENGAGEMENT, posts["chunk"])
+        post_times = np.array(posts["timestamp_ms"], dtype=np.int64)
+        result = {}
+        for name in ("likes", "shares"):
+            counts = np.array(posts["like_count" if name == "likes" else "share_count"], dtype=np.int64)
+            rows = np.repeat(np.arange(len(counts)), counts)
+            users = self._distinct_users(rng, counts)
+            # engagement arrives soon after posting, exponentially fewer later
+            times = post_times[rows] + rng.exponential(6 * 3_600_000, len(rows)).astype(np.int64)
+            result[name] = {
+                "post": rows.tolist(),
+                "user": users.tolist(),
+                "user_id": self.user_ids(users),
+                "timestamp": _datetimes(times),
+            }
+        result["likes"]["activity_id"] = _uuids(rng.integers(0, 256, (len(result["likes"]["post"]), 16),
+                                                             dtype=np.uint8))
+        counts = np.array(posts["comment_count"], dtype=np.int64)
+        rows = np.repeat(np.arange(len(counts)), counts)
+        users = self._pick_users(rng, len(rows))
+        # between 1 minute and 24 hours after the post
+        times = post_times[rows] + rng.integers(60_000, DAY_MS, len(rows))
+        result["comments"] = {
+            "post": rows.tolist(),
+            "user": users.tolist(),
+            "user_id": self.user_ids(users),
+            "comment_id": _uuids(rng.integers(0, 256, (len(rows), 16), dtype=np.uint8)),
+            "activity_id": _uuids(rng.integers(0, 256, (len(rows), 16), dtype=np.uint8)),
+            "content": [self.comments[code] for code in rng.integers(0, COMMENT_POOL, len(rows)).tolist()],
+            "timestamp": _datetimes(times),
+        }
+        return result
+
+
+def rows(columns, names):
+    """Tuples of the named columns of a chunk."""
+    return zip(*(columns[name] for name in names))
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+LATEST_POSTS = 1000
+MAX_PAGES = 1024
+TTL_SECONDS = 60
+
+
+class Timeline:
+    """
+    Home timeline: the newest posts, the reader's own left out.
+
+    The newest `latest` posts are kept in memory, newest first, and pages are
+    cut from them, so a read only reaches the posts collection when the list
+    runs out before the page is full. Pages are kept in an LRU of `max_pages`
+    entries. Posts added or removed through the model update the list in
+    place and drop the pages they change, other writes call clear(). Writes
+    made by other processes are picked up when the list is reloaded, every
+    `ttl` seconds. Every value can be overridden through TIMELINE_LATEST,
+    TIMELINE_PAGES and TIMELINE_TTL.
+    """
+
+    def __init__(self, newest, latest=None, max_pages=None, ttl=None):
+        # newest(limit, exclude=None) returns the newest posts, the posts of `exclude` left out
+        self.newest = newest
+        self.latest = latest or int(os.getenv("TIMELINE_LATEST", LATEST_POSTS))
+        self.max_pages = max_pages or int(os.getenv("TIMELINE_PAGES", MAX_PAGES))
+        self.ttl = ttl if ttl is not None else float(os.getenv("TIMELINE_TTL", TTL_SECONDS))
+        self.hits = 0
+        self.misses = 0
+        self._posts = None       # newest first
+        self._complete = False   # the list holds every post
+        self._expires_at = 0
+        self._pages = OrderedDict()  # (username, limit) -> posts
+        self._generation = 0     # bumped by every change, pages read meanwhile are not kept
+        self._lock = threading.Lock()
+
+    def page(self, username, limit=10):
+        """The `limit` newest posts not written by `username`."""
+        key = (username, limit)
+        with self._lock:
+            self._load()
+            posts = self._pages.get(key)
+            if posts is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return list(posts)
+            self.misses += 1
+            posts = [post for post in self._posts if post["username"] != username][:limit]
+            if len(posts) == limit or self._complete:
+                self._remember(key, posts)
+                return list(posts)
+            generation = self._generation
+        # the list ran out, older posts come from the collection
+        posts = self.newest(limit, exclude=username)
+        with self._lock:
+            if generation == self._generation:
+                self._remember(key, posts)
+        return list(posts)
+
+    def added(self, post):
+        post = {name: value for name, value in post.items() if name != "_id"}
+        with self._lock:
+            self._generation += 1
+            if self._posts is None:
+                return
+            # only the author's own pages stay the same
+            for key in [key for key in self._pages if key[0] != post["username"]]:
+                del self._pages[key]
+            position = 0
+            while position < len(self._posts) and self._posts[position]["creation_date"] > post["creation_date"]:
+                position += 1
+            # a post older than every one kept stays out of the list
+            if position < len(self._posts) or self._complete:
+                self._posts.insert(position, post)
+                if len(self._posts) > self.latest:
+                    self._posts.pop()
+                    self._complete = False
+
+    def removed(self, title):
+        with self._lock:
+            self._generation += 1
+            if self._posts is None:
+                return
+            self._posts = [post for post in self._posts if post["title"] != title]
+            if len(self._posts) < self.latest // 2 and not self._complete:
+                self._expires_at = 0  # reload once too many posts are gone
+            for key in [key for key, posts in self._pages.items() if any(post["title"] == title for post in posts)]:
+                del self._pages[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._posts = None
+            self._pages.clear()
+
+    def _load(self):
+        now = time.monotonic()
+        if self._posts is not None and now < self._expires_at:
+            return
+        self._posts = self.newest(self.latest)
+        self._complete = len(self._posts) < self.latest
+        self._expires_at = now + self.ttl
+        self._generation += 1
+        self._pages.clear()
+
+    def _remember(self, key, posts):
+        self._pages[key] = posts
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)